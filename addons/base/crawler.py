@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Concurrent crawler for addon file trees.
+
+Folder listings are fetched from WaterButler by a bounded pool of threads and
+throttled by a token bucket, instead of one request at a time with a fixed
+sleep in between. Worker threads only make HTTP requests; anything that needs
+the database (cookies, WaterButler URLs) is resolved by the caller beforehand.
+"""
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+
+import requests
+
+from framework.exceptions import HTTPError
+from website import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Allow ``rate`` acquisitions per second on average, in bursts of up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, blocking until one is available. Return the seconds waited."""
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def get_crawl_limits(provider):
+    limits = dict(settings.ARCHIVER_CRAWL_LIMITS['default'])
+    limits.update(settings.ARCHIVER_CRAWL_LIMITS.get(provider, {}))
+    return limits
+
+
+class FileTreeCrawler(object):
+    """Build the nested file tree of ``addon`` below a folder, as
+    ``BaseStorageAddon._get_file_tree`` returns it.
+
+    :param fetch_children: Callable taking a folder's metadata and returning the metadata of
+        its children; called from worker threads
+    :param str provider: Short name of the addon, used to look up crawl limits
+    """
+
+    def __init__(self, fetch_children, provider, concurrency=None, rate=None, max_retries=None, backoff=None):
+        limits = get_crawl_limits(provider)
+        self.fetch_children = fetch_children
+        self.provider = provider
+        self.concurrency = concurrency or limits['concurrency']
+        self.bucket = TokenBucket(rate or limits['rate'])
+        self.max_retries = max_retries if max_retries is not None else settings.ARCHIVER_CRAWL_MAX_RETRIES
+        self.backoff = backoff if backoff is not None else settings.ARCHIVER_CRAWL_BACKOFF
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'folders': 0,
+            'files': 0,
+            'throttled_seconds': 0.0,
+            'seconds': 0.0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, HTTPError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def _fetch(self, filenode):
+        """Fetch the children of ``filenode``, retrying transient failures with exponential backoff."""
+        attempt = 0
+        while True:
+            self._count('throttled_seconds', self.bucket.acquire())
+            self._count('requests')
+            try:
+                return self.fetch_children(filenode)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning('Retrying {} listing of {} in {}s: {!r}'.format(self.provider, filenode.get('path'), delay, e))
+                self._count('retries')
+                attempt += 1
+                time.sleep(delay)
+
+    def _fetch_into(self, results, filenode):
+        try:
+            results.put((filenode, self._fetch(filenode), None))
+        except Exception as e:
+            results.put((filenode, None, e))
+
+    def crawl(self, filenode):
+        """Fill in the ``children`` of ``filenode`` and of every folder below it. Return ``filenode``.
+        The first error raised by a listing is re-raised once in-flight requests are done.
+        """
+        start = time.time()
+        results = Queue()
+        pool = ThreadPool(self.concurrency)
+        pending = 1
+        error = None
+        try:
+            pool.apply_async(self._fetch_into, (results, filenode))
+            while pending:
+                folder, children, e = results.get()
+                pending -= 1
+                self.stats['folders'] += 1
+                if e is not None:
+                    error = error or e
+                    continue
+                if error is not None:
+                    continue
+                folder['children'] = children
+                for child in children:
+                    if child.get('kind') == 'file':
+                        self.stats['files'] += 1
+                    else:
+                        pending += 1
+                        pool.apply_async(self._fetch_into, (results, child))
+        finally:
+            pool.close()
+            pool.join()
+            self.stats['seconds'] = time.time() - start
+        if error is not None:
+            raise error
+        return filenode
@@ -1,6 +1,5 @@
 import abc
 import os
-import time
 
 import markupsafe
 import requests
@@ -16,6 +15,7 @@ from osf.models.user import OSFUser
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 from website import settings
 from addons.base import logger, serializer
+from addons.base.crawler import FileTreeCrawler
 from website.oauth.signals import oauth_complete
 
 lookup = TemplateLookup(
@@ -547,6 +547,8 @@ class BaseStorageAddon(object):
     """
 
     root_node = GenericRootNode()
+    # Stats of the last file tree crawl
+    crawl_stats = None
 
     class Meta:
         abstract = True
@@ -559,7 +561,7 @@ class BaseStorageAddon(object):
             name = name + ': {folder}'.format(folder=folder_name)
         return name
 
-    def _get_fileobj_child_metadata(self, filenode, user, cookie=None, version=None):
+    def _get_fileobj_child_metadata(self, filenode, user, cookie=None, version=None, base_url=None):
         from api.base.utils import waterbutler_api_url_for
 
         kwargs = {}
@@ -577,17 +579,19 @@ class BaseStorageAddon(object):
             user=user,
             view_only=True,
             _internal=True,
-            base_url=self.owner.osfstorage_region.waterbutler_url,
+            base_url=base_url or self.owner.osfstorage_region.waterbutler_url,
             **kwargs
         )
 
         res = requests.get(metadata_url)
 
         if res.status_code != 200:
-            raise HTTPError(res.status_code, data={'error': res.json()})
-
-        # TODO: better throttling?
-        time.sleep(1.0 / 5.0)
+            try:
+                error = res.json()
+            except ValueError:
+                # e.g. an HTML error page from a proxy in front of WaterButler
+                error = res.text
+            raise HTTPError(res.status_code, data={'error': error})
 
         data = res.json().get('data', None)
         if data:
@@ -596,7 +600,8 @@ class BaseStorageAddon(object):
 
     def _get_file_tree(self, filenode=None, user=None, cookie=None, version=None):
         """
-        Recursively get file metadata
+        Recursively get file metadata. Folders are listed concurrently, see
+        ``addons.base.crawler.FileTreeCrawler``; its stats are kept in ``crawl_stats``.
         """
         filenode = filenode or {
             'path': '/',
@@ -606,15 +611,20 @@ class BaseStorageAddon(object):
         if filenode.get('kind') == 'file':
             return filenode
 
+        # Listings are fetched from worker threads, which must not query the database
         kwargs = {
             'version': version,
-            'cookie': cookie,
+            'cookie': cookie or (user.get_or_create_cookie() if user else None),
+            'base_url': self.owner.osfstorage_region.waterbutler_url,
         }
-        filenode['children'] = [
-            self._get_file_tree(child, user, cookie=cookie)
-            for child in self._get_fileobj_child_metadata(filenode, user, **kwargs)
-        ]
-        return filenode
+        crawler = FileTreeCrawler(
+            lambda folder: self._get_fileobj_child_metadata(folder, user, **kwargs),
+            self.config.short_name,
+        )
+        try:
+            return crawler.crawl(filenode)
+        finally:
+            self.crawl_stats = crawler.stats
 
 
 class BaseOAuthNodeSettings(BaseNodeSettings):
@@ -46,6 +46,7 @@ from website.profile.utils import get_profile_image_url
 from website.project import decorators
 from website.project.decorators import must_be_contributor_or_public, must_be_valid_project, check_contributor_auth
 from website.ember_osf_web.decorators import ember_flag_is_active
+from website.files.metadata_cache import metadata_cache
 from website.project.utils import serialize_node
 from website.util import rubeus
 
@@ -414,6 +415,8 @@ def create_waterbutler_log(payload, **kwargs):
 
         auth = Auth(user=user)
         node = kwargs.get('node') or kwargs.get('project') or Preprint.load(kwargs.get('nid')) or Preprint.load(kwargs.get('pid'))
+        # WaterButler has already applied the change, so cached listings are stale
+        metadata_cache.invalidate_for_payload(node._id, payload)
 
         if action in (NodeLog.FILE_MOVED, NodeLog.FILE_COPIED):
 
@@ -146,9 +146,9 @@ class NodeSettings(BaseOAuthNodeSettings, BaseStorageAddon):
                 auth=auth,
             )
 
-    def _get_fileobj_child_metadata(self, filenode, user, cookie=None, version=None):
+    def _get_fileobj_child_metadata(self, filenode, user, cookie=None, version=None, base_url=None):
         try:
-            return super(NodeSettings, self)._get_fileobj_child_metadata(filenode, user, cookie=cookie, version=version)
+            return super(NodeSettings, self)._get_fileobj_child_metadata(filenode, user, cookie=cookie, version=version, base_url=base_url)
         except HTTPError as e:
             # The Dataverse API returns a 404 if the dataset has no published files
             if e.code == http.NOT_FOUND and version == 'latest-published':
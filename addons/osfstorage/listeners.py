@@ -13,7 +13,10 @@ from framework.postcommit_tasks.handlers import enqueue_postcommit_task
 def checkin_files_by_user(node, user):
     """ Listens to a contributor being removed to check in all of their files
     """
-    node.files.filter(checkout=user).update(checkout=None)
+    OsfStorageFileNode = apps.get_model('osf.OsfStorageFileNode')
+    checked_out = list(node.files.filter(checkout=user).values_list('id', flat=True))
+    node.files.filter(id__in=checked_out).update(checkout=None)
+    OsfStorageFileNode.adjust_checkout_counts(checked_out, -1)
 
 
 @node_deleted.connect
@@ -3,9 +3,8 @@ from __future__ import unicode_literals
 import logging
 
 from django.apps import apps
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.contrib.contenttypes.models import ContentType
-from psycopg2._psycopg import AsIs
 
 from addons.base.models import BaseNodeSettings, BaseStorageAddon, BaseUserSettings
 from osf.utils.fields import EncryptedJSONField
@@ -13,7 +12,7 @@ from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 from osf.exceptions import InvalidTagError, NodeStateError, TagNotFoundError
 from framework.auth.core import Auth
 from osf.models.mixins import Loggable
-from osf.models import AbstractNode
+from osf.models import AbstractNode, StorageUsage
 from osf.models.files import File, FileVersion, Folder, TrashedFileNode, BaseFileNode, BaseFileNodeManager
 from osf.utils import permissions
 from website.files import exceptions
@@ -39,44 +38,125 @@ class OsfStorageFolderManager(BaseFileNodeManager):
 class OsfStorageFileNode(BaseFileNode):
     _provider = 'osfstorage'
 
+    # Computes the materialized path of one or more file nodes from their ancestry
+    MATERIALIZED_PATH_SQL = """
+        WITH RECURSIVE materialized_path_cte(start_id, parent_id, GEN_PATH) AS (
+          SELECT
+            T.id,
+            T.parent_id,
+            T.name :: TEXT AS GEN_PATH
+          FROM "{table}" AS T
+          WHERE T.id = ANY(%s)
+          UNION ALL
+          SELECT
+            R.start_id,
+            T.parent_id,
+            (T.name || '/' || R.GEN_PATH) AS GEN_PATH
+          FROM materialized_path_cte AS R
+            JOIN "{table}" AS T ON T.id = R.parent_id
+          WHERE R.parent_id IS NOT NULL
+        )
+        SELECT start_id, gen_path
+        FROM materialized_path_cte AS N
+        WHERE parent_id IS NULL;
+    """
+
+    # Rewrites the stored materialized paths below a folder from the folder's path
+    DESCENDANT_PATHS_SQL = """
+        WITH RECURSIVE subtree(id, path) AS (
+            SELECT %(id)s, %(path)s :: TEXT
+          UNION ALL
+            SELECT
+              T.id,
+              S.path || T.name || CASE WHEN T.type = ANY(%(folder_types)s) THEN '/' ELSE '' END
+            FROM subtree AS S
+              JOIN "{table}" AS T ON T.parent_id = S.id
+        )
+        UPDATE "{table}" AS T
+        SET _materialized_path = S.path
+        FROM subtree AS S
+        WHERE T.id = S.id AND S.id != %(id)s AND T._materialized_path IS DISTINCT FROM S.path;
+    """
+
+    # Adds a delta to the checkout counts of the given file nodes and all of their ancestors
+    ADJUST_CHECKOUT_COUNTS_SQL = """
+        WITH RECURSIVE ancestors(id, parent_id) AS (
+            SELECT T.id, T.parent_id
+            FROM "{table}" AS T
+            WHERE T.id = ANY(%(ids)s)
+          UNION ALL
+            SELECT T.id, T.parent_id
+            FROM ancestors AS A
+              JOIN "{table}" AS T ON T.id = A.parent_id
+        )
+        UPDATE "{table}" AS T
+        SET checkout_count = T.checkout_count + %(delta)s * A.n
+        FROM (SELECT id, COUNT(*) AS n FROM ancestors GROUP BY id) AS A
+        WHERE T.id = A.id AND T.type = %(folder_type)s;
+    """
+
+    # Lists the files below a folder that are trashed, or not trashed, like the folder itself
+    SUBTREE_FILES_SQL = """
+        WITH RECURSIVE subtree(id, type) AS (
+            SELECT T.id, T.type
+            FROM "{table}" AS T
+            WHERE T.parent_id = %(id)s AND (T.type = ANY(%(trashed_types)s)) = %(trashed)s
+          UNION ALL
+            SELECT T.id, T.type
+            FROM subtree AS S
+              JOIN "{table}" AS T ON T.parent_id = S.id
+            WHERE (T.type = ANY(%(trashed_types)s)) = %(trashed)s
+        )
+        SELECT id FROM subtree WHERE NOT type = ANY(%(folder_types)s);
+    """
+
+    # Trashed OsfStorage file nodes store the path that was computed while they were live
+    TRASHED_PATH_SQL = "'/' || T._id || CASE WHEN T.type = ANY(%(folder_types)s) THEN '/' ELSE '' END"
+    # Live OsfStorage file nodes store an empty path, see save
+    RESTORED_PATH = ''
+
     @property
     def materialized_path(self):
-        sql = """
-            WITH RECURSIVE materialized_path_cte(parent_id, GEN_PATH) AS (
-              SELECT
-                T.parent_id,
-                T.name :: TEXT AS GEN_PATH
-              FROM %s AS T
-              WHERE T.id = %s
-              UNION ALL
-              SELECT
-                T.parent_id,
-                (T.name || '/' || R.GEN_PATH) AS GEN_PATH
-              FROM materialized_path_cte AS R
-                JOIN %s AS T ON T.id = R.parent_id
-              WHERE R.parent_id IS NOT NULL
-            )
-            SELECT gen_path
-            FROM materialized_path_cte AS N
-            WHERE parent_id IS NULL
-            LIMIT 1;
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [AsIs(self._meta.db_table), self.pk, AsIs(self._meta.db_table)])
-            row = cursor.fetchone()
-            if not row:
-                return '/'
-
-            path = row[0]
-            if not self.is_file:
-                path = path + '/'
-            return path
+        if self._materialized_path:
+            return self._materialized_path
+        # Rows saved before paths were stored
+        return self.resolve_materialized_paths([self]).get(self.pk, '/')
 
     @materialized_path.setter
     def materialized_path(self, val):
         # raise Exception('Cannot set materialized path on OSFStorage as it is computed.')
         logger.warn('Cannot set materialized path on OSFStorage because it\'s computed.')
 
+    @classmethod
+    def resolve_materialized_paths(cls, file_nodes):
+        """Compute the materialized paths of ``file_nodes`` from their ancestry in one query,
+        ignoring stored paths. Returns a dict of paths by pk.
+        """
+        file_nodes = [file_node for file_node in file_nodes if file_node.pk]
+        if not file_nodes:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(cls.MATERIALIZED_PATH_SQL.format(table=cls._meta.db_table), [[each.pk for each in file_nodes]])
+            paths = dict(cursor.fetchall())
+        return {
+            each.pk: paths[each.pk] if each.is_file else paths[each.pk] + '/'
+            for each in file_nodes if each.pk in paths
+        }
+
+    def _compute_materialized_path(self):
+        if self.parent_id is None:
+            return '/'
+        path = (self.parent.materialized_path or '/') + self.name
+        return path if self.is_file else path + '/'
+
+    def _update_descendant_paths(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.DESCENDANT_PATHS_SQL.format(table=self._meta.db_table), {
+                'id': self.pk,
+                'path': self._materialized_path,
+                'folder_types': BaseFileNode.get_folder_types(),
+            })
+
     @classmethod
     def get(cls, _id, target):
         return cls.objects.get(_id=_id, target_object_id=target.id, target_content_type=ContentType.objects.get_for_model(target))
@@ -97,32 +177,30 @@ class OsfStorageFileNode(BaseFileNode):
 
     @classmethod
     def get_file_guids(cls, materialized_path, provider, target=None):
-        guids = []
         path = materialized_path.strip('/')
         file_obj = cls.load(path)
         if not file_obj:
             file_obj = TrashedFileNode.load(path)
 
         # At this point, file_obj may be an OsfStorageFile, an OsfStorageFolder, or a
-        # TrashedFileNode. TrashedFileNodes do not have *File and *Folder subclasses, since
-        # only osfstorage trashes folders. To search for children of TrashFileNodes
-        # representing ex-OsfStorageFolders, we will reimplement the `children` method of the
-        # Folder class here.
-        if not file_obj.is_file:
-            children = []
-            if isinstance(file_obj, TrashedFileNode):
-                children = file_obj.trashed_children.all()
-            else:
-                children = file_obj.children
+        # TrashedFileNode.
+        return sorted(cls.get_file_guid_ids(cls.subtree_file_ids(file_obj)))
 
-            for item in children:
-                guids.extend(cls.get_file_guids(item.path, provider, target=target))
-        else:
-            guid = file_obj.get_guid()
-            if guid:
-                guids.append(guid._id)
-
-        return sorted(guids)
+    @classmethod
+    def subtree_file_ids(cls, file_obj):
+        """Return the pks of ``file_obj`` if it is a file, or of the files below it. The files below
+        a live folder are its live descendants; the files below a trashed folder are its trashed descendants.
+        """
+        if file_obj.is_file:
+            return [file_obj.pk]
+        with connection.cursor() as cursor:
+            cursor.execute(cls.SUBTREE_FILES_SQL.format(table=cls._meta.db_table), {
+                'id': file_obj.pk,
+                'trashed_types': TrashedFileNode._typedmodels_subtypes,
+                'trashed': isinstance(file_obj, TrashedFileNode),
+                'folder_types': BaseFileNode.get_folder_types(),
+            })
+            return [row[0] for row in cursor.fetchall()]
 
     @property
     def kind(self):
@@ -169,11 +247,17 @@ class OsfStorageFileNode(BaseFileNode):
                 raise exceptions.FileNodeIsPrimaryFile()
         if self.is_checked_out:
             raise exceptions.FileNodeCheckedOutError()
-        most_recent_fileversion = self.versions.select_related('region').order_by('-created').first()
-        if most_recent_fileversion and most_recent_fileversion.region != destination_parent.target.osfstorage_region:
-            most_recent_fileversion.region = destination_parent.target.osfstorage_region
-            most_recent_fileversion.save()
-        return super(OsfStorageFileNode, self).move_under(destination_parent, name)
+        # Moves change the node, and for files the region, that stored bytes count towards
+        moved_ids = self.subtree_file_ids(self) if self.is_file or self.target != destination_parent.target else []
+        with transaction.atomic():
+            StorageUsage.adjust_for_files(moved_ids, usage_sign=-1)
+            most_recent_fileversion = self.versions.select_related('region').order_by('-created').first()
+            if most_recent_fileversion and most_recent_fileversion.region != destination_parent.target.osfstorage_region:
+                most_recent_fileversion.region = destination_parent.target.osfstorage_region
+                most_recent_fileversion.save()
+            moved = super(OsfStorageFileNode, self).move_under(destination_parent, name)
+            StorageUsage.adjust_for_files(moved_ids, usage_sign=1)
+        return moved
 
     def check_in_or_out(self, user, checkout, save=False):
         """
@@ -227,10 +311,68 @@ class OsfStorageFileNode(BaseFileNode):
             if save:
                 self.save()
 
+    @classmethod
+    def adjust_checkout_counts(cls, ids, delta):
+        """Add ``delta`` to the checkout counts of the folders containing the file nodes ``ids``,
+        and of those file nodes themselves if they are folders.
+        """
+        ids = [each for each in ids if each is not None]
+        if not ids or not delta:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(cls.ADJUST_CHECKOUT_COUNTS_SQL.format(table=cls._meta.db_table), {
+                'ids': ids,
+                'delta': delta,
+                'folder_type': OsfStorageFolder._typedmodels_type,
+            })
+
+    def _checkout_weight(self, checkout_id, checkout_count):
+        """Number of checked out file nodes in the subtree rooted at this file node"""
+        if self.is_file:
+            return 1 if checkout_id else 0
+        return checkout_count or 0
+
     def save(self):
         self._path = ''
-        self._materialized_path = ''
-        return super(OsfStorageFileNode, self).save()
+        self._materialized_path = self._compute_materialized_path()
+        if not self.pk:
+            # Clones carry over the counter of their source
+            self.checkout_count = 0
+            ret = super(OsfStorageFileNode, self).save()
+            if self.checkout_id:
+                self.adjust_checkout_counts([self.pk], 1)
+                if not self.is_file:
+                    self.checkout_count = 1
+            return ret
+
+        with transaction.atomic():
+            previous = BaseFileNode.objects.select_for_update().filter(id=self.pk).values(
+                'parent_id', 'checkout_id', 'checkout_count', '_materialized_path'
+            ).first()
+            if previous is None:
+                return super(OsfStorageFileNode, self).save()
+
+            # Checkout counts are only ever changed in place, so a stale instance must not write them back
+            ret = super(OsfStorageFileNode, self).save(update_fields=[
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'checkout_count'
+            ])
+            self.checkout_count = previous['checkout_count']
+
+            moved_weight = self._checkout_weight(previous['checkout_id'], previous['checkout_count'])
+            if previous['parent_id'] != self.parent_id and moved_weight:
+                self.adjust_checkout_counts([previous['parent_id']], -moved_weight)
+                self.adjust_checkout_counts([self.parent_id], moved_weight)
+            delta = bool(self.checkout_id) - bool(previous['checkout_id'])
+            if delta:
+                self.adjust_checkout_counts([self.pk], delta)
+                if not self.is_file:
+                    self.checkout_count += delta
+
+            # Renaming or moving a folder changes the paths of everything below it
+            if not self.is_file and previous['_materialized_path'] != self._materialized_path:
+                self._update_descendant_paths()
+        return ret
 
 
 class OsfStorageFile(OsfStorageFileNode, File):
@@ -306,6 +448,8 @@ class OsfStorageFile(OsfStorageFileNode, File):
         version.save()
         self.versions.add(version)
         self.save()
+        if isinstance(self.target, AbstractNode):
+            StorageUsage.adjust(self.target.id, version.region_id, usage=max(version.size or 0, 0))
 
         return version
 
@@ -399,38 +543,58 @@ class OsfStorageFolder(OsfStorageFileNode, Folder):
 
     objects = OsfStorageFolderManager()
 
+    # Number of checked out file nodes in this folder's subtree, including the folder itself.
+    # Maintained by OsfStorageFileNode.save and adjust_checkout_counts
+    checkout_count = models.IntegerField(default=0)
+
+    # Lists folders whose checkout count differs from the checked out file nodes below them
+    CHECKOUT_COUNT_DRIFT_SQL = """
+        WITH RECURSIVE ancestors(id, parent_id) AS (
+            SELECT T.id, T.parent_id
+            FROM "{table}" AS T
+            WHERE T.checkout_id IS NOT NULL
+          UNION ALL
+            SELECT T.id, T.parent_id
+            FROM ancestors AS A
+              JOIN "{table}" AS T ON T.id = A.parent_id
+        ), expected AS (
+            SELECT id, COUNT(*) AS n FROM ancestors GROUP BY id
+        )
+        SELECT F.id, F.checkout_count, COALESCE(E.n, 0)
+        FROM "{table}" AS F
+          LEFT JOIN expected AS E ON E.id = F.id
+        WHERE F.type = %s AND F.checkout_count IS DISTINCT FROM COALESCE(E.n, 0);
+    """
+
     @property
     def is_checked_out(self):
-        sql = """
-            WITH RECURSIVE is_checked_out_cte(id, parent_id, checkout_id) AS (
-              SELECT
-                T.id,
-                T.parent_id,
-                T.checkout_id
-              FROM %s AS T
-              WHERE T.id = %s
-              UNION ALL
-              SELECT
-                T.id,
-                T.parent_id,
-                T.checkout_id
-              FROM is_checked_out_cte AS R
-                JOIN %s AS T ON T.parent_id = R.id
-            )
-            SELECT N.checkout_id
-            FROM is_checked_out_cte as N
-            WHERE N.checkout_id IS NOT NULL
-            LIMIT 1;
+        return self.checkout_count > 0
+
+    def _lock_checkout_count(self):
+        """Reload the checkout count under a row lock; must be called in a transaction.
+        The count changes whenever anything below this folder is checked in or out.
         """
+        if self.pk:
+            self.checkout_count = type(self).objects.select_for_update().values_list(
+                'checkout_count', flat=True
+            ).get(pk=self.pk)
 
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [AsIs(self._meta.db_table), self.pk, AsIs(self._meta.db_table)])
-            row = cursor.fetchone()
+    def delete(self, user=None, parent=None, **kwargs):
+        with transaction.atomic():
+            self._lock_checkout_count()
+            return super(OsfStorageFolder, self).delete(user=user, parent=parent, **kwargs)
 
-            if row and row[0]:
-                return True
+    def move_under(self, destination_parent, name=None):
+        with transaction.atomic():
+            self._lock_checkout_count()
+            return super(OsfStorageFolder, self).move_under(destination_parent, name)
 
-        return False
+    @classmethod
+    def checkout_count_drift(cls):
+        """Return ``(id, stored, expected)`` for every folder whose checkout count has drifted."""
+        with connection.cursor() as cursor:
+            cursor.execute(cls.CHECKOUT_COUNT_DRIFT_SQL.format(table=cls._meta.db_table), [cls._typedmodels_type])
+            return cursor.fetchall()
 
     @property
     def is_preprint_primary(self):
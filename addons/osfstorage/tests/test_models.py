@@ -5,6 +5,8 @@ import unittest
 
 import pytest
 import pytz
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from nose.tools import *  # noqa
 
@@ -12,7 +14,7 @@ from framework.auth import Auth
 from addons.osfstorage.models import OsfStorageFile, OsfStorageFileNode, OsfStorageFolder
 from osf.exceptions import ValidationError
 from osf.utils.fields import EncryptedJSONField
-from osf_tests.factories import ProjectFactory, UserFactory, PreprintFactory, RegionFactory, NodeFactory
+from osf_tests.factories import CommentFactory, ProjectFactory, UserFactory, PreprintFactory, RegionFactory, NodeFactory
 
 from addons.osfstorage.tests import factories
 from addons.osfstorage.tests.utils import StorageTestCase
@@ -186,6 +188,7 @@ class TestOsfstorageFileNode(StorageTestCase):
         utils.update_analytics(self.project, child._id, 0)
         utils.update_analytics(self.project, child._id, 1)
         utils.update_analytics(self.project, child._id, 2)
+        models.PageCounter.rollup()
 
         assert_equals(child.get_download_count(), 3)
         assert_equals(child.get_download_count(0), 1)
@@ -222,6 +225,71 @@ class TestOsfstorageFileNode(StorageTestCase):
                 None
             )
 
+    def test_delete_folder_subtree(self):
+        parent = self.node_settings.get_root().append_folder('Test')
+        subfolder = parent.append_folder('Nested')
+        kid = subfolder.append_file('Kid')
+
+        parent.delete(user=self.user)
+
+        trashed_subfolder = models.TrashedFileNode.load(subfolder._id)
+        trashed_kid = models.TrashedFileNode.load(kid._id)
+        assert_true(isinstance(trashed_subfolder, models.TrashedFolder))
+        assert_true(isinstance(trashed_kid, models.TrashedFile))
+        assert_equal(trashed_kid.deleted_by, self.user)
+        assert_equal(trashed_kid.deleted_on, parent.deleted_on)
+        assert_equal(trashed_kid.path, '/' + kid._id)
+        assert_equal(trashed_subfolder.path, '/' + subfolder._id + '/')
+        assert_equal(trashed_kid.materialized_path, '/Test/Nested/Kid')
+
+    def test_delete_folder_detaches_comments(self):
+        parent = self.node_settings.get_root().append_folder('Test')
+        kid = parent.append_file('Kid')
+        comment = CommentFactory(node=self.project, target=kid.get_guid(create=True), user=self.user)
+
+        parent.delete(user=self.user)
+
+        comment.reload()
+        assert_is(comment.root_target, None)
+
+    def test_delete_folder_query_count_does_not_grow_with_files(self):
+        root = self.node_settings.get_root()
+        query_counts = []
+        for size in (1, 10):
+            parent = root.append_folder('Test {}'.format(size))
+            for x in range(size):
+                parent.append_folder(str(x)).append_file(str(x))
+            with mock.patch('website.search.search.bulk_update_files'), CaptureQueriesContext(connection) as queries:
+                parent.delete()
+            query_counts.append(len(queries))
+        assert_equal(query_counts[0], query_counts[1])
+
+    def test_restore_folder_subtree(self):
+        parent = self.node_settings.get_root().append_folder('Test')
+        subfolder = parent.append_folder('Nested')
+        kid = subfolder.append_file('Kid')
+        trashed = parent.delete()
+
+        trashed.restore()
+
+        assert_true(isinstance(OsfStorageFileNode.load(parent._id), OsfStorageFolder))
+        assert_true(isinstance(OsfStorageFileNode.load(subfolder._id), OsfStorageFolder))
+        restored_kid = OsfStorageFileNode.load(kid._id)
+        assert_true(isinstance(restored_kid, OsfStorageFile))
+        assert_equal(restored_kid.materialized_path, '/Test/Nested/Kid')
+        assert_equal(restored_kid._path, '')
+        assert_equal(OsfStorageFileNode.load(subfolder._id)._path, '')
+
+    def test_restore_folder_skips_separately_deleted_children(self):
+        parent = self.node_settings.get_root().append_folder('Test')
+        deleted_earlier = parent.append_file('Earlier')
+        deleted_earlier.delete()
+        trashed = parent.delete()
+
+        trashed.restore()
+
+        assert_true(isinstance(models.BaseFileNode.load(deleted_earlier._id), models.TrashedFile))
+
     def test_delete_file(self):
         child = self.node_settings.get_root().append_file('Test')
         field_names = [f.name for f in child._meta.get_fields() if not f.is_relation and f.name not in ['id', 'content_type_pk']]
@@ -295,6 +363,53 @@ class TestOsfstorageFileNode(StorageTestCase):
         child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
         assert_equals('/Cloud/Carp', child.materialized_path)
 
+    def test_materialized_path_is_stored(self):
+        child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
+        child.reload()
+        assert_equals('/Cloud/Carp', child._materialized_path)
+
+    def test_materialized_path_legacy_row(self):
+        child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
+        models.BaseFileNode.objects.filter(id=child.id).update(_materialized_path='')
+        child.reload()
+        assert_equals('/Cloud/Carp', child.materialized_path)
+
+    def test_rename_folder_updates_descendant_paths(self):
+        folder = self.node_settings.get_root().append_folder('Cloud')
+        subfolder = folder.append_folder('Sea')
+        child = subfolder.append_file('Carp')
+        folder.name = 'Sky'
+        folder.save()
+        subfolder.reload()
+        child.reload()
+        assert_equals('/Sky/Sea/', subfolder._materialized_path)
+        assert_equals('/Sky/Sea/Carp', child._materialized_path)
+
+    def test_move_folder_updates_descendant_paths(self):
+        root = self.node_settings.get_root()
+        destination = root.append_folder('Sky')
+        folder = root.append_folder('Cloud')
+        child = folder.append_file('Carp')
+        folder.move_under(destination)
+        child.reload()
+        assert_equals('/Sky/Cloud/Carp', child._materialized_path)
+
+    def test_resolve_materialized_paths(self):
+        folder = self.node_settings.get_root().append_folder('Cloud')
+        child = folder.append_file('Carp')
+        models.BaseFileNode.objects.filter(id__in=[folder.id, child.id]).update(_materialized_path='/stale')
+        paths = OsfStorageFileNode.resolve_materialized_paths([folder, child])
+        assert_equals({folder.id: '/Cloud/', child.id: '/Cloud/Carp'}, paths)
+
+    def test_check_materialized_paths_repairs_drift(self):
+        from osf.management.commands.check_osfstorage_materialized_paths import check_materialized_paths
+        child = self.node_settings.get_root().append_folder('Cloud').append_file('Carp')
+        models.BaseFileNode.objects.filter(id=child.id).update(_materialized_path='/stale')
+        assert_equals(1, check_materialized_paths(repair=True))
+        child.reload()
+        assert_equals('/Cloud/Carp', child._materialized_path)
+        assert_equals(0, check_materialized_paths())
+
     def test_copy(self):
         to_copy = self.node_settings.get_root().append_file('Carp')
         copy_to = self.node_settings.get_root().append_folder('Cloud')
@@ -333,6 +448,19 @@ class TestOsfstorageFileNode(StorageTestCase):
         assert_equal(new_project, move_to.target)
         assert_equal(new_project, child.target)
 
+    def test_move_across_nodes_query_count_does_not_grow_with_files(self):
+        move_to = ProjectFactory().get_addon('osfstorage').get_root()
+        query_counts = []
+        for size in (1, 10):
+            to_move = self.node_settings.get_root().append_folder('Carp {}'.format(size))
+            for i in range(size):
+                to_move.append_folder(str(i)).append_file(str(i))
+            with mock.patch('website.search.search.bulk_update_files') as mock_update_files, CaptureQueriesContext(connection) as queries:
+                to_move.move_under(move_to)
+            query_counts.append(len(queries))
+            assert_equal(mock_update_files.call_count, 1)
+        assert_equal(query_counts[0], query_counts[1])
+
     def test_copy_rename(self):
         to_copy = self.node_settings.get_root().append_file('Carp')
         copy_to = self.node_settings.get_root().append_folder('Cloud')
@@ -345,6 +473,66 @@ class TestOsfstorageFileNode(StorageTestCase):
         assert_equal(copied.parent, copy_to)
         assert_equal(to_copy.parent, self.node_settings.get_root())
 
+    def test_copy_folder_subtree(self):
+        to_copy = self.node_settings.get_root().append_folder('Cloud')
+        child = to_copy.append_folder('Sea').append_file('Carp')
+        version = child.create_version(self.user, {
+            'service': 'cloud',
+            settings.WATERBUTLER_RESOURCE: 'osf',
+            'object': '06d80e',
+        }, {'size': 1234})
+        trashed = to_copy.append_file('Gone')
+        trashed.delete()
+        copy_to = self.node_settings.get_root().append_folder('Sky')
+
+        copied = to_copy.copy_under(copy_to)
+
+        copied_child = OsfStorageFileNode.objects.get(name='Carp', parent__parent=copied)
+        assert_equal(copied_child.copied_from, child)
+        assert_equal(copied_child.materialized_path, '/Sky/Cloud/Sea/Carp')
+        assert_equal(list(copied_child.versions.all()), [version])
+        assert_false(copied.children.filter(name='Gone').exists())
+        assert_equal(copied.copy_report.counts['file_nodes'], 3)
+
+    def test_copy_relocates_newest_version_to_target_region(self):
+        to_copy = self.node_settings.get_root().append_file('Carp')
+        old_version = to_copy.create_version(self.user, {
+            'service': 'cloud',
+            settings.WATERBUTLER_RESOURCE: 'osf',
+            'object': '06d80e',
+        }, {'size': 1234})
+        newest_version = to_copy.create_version(self.user, {
+            'service': 'cloud',
+            settings.WATERBUTLER_RESOURCE: 'osf',
+            'object': '07d80a',
+        }, {'size': 1234})
+        other_project = ProjectFactory(creator=self.user)
+        other_settings = other_project.get_addon('osfstorage')
+        other_settings.region = RegionFactory()
+        other_settings.save()
+
+        copied = to_copy.copy_under(other_settings.get_root())
+
+        versions = list(copied.versions.order_by('-created'))
+        assert_equal(len(versions), 2)
+        assert_not_equal(versions[0], newest_version)
+        assert_equal(versions[0].location, newest_version.location)
+        assert_equal(versions[0].region, other_settings.region)
+        assert_equal(versions[1], old_version)
+
+    def test_copy_query_count_does_not_grow_with_files(self):
+        root = self.node_settings.get_root()
+        query_counts = []
+        for size in (1, 10):
+            to_copy = root.append_folder('Cloud {}'.format(size))
+            for i in range(size):
+                to_copy.append_file('Carp {}'.format(i))
+            copy_to = root.append_folder('Sky {}'.format(size))
+            with mock.patch('website.search.search.bulk_update_files'), CaptureQueriesContext(connection) as queries:
+                to_copy.copy_under(copy_to)
+            query_counts.append(len(queries))
+        assert_equal(query_counts[0], query_counts[1])
+
     def test_move(self):
         to_move = self.node_settings.get_root().append_file('Carp')
         move_to = self.node_settings.get_root().append_folder('Cloud')
@@ -451,6 +639,18 @@ class TestOsfstorageFileNode(StorageTestCase):
             '/' + folder._id, provider='osfstorage', target=node)
         assert sorted(guids) == sorted(all_guids)
 
+    def test_get_file_guids_for_live_folder_uses_newest_guid(self):
+        node = self.node_settings.owner
+        folder = OsfStorageFolder(name='foofolder', target=node)
+        folder.save()
+        file = folder.append_file('foo')
+        file.get_guid(create=True)
+        file.guids.create()
+
+        all_guids = OsfStorageFileNode.get_file_guids(
+            '/' + folder._id, provider='osfstorage', target=node)
+        assert list(all_guids) == [file.get_guid()._id]
+
     def test_get_file_guids_for_trashed_file(self):
         node = self.node_settings.owner
         file = OsfStorageFile(name='foo', target=node)
@@ -924,3 +1124,163 @@ class TestOsfStorageCheckout(StorageTestCase):
         self.file.target.remove_contributors([self.user], save=True)
         self.file.reload()
         assert_equal(self.file.checkout, None)
+
+    def test_checkout_counts_folder_ancestors(self):
+        folder = self.root_node.append_folder('folder')
+        subfolder = folder.append_folder('subfolder')
+        self.file.move_under(subfolder)
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        assert_false(subfolder.is_checked_out)  # Not refreshed yet
+        for each in (self.root_node, folder, subfolder):
+            each.reload()
+            assert_true(each.is_checked_out)
+        assert_equal(subfolder.checkout_count, 1)
+
+        self.file.check_in_or_out(self.user, None, save=True)
+        for each in (self.root_node, folder, subfolder):
+            each.reload()
+            assert_false(each.is_checked_out)
+
+    def test_stale_folder_cannot_be_moved_or_deleted_while_checked_out(self):
+        folder = self.root_node.append_folder('folder')
+        destination = self.root_node.append_folder('destination')
+        self.file.move_under(folder)
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        assert_false(folder.is_checked_out)  # Not refreshed yet
+        with assert_raises(FileNodeCheckedOutError):
+            folder.move_under(destination)
+        with assert_raises(FileNodeCheckedOutError):
+            folder.delete()
+
+    def test_checked_out_folder_counts_itself(self):
+        folder = self.root_node.append_folder('folder')
+        folder.check_in_or_out(self.user, self.user, save=True)
+        assert_true(folder.is_checked_out)
+        self.root_node.reload()
+        assert_true(self.root_node.is_checked_out)
+
+    def test_stale_save_does_not_overwrite_checkout_count(self):
+        folder = self.root_node.append_folder('folder')
+        self.file.move_under(folder)
+        stale = OsfStorageFolder.objects.get(id=folder.id)
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        stale.name = 'renamed'
+        stale.save()
+        assert_equal(stale.checkout_count, 1)
+        folder.reload()
+        assert_true(folder.is_checked_out)
+
+    def test_move_folder_moves_checkout_count(self):
+        source = self.root_node.append_folder('source')
+        destination = self.root_node.append_folder('destination')
+        folder = source.append_folder('folder')
+        self.file.move_under(folder)
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        # Moves of checked out subtrees are refused by move_under, so reparent directly
+        folder.parent = destination
+        folder.save()
+        for each in (source, destination, self.root_node):
+            each.reload()
+        assert_false(source.is_checked_out)
+        assert_true(destination.is_checked_out)
+        assert_true(self.root_node.is_checked_out)
+        assert_equal(self.root_node.checkout_count, 1)
+
+    def test_remove_contributor_decrements_checkout_counts(self):
+        user = factories.AuthUserFactory()
+        models.Contributor.objects.create(
+            node=self.node,
+            user=user,
+            admin=True,
+            write=True,
+            read=True,
+            visible=True
+        )
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        self.root_node.reload()
+        assert_true(self.root_node.is_checked_out)
+        self.node.remove_contributors([self.user], save=True)
+        self.root_node.reload()
+        assert_false(self.root_node.is_checked_out)
+
+    def test_check_checkout_counts_repairs_drift(self):
+        from osf.management.commands.check_osfstorage_checkout_counts import check_checkout_counts
+        self.file.check_in_or_out(self.user, self.user, save=True)
+        OsfStorageFolder.objects.filter(id=self.root_node.id).update(checkout_count=5)
+        assert_equal(check_checkout_counts(repair=True), 1)
+        self.root_node.reload()
+        assert_equal(self.root_node.is_checked_out, True)
+        assert_equal(self.root_node.checkout_count, 1)
+        assert_equal(check_checkout_counts(), 0)
+
+
+@pytest.mark.django_db
+class TestOsfStorageUsage(StorageTestCase):
+    def setUp(self):
+        super(TestOsfStorageUsage, self).setUp()
+        self.root_node = self.node_settings.get_root()
+
+    def add_file(self, name, size, parent=None):
+        file_node = (parent or self.root_node).append_file(name)
+        file_node.create_version(self.user, {
+            'service': 'cloud',
+            settings.WATERBUTLER_RESOURCE: 'osf',
+            'object': name,
+        }, {'size': size})
+        return file_node
+
+    def usage(self, node, descendants=True):
+        totals = models.StorageUsage.for_node(node, descendants=descendants)
+        return totals['usage'], totals['deleted_usage']
+
+    def test_create_version_adds_usage(self):
+        file_node = self.add_file('Carp', 1000)
+        file_node.create_version(self.user, {
+            'service': 'cloud',
+            settings.WATERBUTLER_RESOURCE: 'osf',
+            'object': 'newer',
+        }, {'size': 500})
+        assert_equal(self.usage(self.project), (1500, 0))
+        assert_equal(models.StorageUsage.for_region(self.node_settings.region), {'usage': 1500, 'deleted_usage': 0})
+
+    def test_delete_and_restore_folder(self):
+        folder = self.root_node.append_folder('Sea')
+        self.add_file('Carp', 1000, parent=folder)
+        self.add_file('Cod', 24, parent=folder.append_folder('Deep'))
+        self.add_file('Eel', 7)
+
+        folder.delete()
+        assert_equal(self.usage(self.project), (7, 1024))
+
+        models.TrashedFileNode.load(folder._id).restore()
+        assert_equal(self.usage(self.project), (1031, 0))
+
+    def test_move_and_copy_between_nodes(self):
+        component = NodeFactory(parent=self.project, creator=self.user)
+        destination = component.get_addon('osfstorage').get_root()
+        file_node = self.add_file('Carp', 1000)
+        folder = self.root_node.append_folder('Sea')
+        self.add_file('Cod', 24, parent=folder)
+
+        file_node.move_under(destination)
+        folder.copy_under(destination)
+        assert_equal(self.usage(self.project, descendants=False), (24, 0))
+        assert_equal(self.usage(component), (1024, 0))
+        assert_equal(self.usage(self.project), (1048, 0))
+
+    def test_roots_and_users_over_limit(self):
+        self.add_file('Carp', 1000)
+        contributor = factories.AuthUserFactory()
+        self.project.add_contributor(contributor, permissions=['read'], auth=Auth(self.user), save=True)
+        assert_equal(models.StorageUsage.roots_over(1000), [(self.project.id, 1000, 0)])
+        assert_equal(models.StorageUsage.roots_over(1001), [])
+        assert_equal(models.StorageUsage.roots_over(1000, excluded_ids=[self.project.id]), [])
+        assert_equal(models.StorageUsage.users_over(1000), [(self.user.id, 1000, 0)])
+
+    def test_check_storage_usage_repairs_drift(self):
+        from osf.management.commands.check_storage_usage import check_storage_usage
+        self.add_file('Carp', 1000)
+        models.StorageUsage.objects.filter(node=self.project).update(usage=5, deleted_usage=3)
+        assert_equal(check_storage_usage(repair=True), 1)
+        assert_equal(self.usage(self.project), (1000, 0))
+        assert_equal(check_storage_usage(), 0)
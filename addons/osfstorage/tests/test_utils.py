@@ -7,7 +7,7 @@ from nose.tools import *  # noqa
 from framework import sessions
 from framework.flask import request
 
-from osf.models import Session
+from osf.models import PageCounter, Session
 from addons.osfstorage.tests import factories
 from addons.osfstorage import utils
 
@@ -33,6 +33,7 @@ class TestSerializeRevision(StorageTestCase):
         utils.update_analytics(self.project, self.record._id, 0)
         utils.update_analytics(self.project, self.record._id, 0)
         utils.update_analytics(self.project, self.record._id, 2)
+        PageCounter.rollup()
         expected = {
             'index': 1,
             'user': {
@@ -60,6 +61,7 @@ class TestSerializeRevision(StorageTestCase):
         utils.update_analytics(self.project, self.record._id, 0)
         utils.update_analytics(self.project, self.record._id, 0)
         utils.update_analytics(self.project, self.record._id, 2)
+        PageCounter.rollup()
         expected = {
             'index': 2,
             'user': None,
@@ -1,5 +1,7 @@
+import collections
 import datetime
 import functools
+import logging
 import operator
 import re
 
@@ -21,6 +23,13 @@ from rest_framework.filters import OrderingFilter
 from osf.models import Subject, Preprint
 from osf.models.base import GuidMixin
 
+logger = logging.getLogger(__name__)
+
+# Number of filters applied in Python by ListFilterMixin.get_filtered_queryset, by view and field
+python_filter_fallbacks = collections.Counter()
+# Log python_filter_fallbacks after this many fallbacks
+PYTHON_FILTER_FALLBACKS_LOG_INTERVAL = 1000
+
 
 def lowercase(lower):
     if hasattr(lower, '__call__'):
@@ -336,6 +345,10 @@ class ListFilterMixin(FilterMixin):
 
     Serializers that want to restrict which fields are used for filtering need to have a variable called
     filterable_fields which is a frozenset of strings representing the field names as they appear in the serialization.
+
+    Serializers can map fields that are not model fields, like SerializerMethodFields, to ORM expressions in a
+    variable called filter_expressions. Values are expressions, or callables that take the request and return one.
+    Querysets are annotated with the expressions of the fields they are filtered on, and filtered in SQL.
     """
     FILTERS = {
         'eq': operator.eq,
@@ -368,6 +381,9 @@ class ListFilterMixin(FilterMixin):
         query_parts = []
 
         if filters:
+            if not isinstance(queryset, list):
+                queryset = self.annotate_filter_expressions(queryset, filters)
+
             for key, field_names in filters.items():
 
                 sub_query_parts = []
@@ -395,6 +411,32 @@ class ListFilterMixin(FilterMixin):
 
         return queryset
 
+    def annotate_filter_expressions(self, queryset, filters):
+        """Annotate queryset with the filter_expressions of the serializer fields in filters, and point
+        the operations on those fields at the annotations.
+        """
+        filter_expressions = getattr(self.serializer_class, 'filter_expressions', {})
+        annotations = {}
+        for field_names in filters.values():
+            for field_name, data in field_names.items():
+                if field_name not in filter_expressions:
+                    continue
+                expression = filter_expressions[field_name]
+                if not hasattr(expression, 'resolve_expression'):
+                    expression = expression(self.request)
+                annotation = 'filter_{}'.format(field_name)
+                annotations[annotation] = expression
+                for operation in (data if isinstance(data, list) else [data]):
+                    operation['source_field_name'] = annotation
+                    if operation['value'] is not None:
+                        try:
+                            operation['value'] = expression.output_field.to_python(operation['value'])
+                        except ValidationError:
+                            raise InvalidFilterValue(value=operation['value'])
+        if not annotations:
+            return queryset
+        return queryset.annotate(**annotations)
+
     def build_query_from_field(self, field_name, operation):
         query_field_name = operation['source_field_name']
         if operation['op'] == 'ne':
@@ -449,6 +491,10 @@ class ListFilterMixin(FilterMixin):
         """filters default queryset based on the serializer field type"""
         field = self.serializer_class._declared_fields[field_name]
         source_field_name = params['source_field_name']
+        python_filter_fallbacks[(self.__class__.__name__, field_name)] += 1
+        logger.debug('Filtering {} on {} in Python'.format(self.__class__.__name__, field_name))
+        if sum(python_filter_fallbacks.values()) % PYTHON_FILTER_FALLBACKS_LOG_INTERVAL == 0:
+            logger.info('Filters applied in Python: {}'.format(dict(python_filter_fallbacks)))
 
         if isinstance(field, ser.SerializerMethodField):
             return_val = [
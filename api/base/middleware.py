@@ -13,6 +13,11 @@ from framework.postcommit_tasks.handlers import (
     postcommit_after_request,
     postcommit_before_request,
 )
+from framework.identity_map.handlers import (
+    identity_map_before_request,
+    identity_map_after_request,
+    identity_map_teardown_request,
+)
 from framework.celery_tasks.handlers import (
     celery_before_request,
     celery_after_request,
@@ -60,6 +65,21 @@ class DjangoGlobalMiddleware(MiddlewareMixin):
         return response
 
 
+class IdentityMapMiddleware(MiddlewareMixin):
+    """
+    Scope the model identity map (when enabled) to the request.
+    """
+    def process_request(self, request):
+        identity_map_before_request()
+
+    def process_exception(self, request, exception):
+        identity_map_teardown_request(error=exception)
+        return None
+
+    def process_response(self, request, response):
+        return identity_map_after_request(response)
+
+
 class CorsMiddleware(corsheaders.middleware.CorsMiddleware):
     """
     Augment CORS origin white list with the Institution model's domains.
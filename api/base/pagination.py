@@ -1,8 +1,15 @@
+import base64
+import functools
+import json
+import operator
+
 from django.utils import six
 from collections import OrderedDict
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
 from django.core.urlresolvers import reverse
 from django.core.paginator import InvalidPage, Paginator as DjangoPaginator
-from django.db.models import QuerySet
+from django.db import connections
+from django.db.models import Q, QuerySet
 
 from rest_framework import pagination
 from rest_framework.exceptions import NotFound
@@ -10,6 +17,7 @@ from rest_framework.response import Response
 from rest_framework.utils.urls import (
     replace_query_param, remove_query_param,
 )
+from api.base.exceptions import InvalidQueryStringError
 from api.base.serializers import is_anonymized
 from api.base.settings import MAX_PAGE_SIZE
 from api.base.utils import absolute_reverse
@@ -18,6 +26,70 @@ from osf.models import AbstractNode, Comment, Preprint, Guid
 from website.search.elastic_search import DOC_TYPE_TO_MODEL
 
 
+class EmbeddedBatchResults(object):
+    """The first page of rows of an embedded list and its total number of rows, fetched with
+    the embeds of other items of the page. Paginates like a queryset without querying again.
+    """
+
+    def __init__(self, results, total):
+        self.results = results
+        self.total = total
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+
+def estimate_count(queryset):
+    """Return the query planner's estimate of the number of rows of ``queryset``."""
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, six.string_types):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CursorPage(object):
+    """A page of cursor pagination, with the cursors of the pages before and after it.
+    Serves as its own paginator for the ``total`` and ``per_page`` of responses.
+    """
+
+    def __init__(self, object_list, per_page, count, count_is_estimate, cursor, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.paginator = self
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
 class JSONAPIPagination(pagination.PageNumberPagination):
     """
     Custom paginator that formats responses in a JSON-API compatible format.
@@ -29,6 +101,15 @@ class JSONAPIPagination(pagination.PageNumberPagination):
     page_size_query_param = 'page[size]'
     max_page_size = MAX_PAGE_SIZE
 
+    # Cursor pagination is used instead of page numbers if the request has this query param,
+    # which is empty for the first page
+    cursor_query_param = 'page[cursor]'
+    # Cursor pagination estimates the total unless this query param is "exact"
+    total_query_param = 'page[total]'
+    invalid_cursor_message = 'Invalid cursor'
+
+    cursor_page = None
+
     def page_number_query(self, url, page_number):
         """
         Builds uri and adds page param.
@@ -41,30 +122,49 @@ class JSONAPIPagination(pagination.PageNumberPagination):
 
         return paginated_url
 
+    def cursor_query(self, url, cursor):
+        """
+        Builds uri and adds cursor param.
+        """
+        url = remove_query_param(self.request.build_absolute_uri(url), '_')
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
     def get_self_real_link(self, url):
+        if self.cursor_page is not None:
+            return self.cursor_query(url, self.cursor_page.cursor)
         page_number = self.page.number
         return self.page_number_query(url, page_number)
 
     def get_first_real_link(self, url):
         if not self.page.has_previous():
             return None
+        if self.cursor_page is not None:
+            return self.cursor_query(url, '')
         return self.page_number_query(url, 1)
 
     def get_last_real_link(self, url):
         if not self.page.has_next():
             return None
+        if self.cursor_page is not None:
+            # Reaching the last page would take counting the rows
+            return None
         page_number = self.page.paginator.num_pages
         return self.page_number_query(url, page_number)
 
     def get_previous_real_link(self, url):
         if not self.page.has_previous():
             return None
+        if self.cursor_page is not None:
+            return self.cursor_query(url, self.cursor_page.previous_cursor)
         page_number = self.page.previous_page_number()
         return self.page_number_query(url, page_number)
 
     def get_next_real_link(self, url):
         if not self.page.has_next():
             return None
+        if self.cursor_page is not None:
+            return self.cursor_query(url, self.cursor_page.next_cursor)
         page_number = self.page.next_page_number()
         return self.page_number_query(url, page_number)
 
@@ -128,6 +228,12 @@ class JSONAPIPagination(pagination.PageNumberPagination):
         else:
             response_dict = self.get_response_dict(data, reversed_url)
 
+        if self.cursor_page is not None and self.cursor_page.count_is_estimate:
+            if self.request.version < '2.1':
+                response_dict['links']['meta']['total_is_estimate'] = True
+            else:
+                response_dict['meta']['total_is_estimate'] = True
+
         if is_anonymized(self.request):
             if response_dict.get('meta', False):
                 response_dict['meta'].update({'anonymous': True})
@@ -164,9 +270,145 @@ class JSONAPIPagination(pagination.PageNumberPagination):
             self.request = request
             return list(self.page)
 
+        elif self.cursor_query_param in request.query_params:
+            return self.paginate_queryset_by_cursor(queryset, request)
+
         else:
             return super(JSONAPIPagination, self).paginate_queryset(queryset, request, view=None)
 
+    def get_keyset_ordering(self, queryset):
+        """
+        Returns the ordering of queryset as (name, nullable, descending) tuples, ending with the primary key.
+        Only orderings by columns or annotations of the queryset's model are supported.
+        """
+        query = queryset.query
+        if query.order_by:
+            names = list(query.order_by)
+        elif query.default_ordering:
+            names = list(queryset.model._meta.ordering)
+        else:
+            names = []
+
+        if query.extra_order_by:
+            raise InvalidQueryStringError(detail='Cursor pagination is not supported for this sort order.', parameter=self.cursor_query_param)
+
+        pk_name = queryset.model._meta.pk.name
+        ordering = []
+        for name in names:
+            if not isinstance(name, six.string_types) or '__' in name or name.lstrip('-') == '?':
+                raise InvalidQueryStringError(detail='Cursor pagination is not supported for this sort order.', parameter=self.cursor_query_param)
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = pk_name
+            if name in query.annotations:
+                nullable = True
+            else:
+                try:
+                    field = queryset.model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    field = None
+                if field is None or field.is_relation or not field.concrete:
+                    raise InvalidQueryStringError(detail='Cursor pagination is not supported for this sort order.', parameter=self.cursor_query_param)
+                nullable = field.null
+            ordering.append((name, nullable, descending))
+            if name == pk_name:
+                break
+        else:
+            ordering.append((pk_name, False, False))
+        return ordering
+
+    def encode_cursor(self, reverse, values):
+        """
+        Returns a cursor pointing after (or, if reverse, before) the row with values of the keyset ordering.
+        """
+        data = json.dumps([reverse, values], default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else six.text_type(value))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, queryset, ordering):
+        """
+        Returns (reverse, values) of cursor, or (False, None) for the empty cursor of the first page.
+        """
+        if not cursor:
+            return False, None
+        try:
+            reverse, values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if len(values) != len(ordering):
+                raise ValueError('Cursor does not match the ordering')
+            for index, (name, _, _) in enumerate(ordering):
+                if values[index] is not None and name not in queryset.query.annotations:
+                    values[index] = queryset.model._meta.get_field(name).to_python(values[index])
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), values
+
+    def keyset_filter(self, ordering, values):
+        """
+        Returns a Q of the rows that follow the row with values in ordering, or None if no rows can.
+        Ascending columns sort NULLs last and descending columns sort them first, as Postgres does.
+        """
+        clauses = []
+        equal = Q()
+        for (name, nullable, descending), value in zip(ordering, values):
+            if value is None:
+                after = Q(**{name + '__isnull': False}) if descending else None
+            elif descending:
+                after = Q(**{name + '__lt': value})
+            else:
+                after = Q(**{name + '__gt': value})
+                if nullable:
+                    after |= Q(**{name + '__isnull': True})
+            if after is not None:
+                clauses.append(equal & after)
+            equal &= Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+        if not clauses:
+            return None
+        return functools.reduce(operator.or_, clauses)
+
+    def paginate_queryset_by_cursor(self, queryset, request):
+        """
+        Returns the page of queryset that the cursor query param points at. Pages are keyed on the values
+        of the queryset's ordering and primary key, so deep pages cost no more than the first one. The total
+        is the planner's estimate unless the total query param is "exact".
+        """
+        if not isinstance(queryset, QuerySet):
+            raise InvalidQueryStringError(detail='Cursor pagination is not supported by this endpoint.', parameter=self.cursor_query_param)
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self.get_keyset_ordering(queryset)
+        cursor = request.query_params[self.cursor_query_param]
+        reverse, values = self.decode_cursor(cursor, queryset, ordering)
+
+        if reverse:
+            ordering = [(name, nullable, not descending) for name, nullable, descending in ordering]
+        page_queryset = queryset.order_by(*[('-' if descending else '') + name for name, _, descending in ordering])
+        if values is not None:
+            keyset = self.keyset_filter(ordering, values)
+            page_queryset = page_queryset.filter(keyset) if keyset is not None else page_queryset.none()
+
+        results = list(page_queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        keys = [[getattr(obj, name) for name, _, _ in ordering] for obj in results]
+        if reverse:
+            results.reverse()
+            keys.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        if request.query_params.get(self.total_query_param) == 'exact':
+            count, count_is_estimate = queryset.count(), False
+        else:
+            count, count_is_estimate = estimate_count(queryset), True
+
+        self.page = self.cursor_page = CursorPage(
+            results, page_size, count, count_is_estimate, cursor,
+            next_cursor=self.encode_cursor(False, keys[-1] if keys else values) if has_next else None,
+            previous_cursor=self.encode_cursor(True, keys[0] if keys else values) if has_previous else None,
+        )
+        return results
+
 
 class MaxSizePagination(JSONAPIPagination):
     page_size = 1000
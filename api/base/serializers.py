@@ -5,6 +5,8 @@ from urlparse import urlparse
 import furl
 from django.core.urlresolvers import resolve, reverse, NoReverseMatch
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from distutils.version import StrictVersion
 
 from rest_framework import exceptions, permissions
@@ -25,6 +27,14 @@ from website import settings
 from website.project.model import has_anonymous_link
 
 
+def related_count(queryset, lookup):
+    """Aggregate expression counting the rows of ``queryset`` whose ``lookup`` is the
+    annotated object, for JSONAPISerializer.related_count_aggregates.
+    """
+    counts = queryset.filter(**{lookup: OuterRef('pk')}).order_by().values(lookup).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
 def format_relationship_links(related_link=None, self_link=None, rel_meta=None, self_meta=None):
     """
     Properly handles formatting of self and related links according to JSON API.
@@ -646,11 +656,11 @@ class RelationshipField(ser.HyperlinkedIdentityField):
                 field_counts_requested = self.process_related_counts_parameters(show_related_counts, value)
 
                 if utils.is_truthy(show_related_counts):
-                    meta[key] = functional.rapply(meta_data[key], _url_val, obj=value, serializer=self.parent, request=self.context['request'])
+                    meta[key] = self.get_related_count(meta_data[key], value)
                 elif utils.is_falsy(show_related_counts):
                     continue
                 elif self.field_name in field_counts_requested:
-                    meta[key] = functional.rapply(meta_data[key], _url_val, obj=value, serializer=self.parent, request=self.context['request'])
+                    meta[key] = self.get_related_count(meta_data[key], value)
                 else:
                     continue
             elif key == 'projects_in_common':
@@ -663,6 +673,15 @@ class RelationshipField(ser.HyperlinkedIdentityField):
                 meta[key] = functional.rapply(meta_data[key], _url_val, obj=value, serializer=self.parent, request=self.context['request'])
         return meta
 
+    def get_related_count(self, meta_value, value):
+        """Return a count of related_meta, as annotated on ``value`` by
+        JSONAPISerializer.prefetch_related_counts if possible.
+        """
+        related_counts = getattr(value, '_related_counts', None)
+        if related_counts and meta_value in related_counts:
+            return related_counts[meta_value]
+        return functional.rapply(meta_value, _url_val, obj=value, serializer=self.parent, request=self.context['request'])
+
     def lookup_attribute(self, obj, lookup_field):
         """
         Returns attribute from target object unless attribute surrounded in angular brackets where it returns the lookup field.
@@ -1148,6 +1167,12 @@ class JSONAPIListSerializer(ser.ListSerializer):
                 self.child.to_esi_representation(item, envelope=None) for item in data
             ]
         else:
+            data = list(data)
+            self.child.prefetch_related_counts(data)
+            # Let embeds fetch their relation for the whole page at once
+            for partial in self.context.get('embed', {}).values():
+                if len(data) > 1 and hasattr(partial, 'prefetch'):
+                    partial.prefetch(data)
             ret = [
                 self.child.to_representation(item, envelope=envelope) for item in data
             ]
@@ -1250,6 +1275,28 @@ class BaseAPISerializer(ser.Serializer, SparseFieldsetMixin):
         ]
 
 
+class FieldPlanEntry(collections.namedtuple('FieldPlanEntry', ['name', 'kind', 'null_relationship', 'embed', 'hidden'])):
+    """How JSONAPISerializer.to_representation serializes one field, see JSONAPISerializer.get_field_plan.
+
+    :param str kind: Where the representation goes: ID, LINKS, ATTRIBUTE or RELATIONSHIP
+    :param bool null_relationship: Whether a None value is a null relationship rather than a null attribute
+    :param bool embed: Whether the relationship is embedded
+    :param bool hidden: Whether the relationship is hidden from anonymous view-only links
+    """
+    __slots__ = ()
+
+    ID = 'id'
+    LINKS = 'links'
+    ATTRIBUTE = 'attribute'
+    RELATIONSHIP = 'relationship'
+
+
+# (serializer class, field names, anonymized, embeds) -> (FieldPlanEntry tuple, invalid embeds)
+_field_plans = {}
+# Sparse fieldsets and embeds come from the query string, so the number of plans is capped
+MAX_FIELD_PLANS = 1000
+
+
 class JSONAPISerializer(BaseAPISerializer):
     """Base serializer. Requires that a `type_` option is set on `class Meta`. Also
     allows for enveloping of both single resources and collections.  Looks to nest fields
@@ -1258,6 +1305,14 @@ class JSONAPISerializer(BaseAPISerializer):
     """
     writeable_method_fields = frozenset([])
 
+    _sparse_fields_parsed = False
+    _bound_field_plans = None
+
+    # Counts of related_meta that list pages annotate on all of their objects with one query,
+    # keyed by the serializer method that computes the count of a single object. Expressions
+    # are relative to the concrete model of the objects, see related_count.
+    related_count_aggregates = {}
+
     # Don't serialize relationships that use these views
     # when viewing thru an anonymous VOL
     views_to_hide_if_anonymous = {
@@ -1281,6 +1336,36 @@ class JSONAPISerializer(BaseAPISerializer):
         )
         return invalid_embeds
 
+    def prefetch_related_counts(self, objs):
+        """Annotate the counts requested by the related_counts query param that have an
+        aggregate in ``related_count_aggregates`` on all ``objs`` at once. RelationshipField
+        reads them instead of calling the serializer method for every object.
+        """
+        request = self.context['request']
+        show_related_counts = request.query_params.get('related_counts', False)
+        if utils.is_falsy(show_related_counts) or not self.related_count_aggregates or not objs:
+            return
+        if (request.parser_context.get('kwargs') or {}).get('is_embedded'):
+            return
+        requested = None if utils.is_truthy(show_related_counts) else set(show_related_counts.split(','))
+
+        aggregates = {}
+        for field_name, field in self.fields.items():
+            field = getattr(field, 'field', None) or field
+            if requested is not None and field_name not in requested:
+                continue
+            for key, meta_value in (getattr(field, 'related_meta', None) or {}).items():
+                if key in ('count', 'unread') and meta_value in self.related_count_aggregates:
+                    aggregates[meta_value] = self.related_count_aggregates[meta_value]
+        if not aggregates:
+            return
+
+        model = objs[0]._meta.concrete_model
+        rows = model.objects.filter(pk__in=[obj.pk for obj in objs]).annotate(**aggregates).values_list('pk', *aggregates.keys())
+        counts = {row[0]: dict(zip(aggregates.keys(), row[1:])) for row in rows}
+        for obj in objs:
+            obj._related_counts = counts.get(obj.pk)
+
     def to_esi_representation(self, data, envelope='data'):
         href = None
         query_params_blacklist = ['page[size]']
@@ -1302,6 +1387,74 @@ class JSONAPISerializer(BaseAPISerializer):
                 _validated_data[field] = self.initial_data[field]
         return _validated_data
 
+    def _compile_field_plan(self, is_anonymous, embeds):
+        """Partition the fields of this serializer by how ``to_representation`` serializes them.
+        Return the fields as FieldPlanEntry tuples, in order, and the names of invalid embeds.
+        """
+        to_be_removed = set()
+        if is_anonymous and hasattr(self, 'non_anonymized_fields'):
+            # Drop any fields that are not specified in the `non_anonymized_fields` variable.
+            to_be_removed = set(self.fields.keys()) - set(self.non_anonymized_fields)
+
+        fields = [
+            field for field in self.fields.values() if
+            not field.write_only and field.field_name not in to_be_removed
+        ]
+        invalid_embeds = self.invalid_embeds(fields, embeds) - to_be_removed
+
+        entries = []
+        for field in fields:
+            if hasattr(field, 'child_relation'):
+                nested_field = field.child_relation
+            else:
+                nested_field = getattr(field, 'field', None)
+            if getattr(field, 'json_api_link', False) or getattr(nested_field, 'json_api_link', False):
+                kind = FieldPlanEntry.RELATIONSHIP
+            elif field.field_name == 'id':
+                kind = FieldPlanEntry.ID
+            elif field.field_name == 'links':
+                kind = FieldPlanEntry.LINKS
+            else:
+                kind = FieldPlanEntry.ATTRIBUTE
+            entries.append(FieldPlanEntry(
+                name=field.field_name,
+                kind=kind,
+                # None values of wrapped RelationshipFields are serialized as null relationships
+                null_relationship=bool(getattr(field, 'field', None) and isinstance(field.field, RelationshipField)),
+                # If embed=field_name is appended to the query string or 'always_embed' flag is True, directly embed the
+                # results in addition to adding a relationship link
+                embed=bool(embeds and (field.field_name in embeds or getattr(field, 'always_embed', None))),
+                hidden=bool(
+                    is_anonymous and
+                    hasattr(field, 'view_name') and
+                    field.view_name in self.views_to_hide_if_anonymous
+                ),
+            ))
+        return tuple(entries), frozenset(invalid_embeds)
+
+    def get_field_plan(self, is_anonymous, embeds):
+        """Return ``(invalid embeds, [(field, source field, FieldPlanEntry)])`` for serializing objects
+        with this serializer. Plans are compiled once per serializer class, set of fields, anonymization
+        and embeds, and bound to the fields of each serializer instance once.
+        """
+        key = (is_anonymous, frozenset(embeds))
+        if self._bound_field_plans is None:
+            self._bound_field_plans = {}
+        bound = self._bound_field_plans.get(key)
+        if bound is None:
+            plan_key = (self.__class__, tuple(self.fields.keys())) + key
+            plan = _field_plans.get(plan_key)
+            if plan is None:
+                if len(_field_plans) >= MAX_FIELD_PLANS:
+                    _field_plans.clear()
+                plan = _field_plans[plan_key] = self._compile_field_plan(is_anonymous, embeds)
+            entries, invalid_embeds = plan
+            bound = self._bound_field_plans[key] = (invalid_embeds, [
+                (self.fields[entry.name], getattr(self.fields[entry.name], 'child_relation', self.fields[entry.name]), entry)
+                for entry in entries
+            ])
+        return bound
+
     # overrides Serializer
     def to_representation(self, obj, envelope='data'):
         """Serialize to final representation.
@@ -1313,7 +1466,9 @@ class JSONAPISerializer(BaseAPISerializer):
         meta = getattr(self, 'Meta', None)
         type_ = getattr(meta, 'type_', None)
         assert type_ is not None, 'Must define Meta.type_'
-        self.parse_sparse_fields(allow_unsafe=True, context=self.context)
+        if not self._sparse_fields_parsed:
+            self.parse_sparse_fields(allow_unsafe=True, context=self.context)
+            self._sparse_fields_parsed = True
 
         data = {
             'id': '',
@@ -1330,20 +1485,8 @@ class JSONAPISerializer(BaseAPISerializer):
             context_envelope = None
         enable_esi = self.context.get('enable_esi', False)
         is_anonymous = is_anonymized(self.context['request'])
-        to_be_removed = set()
-        if is_anonymous and hasattr(self, 'non_anonymized_fields'):
-            # Drop any fields that are not specified in the `non_anonymized_fields` variable.
-            allowed = set(self.non_anonymized_fields)
-            existing = set(self.fields.keys())
-            to_be_removed = existing - allowed
 
-        fields = [
-            field for field in self.fields.values() if
-            not field.write_only and field.field_name not in to_be_removed
-        ]
-
-        invalid_embeds = self.invalid_embeds(fields, embeds)
-        invalid_embeds = invalid_embeds - to_be_removed
+        invalid_embeds, plan = self.get_field_plan(is_anonymous, embeds)
         if invalid_embeds:
             raise api_exceptions.InvalidQueryStringError(
                 parameter='embed',
@@ -1352,77 +1495,53 @@ class JSONAPISerializer(BaseAPISerializer):
                 ),
             )
 
-        for field in fields:
+        attributes, relationships = data['attributes'], data['relationships']
+        for field, source, entry in plan:
             try:
-                if hasattr(field, 'child_relation'):
-                    attribute = field.child_relation.get_attribute(obj)
-                else:
-                    attribute = field.get_attribute(obj)
+                attribute = source.get_attribute(obj)
             except SkipField:
                 continue
 
-            if hasattr(field, 'child_relation'):
-                nested_field = field.child_relation
-            else:
-                nested_field = getattr(field, 'field', None)
             if attribute is None:
                 # We skip `to_representation` for `None` values so that
                 # fields do not have to explicitly deal with that case.
-                if getattr(field, 'field', None) and isinstance(field.field, RelationshipField):
-                    # if this is a RelationshipField, serialize as a null relationship
-                    data['relationships'][field.field_name] = {'data': None}
+                if entry.null_relationship:
+                    relationships[entry.name] = {'data': None}
                 else:
-                    # otherwise, serialize as an null attribute
-                    data['attributes'][field.field_name] = None
-            else:
-                try:
-                    if hasattr(field, 'child_relation'):
-                        if hasattr(attribute, 'all'):
-                            representation = field.child_relation.to_representation(attribute.all())
-                        else:
-                            representation = field.child_relation.to_representation(attribute)
+                    attributes[entry.name] = None
+                continue
+
+            try:
+                representation = source.to_representation(attribute.all() if hasattr(attribute, 'all') else attribute)
+            except SkipField:
+                continue
+
+            if entry.kind == FieldPlanEntry.ATTRIBUTE:
+                attributes[entry.name] = representation
+            elif entry.kind == FieldPlanEntry.RELATIONSHIP:
+                if entry.embed:
+                    if enable_esi:
+                        try:
+                            result = field.to_esi_representation(attribute, envelope=envelope)
+                        except SkipField:
+                            continue
                     else:
-                        if hasattr(attribute, 'all'):
-                            representation = field.to_representation(attribute.all())
-                        else:
-                            representation = field.to_representation(attribute)
-                except SkipField:
-                    continue
-                if getattr(field, 'json_api_link', False) or getattr(nested_field, 'json_api_link', False):
-                    # If embed=field_name is appended to the query string or 'always_embed' flag is True, directly embed the
-                    # results in addition to adding a relationship link
-                    if embeds and (field.field_name in embeds or getattr(field, 'always_embed', None)):
-                        if enable_esi:
-                            try:
-                                result = field.to_esi_representation(attribute, envelope=envelope)
-                            except SkipField:
-                                continue
-                        else:
-                            try:
-                                # If a field has an empty representation, it should not be embedded.
-                                result = self.context['embed'][field.field_name](obj)
-                            except SkipField:
-                                result = None
-
-                        if result:
-                            data['embeds'][field.field_name] = result
-                        else:
-                            data['embeds'][field.field_name] = {'error': 'This field is not embeddable.'}
-                    try:
-                        if not (
-                            is_anonymous and
-                            hasattr(field, 'view_name') and
-                                field.view_name in self.views_to_hide_if_anonymous
-                        ):
-                            data['relationships'][field.field_name] = representation
-                    except SkipField:
-                        continue
-                elif field.field_name == 'id':
-                    data['id'] = representation
-                elif field.field_name == 'links':
-                    data['links'] = representation
-                else:
-                    data['attributes'][field.field_name] = representation
+                        try:
+                            # If a field has an empty representation, it should not be embedded.
+                            result = embeds[entry.name](obj)
+                        except SkipField:
+                            result = None
+
+                    if result:
+                        data['embeds'][entry.name] = result
+                    else:
+                        data['embeds'][entry.name] = {'error': 'This field is not embeddable.'}
+                if not entry.hidden:
+                    relationships[entry.name] = representation
+            elif entry.kind == FieldPlanEntry.ID:
+                data['id'] = representation
+            else:
+                data['links'] = representation
 
         if not data['relationships']:
             del data['relationships']
@@ -204,6 +204,7 @@ ORIGINS_WHITELIST = ()
 
 MIDDLEWARE = (
     'api.base.middleware.DjangoGlobalMiddleware',
+    'api.base.middleware.IdentityMapMiddleware',
     'api.base.middleware.CeleryTaskMiddleware',
     'api.base.middleware.PostcommitTaskMiddleware',
     # A profiling middleware. ONLY FOR DEV USE
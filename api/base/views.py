@@ -1,12 +1,10 @@
-from collections import defaultdict
+import logging
 from distutils.version import StrictVersion
 
-from django_bulk_update.helper import bulk_update
 from django.conf import settings as django_settings
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.models import F
 from django.http import JsonResponse
-from django.contrib.contenttypes.models import ContentType
 from rest_framework import generics
 from rest_framework import permissions as drf_permissions
 from rest_framework import status
@@ -19,6 +17,7 @@ from api.base import permissions as base_permissions
 from api.base import utils
 from api.base.exceptions import RelationshipPostMakesNoChanges
 from api.base.filters import ListFilterMixin
+from api.base.pagination import EmbeddedBatchResults
 from api.base.parsers import JSONAPIRelationshipParser
 from api.base.parsers import JSONAPIRelationshipParserForRegularJSON
 from api.base.requests import EmbeddedRequest
@@ -39,14 +38,75 @@ from osf.models import Contributor, MaintenanceState, BaseFileNode
 from waffle.models import Flag, Switch, Sample
 from waffle import flag_is_active, sample_is_active
 
+logger = logging.getLogger(__name__)
+
 class JSONAPIBaseView(generics.GenericAPIView):
 
+    # List views that set these can be embedded for a whole page of parents at once: the first
+    # page of every parent is fetched by get_embed_batch with one grouped query, instead of one
+    # queryset and count per parent. ``embed_batch_parent`` is the foreign key of the listed
+    # rows to the parent, which the view finds by the ``embed_batch_lookup_kwarg`` URL kwarg.
+    embed_batch_parent = None
+    embed_batch_lookup_kwarg = None
+    embed_batch_ordering = ('id',)
+
+    # First ``page_size`` rows of every parent of the rows selected by ``queryset``,
+    # with the number of rows of each parent
+    EMBED_BATCH_SQL = """
+        SELECT id, parent_id, total
+        FROM (
+            SELECT T.id, T.{parent} AS parent_id,
+                   ROW_NUMBER() OVER (PARTITION BY T.{parent} ORDER BY {ordering}) AS rank,
+                   COUNT(*) OVER (PARTITION BY T.{parent}) AS total
+            FROM "{table}" AS T
+            WHERE T.id IN ({queryset})
+        ) AS ranked
+        WHERE rank <= %s
+        ORDER BY parent_id, rank;
+    """
+
     def __init__(self, **kwargs):
         assert getattr(self, 'view_name', None), 'Must specify view_name on view.'
         assert getattr(self, 'view_category', None), 'Must specify view_category on view.'
         self.view_fqn = ':'.join([self.view_category, self.view_name])
         super(JSONAPIBaseView, self).__init__(**kwargs)
 
+    def get_embed_batch_queryset(self, parent_ids):
+        """Return the rows of every parent in ``parent_ids``, as get_default_queryset
+        would return them for a single parent. Required by ``embed_batch_parent``.
+        """
+        raise NotImplementedError('Must define get_embed_batch_queryset')
+
+    def get_embed_batch(self, parent_ids, page_size):
+        """Fetch the first page of this list for every parent in ``parent_ids``.
+
+        :return dict: parent id -> (list of rows, total number of rows)
+        """
+        queryset = self.get_embed_batch_queryset(parent_ids)
+        model = queryset.model
+        ordering = []
+        for name in self.embed_batch_ordering:
+            column = connection.ops.quote_name(model._meta.get_field(name.lstrip('-')).column)
+            ordering.append('T.{} {}'.format(column, 'DESC' if name.startswith('-') else 'ASC'))
+        inner_sql, inner_params = queryset.order_by().values('pk').query.sql_with_params()
+        sql = self.EMBED_BATCH_SQL.format(
+            table=model._meta.db_table,
+            parent=connection.ops.quote_name(model._meta.get_field(self.embed_batch_parent).column),
+            ordering=', '.join(ordering + ['T.id ASC']),
+            queryset=inner_sql,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, list(inner_params) + [page_size])
+            ranked = cursor.fetchall()
+
+        rows = queryset.in_bulk([row_id for row_id, _, _ in ranked])
+        results = {parent_id: [] for parent_id in parent_ids}
+        totals = {}
+        for row_id, parent_id, total in ranked:
+            results[parent_id].append(rows[row_id])
+            totals[parent_id] = total
+        return {parent_id: (results[parent_id], totals.get(parent_id, 0)) for parent_id in parent_ids}
+
     def _get_embed_partial(self, field_name, field):
         """Create a partial function to fetch the values of an embedded field. A basic
         example is to include a Node's children in a single response.
@@ -111,7 +171,14 @@ class JSONAPIBaseView(generics.GenericAPIView):
                 if not isinstance(view, ListModelMixin):
                     ret = ser.to_representation(item)
                 else:
-                    queryset = view.filter_queryset(view.get_queryset())
+                    batch = getattr(request._request, '_embed_batches', {}).get((v.cls, field_name, item.id))
+                    if batch is None:
+                        queryset = view.filter_queryset(view.get_queryset())
+                    else:
+                        # Still run the view's permission checks on the parent; the lazy queryset
+                        # is not evaluated, its first page was fetched by prefetch
+                        view.get_queryset()
+                        queryset = EmbeddedBatchResults(*batch)
                     page = view.paginate_queryset(getattr(queryset, '_results_cache', None) or queryset)
 
                     ret = ser.to_representation(page or queryset)
@@ -133,6 +200,48 @@ class JSONAPIBaseView(generics.GenericAPIView):
 
             return ret
 
+        def prefetch(items):
+            """Fetch this embed for every item of a list page at once, if the embedded view
+            supports it. partial picks up the result of each item, so the output and errors of
+            every embed are the same as without prefetching.
+            """
+            if not hasattr(field, 'resolve'):
+                return
+            parents = {}
+            for item in items:
+                try:
+                    v, view_args, view_kwargs = field.resolve(item, field_name, self.request)
+                except Exception:
+                    # partial reports the error for this item
+                    continue
+                if not v:
+                    continue
+                if not getattr(v.cls, 'embed_batch_parent', None):
+                    if isinstance(getattr(field, 'view_name', None), basestring):
+                        # Every item embeds the same view, which does not support batches
+                        return
+                    continue
+                if view_kwargs.get(v.cls.embed_batch_lookup_kwarg) == item._id:
+                    parents.setdefault(v.cls, []).append(item.id)
+
+            if not hasattr(self.request._request, '_embed_batches'):
+                self.request._request._embed_batches = {}
+            batches = self.request._request._embed_batches
+            for view_class, parent_ids in parents.items():
+                if len(parent_ids) < 2:
+                    continue
+                view = view_class()
+                try:
+                    with transaction.atomic():
+                        batch = view.get_embed_batch(parent_ids, view.paginator.page_size)
+                except Exception as e:
+                    # Fall back to embedding every item on its own
+                    logger.exception('Could not prefetch {} embeds of {}: {!r}'.format(field_name, view_class.__name__, e))
+                    continue
+                for parent_id, results in batch.items():
+                    batches[(view_class, field_name, parent_id)] = results
+
+        partial.prefetch = prefetch
         return partial
 
     def get_serializer_context(self):
@@ -470,6 +579,13 @@ class BaseContributorList(JSONAPIBaseView, generics.ListAPIView, ListFilterMixin
 
     ordering = ('-modified',)
 
+    embed_batch_parent = 'node'
+    embed_batch_lookup_kwarg = 'node_id'
+    embed_batch_ordering = ('_order',)
+
+    def get_embed_batch_queryset(self, parent_ids):
+        return Contributor.objects.filter(node_id__in=parent_ids).include('user__guids')
+
     def get_default_queryset(self):
         node = self.get_node()
 
@@ -556,43 +672,14 @@ class WaterButlerMixin(object):
 
     def bulk_get_file_nodes_from_wb_resp(self, files_list):
         """Takes a list of file data from wb response, touches/updates metadata for each, and returns list of file objects.
-        This function mirrors all the actions of get_file_node_from_wb_resp except the create and updates are done in bulk.
-        The bulk_update and bulk_create do not call the base class update and create so the actions of those functions are
-        done here where needed
+        This function mirrors all the actions of get_file_node_from_wb_resp except the lookups, creates and updates are
+        done in bulk. See BaseFileNode.bulk_get_or_create_from_waterbutler
         """
-        node = self.get_node(check_object_permissions=False)
-        content_type = ContentType.objects.get_for_model(node)
-
-        objs_to_create = defaultdict(lambda: [])
-        file_objs = []
-
-        for item in files_list:
-            attrs = item['attributes']
-            base_class = BaseFileNode.resolve_class(
-                attrs['provider'],
-                BaseFileNode.FOLDER if attrs['kind'] == 'folder'
-                else BaseFileNode.FILE,
-            )
-
-            # mirrors BaseFileNode get_or_create
-            try:
-                file_obj = base_class.objects.get(target_object_id=node.id, target_content_type=content_type, _path='/' + attrs['path'].lstrip('/'))
-            except base_class.DoesNotExist:
-                # create method on BaseFileNode appends provider, bulk_create bypasses this step so it is added here
-                file_obj = base_class(target=node, _path='/' + attrs['path'].lstrip('/'), provider=base_class._provider)
-                objs_to_create[base_class].append(file_obj)
-            else:
-                file_objs.append(file_obj)
-
-            file_obj.update(None, attrs, user=self.request.user, save=False)
-
-        bulk_update(file_objs)
-
-        for base_class in objs_to_create:
-            base_class.objects.bulk_create(objs_to_create[base_class])
-            file_objs += objs_to_create[base_class]
-
-        return file_objs
+        return BaseFileNode.bulk_get_or_create_from_waterbutler(
+            self.get_node(check_object_permissions=False),
+            files_list,
+            user=self.request.user,
+        )
 
     def get_file_node_from_wb_resp(self, item):
         """Takes file data from wb response, touches/updates metadata for it, and returns file object"""
@@ -2,11 +2,12 @@ from datetime import datetime
 from collections import OrderedDict
 
 from django.core.urlresolvers import resolve, reverse
+from django.db.models import IntegerField, OuterRef, Subquery
 import furl
 import pytz
 
 from framework.auth.core import Auth
-from osf.models import BaseFileNode, OSFUser, Comment, Preprint, AbstractNode
+from osf.models import BaseFileNode, FileVersion, OSFUser, Comment, Preprint, AbstractNode
 from rest_framework import serializers as ser
 from rest_framework.fields import SkipField
 from website import settings
@@ -155,6 +156,10 @@ class BaseFileSerializer(JSONAPISerializer):
         'last_touched',
         'tags',
     ])
+    filter_expressions = {
+        # Size of the latest version, as get_size returns it
+        'size': Subquery(FileVersion.objects.filter(basefilenode=OuterRef('pk')).order_by('-created').values('size')[:1], output_field=IntegerField()),
+    }
     id = IDField(source='_id', read_only=True)
     type = TypeField()
     guid = ser.SerializerMethodField(
@@ -1,3 +1,4 @@
+from django.db.models import Case, CharField, F, Value, When
 from rest_framework import serializers as ser
 from api.base.utils import absolute_reverse
 from api.base.serializers import JSONAPISerializer, RelationshipField, IDField, LinksField
@@ -8,6 +9,9 @@ class RegistrationIdentifierSerializer(JSONAPISerializer):
     category = ser.SerializerMethodField()
 
     filterable_fields = frozenset(['category'])
+    filter_expressions = {
+        'category': Case(When(category='legacy_doi', then=Value('doi')), default=F('category'), output_field=CharField()),
+    }
 
     value = ser.CharField(read_only=True)
 
@@ -10,7 +10,7 @@ from api.base.serializers import (
     VersionedDateTimeField, HideIfRegistration, IDField,
     JSONAPIRelationshipSerializer,
     JSONAPISerializer, LinksField,
-    NodeFileHyperLinkField, RelationshipField,
+    NodeFileHyperLinkField, RelationshipField, related_count,
     ShowIfVersion, TargetTypeField, TypeField,
     WaterbutlerLink, relationship_diff, BaseAPISerializer,
     HideIfWikiDisabled, ShowIfAdminScopeOrAnonymous,
@@ -33,9 +33,9 @@ from addons.base.exceptions import InvalidAuthError, InvalidFolderError
 from addons.osfstorage.models import Region
 from osf.exceptions import NodeStateError
 from osf.models import (
-    Comment, DraftRegistration, Institution,
-    RegistrationSchema, AbstractNode, PrivateLink,
-    RegistrationProvider,
+    Comment, Contributor, DraftRegistration, Institution,
+    RegistrationSchema, AbstractNode, NodeLog, NodeRelation, PrivateLink,
+    RegistrationProvider, StorageUsage,
 )
 from osf.models.external import ExternalAccount
 from osf.models.licenses import NodeLicense
@@ -531,6 +531,20 @@ class NodeSerializer(TaxonomizableSerializerMixin, JSONAPISerializer):
     class Meta:
         type_ = 'nodes'
 
+    # Counts that do not depend on the requesting user; the others are computed per node
+    related_count_aggregates = {
+        'get_logs_count': related_count(NodeLog.objects.all(), 'node'),
+        'get_contrib_count': related_count(Contributor.objects.all(), 'node'),
+        'get_forks_count': related_count(AbstractNode.objects.exclude(type='osf.registration').exclude(is_deleted=True), 'forked_from'),
+        'get_pointers_count': related_count(NodeRelation.objects.filter(is_node_link=True), 'parent'),
+        'get_linked_by_nodes_count': related_count(
+            NodeRelation.objects.filter(is_node_link=True, parent__is_deleted=False, parent__type='osf.node'), 'child',
+        ),
+        'get_linked_by_registrations_count': related_count(
+            NodeRelation.objects.filter(is_node_link=True, parent__type='osf.registration', parent__retraction__isnull=True), 'child',
+        ),
+    }
+
     def get_absolute_url(self, obj):
         return obj.get_absolute_url()
 
@@ -1239,6 +1253,11 @@ class NodeStorageProviderSerializer(JSONAPISerializer):
     def get_id(obj):
         return '{}:{}'.format(obj.node._id, obj.provider)
 
+    def get_meta(self, obj):
+        if obj.provider != 'osfstorage':
+            return None
+        return {'storage_usage': StorageUsage.for_node(obj.node, descendants=False)}
+
     def get_absolute_url(self, obj):
         return absolute_reverse(
             'nodes:node-provider-detail',
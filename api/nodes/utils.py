@@ -10,10 +10,12 @@ import requests
 
 from addons.osfstorage.models import OsfStorageFile, OsfStorageFolder
 from addons.wiki.models import NodeSettings as WikiNodeSettings
-from osf.models import AbstractNode, Preprint, Guid, NodeRelation, Contributor
+from osf.models import AbstractNode, Preprint, Guid, NodeRelation, NodePermissionIndex
 
 from api.base.exceptions import ServiceUnavailableError
 from api.base.utils import get_object_or_error, waterbutler_api_url_for, get_user_auth, has_admin_scope
+from website import settings as website_settings
+from website.files.metadata_cache import metadata_cache
 
 def get_file_object(target, path, provider, request):
     # Don't bother going to waterbutler for osfstorage
@@ -40,6 +42,16 @@ def get_file_object(target, path, provider, request):
         raise NotFound('The {} provider is not configured for this project.'.format(provider))
 
     view_only = request.query_params.get('view_only', default=None)
+    version = request.query_params.get('version', default=None)
+    fingerprint = metadata_cache.credential_fingerprint(
+        authorization=request.META.get('HTTP_AUTHORIZATION'),
+        cookie=request.COOKIES.get(website_settings.COOKIE_NAME),
+        view_only=view_only,
+    )
+    cached = metadata_cache.get(target._id, provider, path, version, fingerprint)
+    if cached is not None:
+        return cached
+
     base_url = None
     if hasattr(target, 'osfstorage_region'):
         base_url = target.osfstorage_region.waterbutler_url
@@ -64,9 +76,11 @@ def get_file_object(target, path, provider, request):
         raise ServiceUnavailableError(detail='Could not retrieve files information at this time.')
 
     try:
-        return waterbutler_request.json()['data']
+        data = waterbutler_request.json()['data']
     except KeyError:
         raise ServiceUnavailableError(detail='Could not retrieve files information at this time.')
+    metadata_cache.set(target._id, provider, path, version, fingerprint, data)
+    return data
 
 def enforce_no_children(request):
     return StrictVersion(request.version) < StrictVersion('2.12')
@@ -82,7 +96,7 @@ class NodeOptimizationMixin(object):
         guid = Guid.objects.filter(content_type_id=abstract_node_contenttype_id, object_id=OuterRef('parent_id'))
         parent = NodeRelation.objects.annotate(parent__id=Subquery(guid.values('_id')[:1])).filter(child=OuterRef('pk'), is_node_link=False)
         wiki_addon = WikiNodeSettings.objects.filter(owner=OuterRef('pk'), deleted=False)
-        contribs = Contributor.objects.filter(user=auth.user, node=OuterRef('pk'))
+        contribs = NodePermissionIndex.objects.filter(user=auth.user, node=OuterRef('pk'), source=NodePermissionIndex.CONTRIBUTOR)
         return queryset.prefetch_related('root').prefetch_related('subjects').annotate(
             user_is_contrib=Exists(contribs),
             contrib_read=Subquery(contribs.values('read')[:1]),
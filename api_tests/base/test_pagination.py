@@ -54,3 +54,32 @@ class TestJSONAPIPagination(ApiTestCase):
         assert_not_in('meta', links)
         assert_in('total', meta)
         assert_in('per_page', meta)
+
+    def test_cursor_pagination_walks_every_node(self):
+        res = self.app.get(self.url_version_2_1, auth=self.user.auth)
+        expected = [node['id'] for node in res.json['data']]
+        expected += [node['id'] for node in self.app.get(res.json['links']['next'], auth=self.user.auth).json['data']]
+
+        res = self.app.get(self.url_version_2_1 + '&page[cursor]=', auth=self.user.auth)
+        assert_equal(res.status_code, 200)
+        assert_is_none(res.json['links']['prev'])
+        assert_is_none(res.json['links']['last'])
+        assert_true(res.json['meta']['total_is_estimate'])
+        first_page = [node['id'] for node in res.json['data']]
+        assert_equal(len(first_page), 10)
+
+        res = self.app.get(res.json['links']['next'], auth=self.user.auth)
+        assert_equal(first_page + [node['id'] for node in res.json['data']], expected)
+        assert_is_none(res.json['links']['next'])
+
+        res = self.app.get(res.json['links']['prev'], auth=self.user.auth)
+        assert_equal([node['id'] for node in res.json['data']], first_page)
+
+    def test_cursor_pagination_exact_total(self):
+        res = self.app.get(self.url_version_2_1 + '&page[cursor]=&page[total]=exact', auth=self.user.auth)
+        assert_equal(res.json['meta']['total'], 11)
+        assert_not_in('total_is_estimate', res.json['meta'])
+
+    def test_invalid_cursor(self):
+        res = self.app.get(self.url_version_2_1 + '&page[cursor]=fish', auth=self.user.auth, expect_errors=True)
+        assert_equal(res.status_code, 404)
@@ -3,7 +3,9 @@ import httplib as http
 import importlib
 import pkgutil
 
+import mock
 import pytest
+from django.http import QueryDict
 from pytz import utc
 from datetime import datetime
 import urllib
@@ -18,9 +20,11 @@ from tests.utils import make_drf_request_with_version
 from api.base.settings.defaults import API_BASE
 from api.base.serializers import JSONAPISerializer, BaseAPISerializer
 from api.base import serializers as base_serializers
+from api.base.exceptions import InvalidQueryStringError
 from api.nodes.serializers import NodeSerializer, RelationshipField
 from api.waffle.serializers import WaffleSerializer, BaseWaffleSerializer
 from api.registrations.serializers import RegistrationSerializer
+from osf.models import AbstractNode
 
 SER_MODULES = []
 for loader, name, _ in pkgutil.iter_modules(['api']):
@@ -177,6 +181,47 @@ class TestNullLinks(ApiTestCase):
         assert_not_in('null_link_field', rep['relationships'])
 
 
+class TestFieldPlans(ApiTestCase):
+
+    def setUp(self):
+        super(TestFieldPlans, self).setUp()
+        base_serializers._field_plans.clear()
+
+    def test_fields_are_partitioned(self):
+        req = make_drf_request_with_version(version='2.0')
+        invalid_embeds, plan = FakeSerializer(context={'request': req}).get_field_plan(False, {})
+        assert_equal(invalid_embeds, frozenset())
+        kinds = {entry.name: entry.kind for _, _, entry in plan}
+        assert_equal(kinds, {
+            'links': base_serializers.FieldPlanEntry.LINKS,
+            'null_link_field': base_serializers.FieldPlanEntry.RELATIONSHIP,
+            'valued_link_field': base_serializers.FieldPlanEntry.RELATIONSHIP,
+        })
+
+    def test_plan_is_compiled_once_per_class(self):
+        req = make_drf_request_with_version(version='2.0')
+        with mock.patch.object(FakeSerializer, '_compile_field_plan', autospec=True, side_effect=FakeSerializer._compile_field_plan) as compile_plan:
+            first = FakeSerializer(FakeModel, context={'request': req}).data['data']
+            second = FakeSerializer(FakeModel, context={'request': req}).data['data']
+        assert_equal(compile_plan.call_count, 1)
+        assert_equal(first, second)
+
+    def test_invalid_embeds_are_rejected_for_every_object(self):
+        req = make_drf_request_with_version(version='2.0')
+        serializer = FakeSerializer(context={'request': req, 'embed': {'links': None}})
+        for _ in range(2):
+            with assert_raises(InvalidQueryStringError):
+                serializer.to_representation(FakeModel)
+
+    def test_sparse_fieldsets_have_their_own_plans(self):
+        req = make_drf_request_with_version(version='2.0')
+        FakeSerializer(FakeModel, context={'request': req}).data
+        req._request.GET = QueryDict('fields[foos]=valued_link_field')
+        rep = FakeSerializer(FakeModel, context={'request': req}).data['data']
+        assert_in('valued_link_field', rep['relationships'])
+        assert_equal(len(base_serializers._field_plans), 2)
+
+
 class TestApiBaseSerializers(ApiTestCase):
 
     def setUp(self):
@@ -347,6 +392,24 @@ class TestApiBaseSerializers(ApiTestCase):
                 else:
                     assert_not_in('count', link.get('meta', {}))
 
+    def test_related_counts_of_list_page_match_detail(self):
+        url = '/{}nodes/{}/children/'.format(API_BASE, self.node._id)
+        self.node.nodes[0].add_pointer(self.linked_node, auth=self.auth)
+        res = self.app.get(url, params={'related_counts': True})
+        assert_equal(len(res.json['data']), 5)
+        for node in res.json['data']:
+            detail = self.app.get('/{}nodes/{}/'.format(API_BASE, node['id']), params={'related_counts': True})
+            assert_equal(node['relationships'], detail.json['data']['relationships'])
+
+    def test_related_counts_of_list_page_are_annotated_at_once(self):
+        url = '/{}nodes/{}/children/'.format(API_BASE, self.node._id)
+        with mock.patch.object(NodeSerializer, 'get_logs_count') as get_logs_count:
+            res = self.app.get(url, params={'related_counts': 'logs'})
+        assert_false(get_logs_count.called)
+        for node in res.json['data']:
+            logs_count = AbstractNode.load(node['id']).logs.count()
+            assert_equal(node['relationships']['logs']['links']['related']['meta']['count'], logs_count)
+
     def test_error_when_requesting_related_counts_for_attribute_field(self):
 
         res = self.app.get(
@@ -119,6 +119,18 @@ class TestRegistrationIdentifierList:
         total = new_res.json['links']['meta']['total']
         assert total == carpid_total
 
+    def test_identifier_filter_by_serialized_category(
+            self, app, registration, identifier_registration,
+            url_registration_identifiers
+    ):
+        legacy_doi = IdentifierFactory(referent=registration, category='legacy_doi')
+        res = app.get('{}?filter[category]=doi'.format(url_registration_identifiers))
+        assert [item['id'] for item in res.json['data']] == [legacy_doi._id]
+        assert res.json['data'][0]['attributes']['category'] == 'doi'
+
+        res = app.get('{}?filter[category]=legacy_doi'.format(url_registration_identifiers))
+        assert res.json['data'] == []
+
     def test_node_identifier_not_returned_from_registration_endpoint(
             self, identifier_node, identifier_registration,
             res_registration_identifiers,
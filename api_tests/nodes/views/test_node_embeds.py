@@ -155,3 +155,24 @@ class TestNodeEmbeds:
         res = app.get(url, auth=write_contrib_one.auth)
         assert res.status_code == 200
         assert res.json['data']['embeds']['contributors']['meta']['total_bibliographic'] == 3
+
+    def test_embed_contributors_of_list_page(
+            self, app, user, auth, root_node,
+            child_one, child_two):
+        for _ in range(11):
+            child_two.add_contributor(AuthUserFactory(), auth=auth, save=True)
+
+        url = '/{}nodes/{}/children/?version=2.1&embed=contributors'.format(API_BASE, root_node._id)
+        res = app.get(url, auth=user.auth)
+        assert res.status_code == 200
+        embeds = {node['id']: node['embeds']['contributors'] for node in res.json['data']}
+        assert len(embeds) == 2
+        assert embeds[child_two._id]['meta']['total'] == 12
+        assert len(embeds[child_two._id]['data']) == 10
+        assert embeds[child_two._id]['links']['next'] is not None
+
+        # Each embed matches the embed of the node on its own
+        for node in (child_one, child_two):
+            url = '/{}nodes/{}/?version=2.1&embed=contributors'.format(API_BASE, node._id)
+            detail = app.get(url, auth=user.auth).json['data']['embeds']['contributors']
+            assert embeds[node._id] == detail
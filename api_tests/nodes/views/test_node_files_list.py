@@ -10,6 +10,7 @@ from framework.auth.core import Auth
 
 from addons.github.models import GithubFolder
 from addons.github.tests.factories import GitHubAccountFactory
+from addons.osfstorage import settings as osfstorage_settings
 from api.base.settings.defaults import API_BASE
 from api.base.utils import waterbutler_api_url_for
 from api_tests import utils as api_utils
@@ -575,6 +576,27 @@ class TestNodeFilesListFiltering(ApiTestCase):
         assert_equal(res.status_code, 400)
         assert_equal(len(res.json['errors']), 1)
 
+    def test_node_files_osfstorage_are_filterable_by_size(self):
+        api_utils.create_test_file(self.project, self.user, filename='large')
+        small = api_utils.create_test_file(self.project, self.user, filename='small')
+        small.create_version(self.user, {
+            'object': '07d80a',
+            'service': 'cloud',
+            osfstorage_settings.WATERBUTLER_RESOURCE: 'osf',
+        }, {
+            'size': 10,
+            'contentType': 'img/png'
+        }).save()
+
+        url = '/{}nodes/{}/files/osfstorage/?filter[size]=10'.format(API_BASE, self.project._id)
+        res = self.app.get(url, auth=self.user.auth)
+        assert_equal(res.status_code, 200)
+        assert_equal([item['attributes']['name'] for item in res.json['data']], ['small'])
+
+        url = '/{}nodes/{}/files/osfstorage/?filter[size]=big'.format(API_BASE, self.project._id)
+        res = self.app.get(url, auth=self.user.auth, expect_errors=True)
+        assert_equal(res.status_code, 400)
+
 
 class TestNodeFilesListPagination(ApiTestCase):
     def setUp(self):
@@ -103,6 +103,24 @@ class TestNodeList:
         assert public_project._id in ids
         assert private_project._id not in ids
 
+    def test_node_list_includes_node_after_claiming_unregistered_contributor(
+            self, app, user, private_project, url):
+        unreg = private_project.add_unregistered_contributor(
+            'Unclaimed Contributor',
+            'unclaimed@example.com',
+            auth=Auth(user),
+            save=True)
+        claimer = AuthUserFactory()
+
+        private_project.replace_contributor(old=unreg, new=claimer)
+        private_project.save()
+
+        assert private_project.can_view(Auth(claimer))
+        res = app.get(url, auth=claimer.auth)
+        ids = [each['id'] for each in res.json['data']]
+        assert private_project._id in ids
+        assert not private_project.can_view(Auth(unreg))
+
     def test_node_list_does_not_returns_registrations(
             self, app, user, public_project, url):
         registration = RegistrationFactory(
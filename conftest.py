@@ -47,6 +47,8 @@ def override_settings():
     website_settings.BCRYPT_LOG_ROUNDS = 1
     # Make sure we don't accidentally send any emails
     website_settings.SENDGRID_API_KEY = None
+    # Tests mock WaterButler responses per request
+    website_settings.WATERBUTLER_METADATA_CACHE_TIMEOUT = 0
     # Set this here instead of in SILENT_LOGGERS, in case developers
     # call setLevel in local.py
     logging.getLogger('website.mails.mails').setLevel(logging.CRITICAL)
@@ -73,10 +75,6 @@ _MOCKS = {
         'mark': 'enable_implicit_clean',
         'replacement': lambda *args, **kwargs: None,
     },
-    'osf.models.base._check_blacklist': {
-        'mark': 'enable_blacklist_check',
-        'replacement': lambda *args, **kwargs: False,
-    },
     'website.search.search.search_engine': {
         'mark': 'enable_search',
         'replacement': mock.MagicMock()
@@ -2,17 +2,16 @@
 
 import logging
 
-from framework.celery_tasks import app
-from framework.postcommit_tasks.handlers import run_postcommit
-
 logger = logging.getLogger(__name__)
 
 
-@run_postcommit(once_per_request=False, celery=True)
-@app.task(max_retries=5, default_retry_delay=60)
 def increment_user_activity_counters(user_id, action, date_string):
+    """Log an increment; logged increments are applied in batches by the
+    ``flush_user_activity_counters`` task.
+    """
     from osf.models import UserActivityCounter
-    return UserActivityCounter.increment(user_id, action, date_string)
+    UserActivityCounter.record(user_id, action, date_string)
+    return True
 
 
 def get_total_activity_count(user_id):
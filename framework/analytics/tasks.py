@@ -0,0 +1,34 @@
+# encoding: utf-8
+import logging
+
+from framework.celery_tasks import app as celery_app
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(ignore_results=True)
+def flush_user_activity_counters():
+    """Apply logged activity increments to the user activity counters."""
+    from osf.models import UserActivityCounter
+    flush_lag = UserActivityCounter.flush_lag()
+    result = UserActivityCounter.flush_deltas()
+    if result is None:
+        logger.info('Activity counter flush already in progress, flush lag {:.0f}s'.format(flush_lag))
+        return
+    flushed, dropped = result
+    log = logger.error if dropped else logger.info
+    log('Flushed {} activity increments, dropped {}, flush lag {:.0f}s'.format(flushed, dropped, flush_lag))
+
+
+@celery_app.task(ignore_results=True)
+def rollup_page_views():
+    """Fold logged page views into the daily and total page counters."""
+    from osf.models import PageCounter
+    rolled_up = PageCounter.rollup()
+    if rolled_up is None:
+        logger.info('Page view rollup already in progress')
+    else:
+        logger.info('Rolled up {} page views'.format(rolled_up))
+    pruned = PageCounter.prune_visitors()
+    if pruned:
+        logger.info('Pruned {} page visitors'.format(pruned))
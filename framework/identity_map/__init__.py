@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Request-scoped identity map for model ``load`` calls.
+
+While a map is active (see ``framework.identity_map.handlers``), repeated
+``load`` calls for the same model and key return the instance that was already
+loaded during the request instead of querying the database again. Instances are
+evicted when they are saved, deleted or refreshed.
+"""
+import collections
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Cumulative counters for all requests handled by this process
+counters = collections.Counter()
+
+
+class IdentityMap(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._objects = {}
+        # (concrete model, pk) -> keys under which that row is cached
+        self._keys_by_row = collections.defaultdict(set)
+
+    @staticmethod
+    def _row(instance):
+        return (instance._meta.concrete_model, instance.pk)
+
+    def get(self, key):
+        instance = self._objects.get(key)
+        if instance is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return instance
+
+    def add(self, key, instance):
+        if instance is None or instance.pk is None:
+            return
+        self._objects[key] = instance
+        self._keys_by_row[self._row(instance)].add(key)
+
+    def discard(self, instance):
+        for key in self._keys_by_row.pop(self._row(instance), ()):
+            self._objects.pop(key, None)
+
+    def clear(self):
+        self._objects.clear()
+        self._keys_by_row.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._objects)}
+
+
+def get_identity_map():
+    """Return the identity map of the current request, or None if none is active."""
+    return getattr(_local, 'identity_map', None)
+
+
+def activate():
+    _local.identity_map = IdentityMap()
+    return _local.identity_map
+
+
+def deactivate():
+    identity_map = get_identity_map()
+    _local.identity_map = None
+    if identity_map is not None:
+        counters['hits'] += identity_map.hits
+        counters['misses'] += identity_map.misses
+    return identity_map
+
+
+def discard(instance):
+    """Evict ``instance`` from the active identity map, if any."""
+    identity_map = get_identity_map()
+    if identity_map is not None and instance.pk is not None:
+        identity_map.discard(instance)
+
+
+def identity_mapped(load):
+    """Decorator for ``load`` classmethods that consults the active identity map.
+    Loads with ``select_for_update`` always go to the database.
+    """
+    @functools.wraps(load)
+    def wrapped(cls, data, select_for_update=False):
+        identity_map = get_identity_map()
+        if identity_map is None or select_for_update or not data:
+            return load(cls, data, select_for_update=select_for_update)
+        key = (cls, data)
+        instance = identity_map.get(key)
+        if instance is None:
+            instance = load(cls, data, select_for_update=select_for_update)
+            identity_map.add(key, instance)
+        return instance
+    return wrapped
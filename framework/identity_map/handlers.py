@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from framework import identity_map
+from website import settings
+
+logger = logging.getLogger(__name__)
+
+
+def identity_map_before_request():
+    if settings.ENABLE_IDENTITY_MAP:
+        identity_map.activate()
+
+
+def identity_map_after_request(response):
+    identity_map_teardown_request()
+    return response
+
+
+def identity_map_teardown_request(error=None):
+    current = identity_map.deactivate()
+    if current is not None:
+        logger.debug('Identity map stats: {}'.format(current.stats()))
+
+
+handlers = {
+    'before_request': identity_map_before_request,
+    'after_request': identity_map_after_request,
+    'teardown_request': identity_map_teardown_request,
+}
@@ -16,3 +16,6 @@ class AppConfig(BaseAppConfig):
             update_permission_groups,
             dispatch_uid='osf.apps.update_permissions_groups'
         )
+        # Every addon's file node classes are defined by now
+        from osf.models import BaseFileNode
+        BaseFileNode.build_class_registry()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from addons.osfstorage.models import OsfStorageFile
+from osf.models import Node, OSFUser
+
+logger = logging.getLogger(__name__)
+
+
+class Rollback(Exception):
+    pass
+
+
+def build_folder(node, size, branching):
+    """Create a folder in ``node``'s osfstorage holding ``size`` files, spread over
+    subfolders of up to ``branching`` files each.
+    """
+    folder = node.get_addon('osfstorage').get_root().append_folder('Benchmark folder')
+    files, created = [], 0
+    while created < size:
+        subfolder = folder.append_folder('Benchmark subfolder {}'.format(created))
+        for i in range(min(branching, size - created)):
+            name = 'Benchmark file {}'.format(created)
+            files.append(OsfStorageFile(
+                name=name,
+                target=node,
+                parent=subfolder,
+                _path='',
+                _materialized_path=subfolder.materialized_path + name,
+            ))
+            created += 1
+    OsfStorageFile.objects.bulk_create(files)
+    return folder
+
+
+def benchmark(user, size, branching):
+    source = Node.objects.create(title='Benchmark source', category='project', creator=user)
+    destination = Node.objects.create(title='Benchmark destination', category='project', creator=user)
+    folder = build_folder(source, size, branching)
+    destination_root = destination.get_addon('osfstorage').get_root()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        folder.move_under(destination_root)
+        elapsed = time.time() - start
+    return {
+        'seconds': elapsed,
+        'queries': len(queries),
+    }
+
+
+class Command(BaseCommand):
+    """Time moving OsfStorage folders of synthetic files between projects. All changes are rolled back."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'user',
+            type=str,
+            help='Guid of the user who creates the projects',
+        )
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[1000, 10000],
+            help='Number of files in each benchmarked folder',
+        )
+        parser.add_argument(
+            '--branching',
+            type=int,
+            default=100,
+            help='Maximum number of files per subfolder',
+        )
+
+    def handle(self, *args, **options):
+        user = OSFUser.load(options['user'])
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    result = benchmark(user, size, options['branching'])
+                    raise Rollback()
+            except Rollback:
+                pass
+            logger.info('move of {} files: {:.3f}s, {} queries'.format(size, result['seconds'], result['queries']))
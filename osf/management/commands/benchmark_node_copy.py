@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import time
+
+import bson
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from framework.auth import Auth
+from framework.exceptions import PermissionsError
+from osf.models import Node, NodeLog, NodeRelation, OSFUser
+from osf.utils.permissions import CREATOR_PERMISSIONS
+from website import language
+from website.project import signals as project_signals
+
+logger = logging.getLogger(__name__)
+
+
+class Rollback(Exception):
+    pass
+
+
+def build_tree(user, size, branching):
+    """Create a project with ``size`` nodes in total, each with up to ``branching`` components."""
+    root = Node.objects.create(title='Benchmark root', category='project', creator=user)
+    queue, created = [root], 1
+    while created < size:
+        parent = queue.pop(0)
+        for i in range(min(branching, size - created)):
+            child = Node(title='Benchmark component {}'.format(created), category='data', creator=user, parent=parent)
+            child.save()
+            queue.append(child)
+            created += 1
+    return root
+
+
+def recursive_fork(node, auth, title=None, parent=None):
+    """Fork ``node`` one node at a time, as ``fork_node`` did before BulkNodeForker.
+    Used as the baseline for the bulk fork.
+    """
+    user = auth.user
+    if not (node.is_public or node.has_permission(user, 'read')):
+        raise PermissionsError('{0!r} does not have permission to fork node {1!r}'.format(user, node._id))
+    when = timezone.now()
+
+    forked = node.clone()
+    forked.custom_citation = ''
+    forked.is_fork = True
+    forked.forked_date = when
+    forked.forked_from = node
+    forked.creator = user
+    forked.node_license = node.license.copy() if node.license else None
+    forked.wiki_private_uuids = {}
+    forked.is_public = False
+    forked.save()
+
+    forked.tags.add(*node.all_tags.values_list('pk', flat=True))
+    forked.subjects.add(*node.subjects.values_list('pk', flat=True))
+
+    if parent:
+        node_relation = NodeRelation.objects.get(parent=parent.forked_from, child=node)
+        NodeRelation.objects.get_or_create(_order=node_relation._order, parent=parent, child=forked)
+
+    for node_relation in node.node_relations.filter(child__is_deleted=False):
+        if not node_relation.is_node_link:
+            try:
+                recursive_fork(node_relation.child, auth, title='', parent=forked)
+            except PermissionsError:
+                pass
+        else:
+            NodeRelation.objects.get_or_create(is_node_link=True, parent=forked, child=node_relation.child)
+
+    forked.title = ('Fork of ' + node.title if title is None else title or node.title)[:512]
+    forked.add_contributor(contributor=user, permissions=CREATOR_PERMISSIONS, log=False, save=False)
+    forked.root = None
+    forked.add_log(
+        action=NodeLog.NODE_FORKED,
+        params={
+            'parent_node': node.parent_id,
+            'node': node._primary_key,
+            'registration': forked._primary_key,
+            'fork': forked._primary_key,
+        },
+        auth=auth,
+        log_date=when,
+        save=False,
+    )
+    NodeLog.objects.bulk_create([
+        NodeLog(
+            _id=bson.ObjectId(), action=log.action, date=log.date, params=log.params,
+            should_hide=log.should_hide, foreign_user=log.foreign_user, node_id=forked.pk,
+            user_id=log.user_id, original_node_id=log.original_node_id,
+        )
+        for log in node.logs.order_by('pk')
+    ])
+    for addon in node.get_addons():
+        addon.after_fork(node, forked, user)
+    forked.save()
+    project_signals.contributor_added.send(forked, contributor=user, auth=auth, email_template='false')
+    return forked
+
+
+def recursive_template(node, auth, top_level=True, parent=None):
+    """Template ``node`` one node at a time, as ``use_as_template`` did before
+    BulkNodeTemplater. Used as the baseline for the bulk template.
+    """
+    if not (node.is_public or node.has_permission(auth.user, 'read')):
+        raise PermissionsError('{0!r} does not have permission to template node {1!r}'.format(auth.user, node._id))
+
+    new = node.clone()
+    new._is_templated_clone = True
+    new.wiki_private_uuids.clear()
+    new.file_guid_to_share_uuids.clear()
+    new.is_public = False
+    new.description = ''
+    new.custom_citation = ''
+    new.creator = auth.user
+    new.template_node = node
+    new.save(suppress_log=True)
+    new.add_contributor(contributor=auth.user, permissions=CREATOR_PERMISSIONS, log=False, save=False)
+    new.is_fork = False
+    new.node_license = node.license.copy() if node.license else None
+    if top_level and language.TEMPLATED_FROM_PREFIX not in new.title:
+        new.title = ''.join((language.TEMPLATED_FROM_PREFIX, new.title,))
+    new.title = new.title[:512]
+    new.created = timezone.now()
+    new.save(suppress_log=True)
+    project_signals.contributor_added.send(new, contributor=auth.user, auth=auth, email_template='false')
+
+    new.add_log(
+        NodeLog.CREATED_FROM,
+        params={
+            'node': new._primary_key,
+            'template_node': {'id': node._primary_key, 'url': node.url, 'title': node.title},
+        },
+        auth=auth,
+        log_date=new.created,
+        save=False,
+    )
+    new.save()
+
+    if parent:
+        node_relation = NodeRelation.objects.get(parent=parent.template_node, child=node)
+        NodeRelation.objects.get_or_create(_order=node_relation._order, parent=parent, child=new)
+
+    for node_relation in node.node_relations.select_related('child').filter(child__is_deleted=False):
+        if not node_relation.is_node_link:
+            try:
+                recursive_template(node_relation.child, auth, top_level=False, parent=new)
+            except PermissionsError:
+                pass
+
+    new.root = None
+    new.save()
+    return new
+
+
+def benchmark(user, operation, size, branching, implementation):
+    with CaptureQueriesContext(connection) as queries:
+        root = build_tree(user, size, branching)
+        setup_queries = len(queries)
+        start = time.time()
+        report = None
+        if implementation == 'recursive':
+            copy = recursive_fork if operation == 'fork' else recursive_template
+            copy(root, Auth(user))
+        elif operation == 'fork':
+            report = root.fork_node(Auth(user)).fork_report
+        else:
+            report = root.use_as_template(Auth(user)).template_report
+        elapsed = time.time() - start
+    return {
+        'seconds': elapsed,
+        'queries': len(queries) - setup_queries,
+        'report': report.to_dict() if report else {},
+    }
+
+
+class Command(BaseCommand):
+    """Time forking and templating of synthetic node trees with the bulk copiers and
+    with the recursive implementations they replaced. All changes are rolled back.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'user',
+            type=str,
+            help='Guid of the user who creates, forks and templates the trees',
+        )
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10, 100, 500],
+            help='Number of nodes in each benchmarked tree',
+        )
+        parser.add_argument(
+            '--branching',
+            type=int,
+            default=5,
+            help='Maximum number of components per node',
+        )
+        parser.add_argument(
+            '--operations',
+            nargs='+',
+            choices=['fork', 'template'],
+            default=['fork', 'template'],
+        )
+        parser.add_argument(
+            '--implementations',
+            nargs='+',
+            choices=['bulk', 'recursive'],
+            default=['bulk', 'recursive'],
+            help='Copy with the bulk copiers, the recursive baseline, or both',
+        )
+
+    def handle(self, *args, **options):
+        user = OSFUser.load(options['user'])
+        for operation in options['operations']:
+            for size in options['sizes']:
+                for implementation in options['implementations']:
+                    try:
+                        with transaction.atomic():
+                            result = benchmark(user, operation, size, options['branching'], implementation)
+                            raise Rollback()
+                    except Rollback:
+                        pass
+                    logger.info('{} {} of {} nodes: {:.3f}s, {} queries, {}'.format(
+                        implementation, operation, size, result['seconds'], result['queries'], result['report']
+                    ))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpRequest
+from rest_framework.request import Request
+
+from api.base import serializers as base_serializers
+from api.nodes.serializers import NodeSerializer
+from osf.models import Node
+
+logger = logging.getLogger(__name__)
+
+
+def make_request(query_string=''):
+    http_request = HttpRequest()
+    http_request.META['SERVER_NAME'] = 'localhost'
+    http_request.META['SERVER_PORT'] = 8000
+    http_request.META['QUERY_STRING'] = query_string
+    request = Request(http_request)
+    request.parser_context['kwargs'] = {'version': 'v2'}
+    request.version = '2.0'
+    return request
+
+
+def serialize(nodes, query_string, compiled):
+    """Serialize ``nodes`` with one NodeSerializer, as a list view does. Unless ``compiled``,
+    field plans are recompiled for every node, as they were before plans were cached.
+    """
+    serializer = NodeSerializer(context={'request': make_request(query_string)})
+    start = time.time()
+    for node in nodes:
+        if not compiled:
+            base_serializers._field_plans.clear()
+            serializer._bound_field_plans = None
+            serializer._sparse_fields_parsed = False
+        serializer.to_representation(node)
+    return time.time() - start
+
+
+class Command(BaseCommand):
+    """Time JSONAPISerializer.to_representation of a page of public nodes with compiled field
+    plans against recompiling the plan for every node.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=100,
+            help='Number of nodes serialized per run',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=10,
+            help='Number of runs of each mode; the fastest is reported',
+        )
+        parser.add_argument(
+            '--query',
+            type=str,
+            default='',
+            help='Query string of the simulated request, e.g. "fields[nodes]=title,description"',
+        )
+
+    def handle(self, *args, **options):
+        nodes = list(Node.objects.filter(is_public=True, is_deleted=False).order_by('-id')[:options['size']])
+        # Warm up caches that are unrelated to field plans, e.g. URL resolvers
+        serialize(nodes, options['query'], compiled=True)
+        timings = {}
+        for compiled in (False, True):
+            timings[compiled] = min(serialize(nodes, options['query'], compiled) for _ in range(options['runs']))
+        logger.info('{} nodes: {:.4f}s recompiling field plans, {:.4f}s with compiled plans ({:.1f}% faster)'.format(
+            len(nodes), timings[False], timings[True],
+            100.0 * (timings[False] - timings[True]) / timings[False] if timings[False] else 0,
+        ))
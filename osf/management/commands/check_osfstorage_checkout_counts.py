@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from addons.osfstorage.models import OsfStorageFolder
+
+logger = logging.getLogger(__name__)
+
+
+def check_checkout_counts(repair=False):
+    """Compare stored OsfStorage folder checkout counts against the checked out file nodes
+    below each folder. Return the number of drifted folders, repairing them if ``repair``.
+    """
+    drifted = OsfStorageFolder.checkout_count_drift()
+    for folder_id, stored, expected in drifted:
+        logger.info('Folder {}: stored {} checkouts, expected {}'.format(folder_id, stored, expected))
+    if repair and drifted:
+        with transaction.atomic():
+            for folder_id, _, expected in drifted:
+                OsfStorageFolder.objects.filter(id=folder_id).update(checkout_count=expected)
+    return len(drifted)
+
+
+class Command(BaseCommand):
+    """Report, and optionally repair, OsfStorage folders whose maintained checkout count
+    does not match the checked out file nodes in their subtree.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            dest='repair',
+            help='Rewrite drifted counts',
+        )
+
+    def handle(self, *args, **options):
+        drifted = check_checkout_counts(repair=options['repair'])
+        logger.info('{} {} folders with drifted checkout counts'.format(
+            'Repaired' if options['repair'] else 'Found', drifted
+        ))
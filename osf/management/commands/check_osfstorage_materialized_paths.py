@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_bulk_update.helper import bulk_update
+
+from addons.osfstorage.models import OsfStorageFileNode
+from osf.models.files import TrashedFileNode
+
+logger = logging.getLogger(__name__)
+
+
+def check_materialized_paths(batch_size=1000, repair=False):
+    """Compare stored OsfStorage materialized paths against the paths computed from the
+    file tree. Return the number of drifted file nodes, repairing them if ``repair``.
+    """
+    queryset = (
+        OsfStorageFileNode.objects
+        .filter(provider='osfstorage')
+        .exclude(type__in=TrashedFileNode._typedmodels_subtypes)
+        .order_by('id')
+    )
+    last_id, drifted = 0, 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        expected = OsfStorageFileNode.resolve_materialized_paths(batch)
+        stale = []
+        for file_node in batch:
+            path = expected.get(file_node.pk)
+            if path is not None and file_node._materialized_path != path:
+                logger.info('{} ({}): stored {!r}, expected {!r}'.format(file_node._id, file_node.pk, file_node._materialized_path, path))
+                file_node._materialized_path = path
+                stale.append(file_node)
+        drifted += len(stale)
+        if repair and stale:
+            with transaction.atomic():
+                bulk_update(stale, update_fields=['_materialized_path'])
+    return drifted
+
+
+class Command(BaseCommand):
+    """Report, and optionally repair, OsfStorage file nodes whose stored materialized path
+    does not match their position in the file tree.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            dest='repair',
+            help='Rewrite drifted paths',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of file nodes checked per query',
+        )
+
+    def handle(self, *args, **options):
+        drifted = check_materialized_paths(batch_size=options['batch_size'], repair=options['repair'])
+        logger.info('{} {} file nodes with drifted materialized paths'.format(
+            'Repaired' if options['repair'] else 'Found', drifted
+        ))
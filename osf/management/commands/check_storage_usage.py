@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from osf.models import StorageUsage
+
+logger = logging.getLogger(__name__)
+
+
+def check_storage_usage(repair=False):
+    """Compare the stored OSFStorage usage of nodes against their file versions. Return the
+    number of drifted (node, region) counters, recomputing their nodes if ``repair``.
+    """
+    drifted = StorageUsage.drift()
+    for node_id, region_id, usage, deleted_usage, exact_usage, exact_deleted_usage in drifted:
+        logger.info('Node {} in region {}: stored {}b used and {}b deleted, expected {}b and {}b'.format(
+            node_id, region_id, usage, deleted_usage, exact_usage, exact_deleted_usage
+        ))
+    if repair:
+        StorageUsage.repair([row[0] for row in drifted])
+    return len(drifted)
+
+
+class Command(BaseCommand):
+    """Report, and optionally repair, nodes whose maintained OSFStorage usage does not match
+    the sizes of the file versions of their files.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            dest='repair',
+            help='Recompute drifted counters',
+        )
+
+    def handle(self, *args, **options):
+        drifted = check_storage_usage(repair=options['repair'])
+        logger.info('{} {} drifted storage usage counters'.format(
+            'Repaired' if options['repair'] else 'Found', drifted
+        ))
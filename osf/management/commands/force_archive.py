@@ -131,9 +131,7 @@ PERMISSIBLE_ADDONS = {
 def complete_archive_target(reg, addon_short_name):
     archive_job = reg.archive_job
     target = archive_job.get_target(addon_short_name)
-    target.status = ARCHIVER_SUCCESS
-    target.save()
-    archive_job._post_update_target()
+    archive_job.update_target(addon_short_name, ARCHIVER_SUCCESS, stat_result=target.stat_result, errors=target.errors)
 
 def perform_wb_copy(reg, node_settings):
     src, dst, user = reg.archive_job.info()
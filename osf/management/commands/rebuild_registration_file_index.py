@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from osf.models import Registration, RegistrationFileIndex
+
+logger = logging.getLogger(__name__)
+
+
+def registrations_with_file_questions(missing_only=False):
+    """Yield the root registrations with a schema that lets users select files."""
+    registrations = Registration.objects.filter(id=F('root_id'), is_deleted=False)
+    if missing_only:
+        registrations = registrations.filter(file_index__isnull=True)
+    for registration in registrations.prefetch_related('registered_schema'):
+        if any(schema.has_files for schema in registration.registered_schema.all()):
+            yield registration
+
+
+def rebuild_file_index(registrations):
+    for registration in registrations:
+        try:
+            num_files = RegistrationFileIndex.build(registration)
+        except Exception as e:
+            logger.error('Could not index the files of registration {}: {!r}'.format(registration._id, e))
+        else:
+            logger.info('Indexed {} files of registration {}'.format(num_files, registration._id))
+
+
+class Command(BaseCommand):
+    """Rebuild the RegistrationFileIndex of registrations, which is used to find the archived
+    copies of files selected in registration schemas.
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'registrations',
+            type=str,
+            nargs='*',
+            help='Guids of root registrations to rebuild. Defaults to every registration with file questions',
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            dest='missing',
+            help='Only index registrations that have no index rows yet',
+        )
+
+    def handle(self, *args, **options):
+        if options['registrations']:
+            registrations = [Registration.load(guid) for guid in options['registrations']]
+            if options['missing']:
+                registrations = [each for each in registrations if not each.file_index.exists()]
+        else:
+            registrations = registrations_with_file_questions(missing_only=options['missing'])
+        rebuild_file_index(registrations)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-07 15:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_CLOSURE = """
+    INSERT INTO osf_noderelationclosure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE closure AS (
+        SELECT
+            parent_id AS ancestor_id,
+            child_id AS descendant_id,
+            1 AS depth,
+            ARRAY[parent_id, child_id] AS path
+        FROM osf_noderelation
+        WHERE is_node_link IS FALSE AND parent_id != child_id
+    UNION ALL
+        SELECT
+            C.ancestor_id,
+            R.child_id,
+            C.depth + 1,
+            C.path || R.child_id
+        FROM closure AS C
+        JOIN osf_noderelation AS R ON R.parent_id = C.descendant_id
+        WHERE R.is_node_link IS FALSE AND NOT R.child_id = ANY(C.path)
+    ) SELECT ancestor_id, descendant_id, MIN(depth)
+      FROM closure
+      GROUP BY ancestor_id, descendant_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0154_remove_ember_project_registrations_flag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeRelationClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_closures', to='osf.AbstractNode')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_closures', to='osf.AbstractNode')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='noderelationclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='noderelationclosure',
+            index_together=set([('descendant', 'depth')]),
+        ),
+        migrations.RunSQL(POPULATE_CLOSURE, 'DELETE FROM osf_noderelationclosure;'),
+    ]
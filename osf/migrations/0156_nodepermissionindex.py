@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-09 14:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_INDEX = """
+    INSERT INTO osf_nodepermissionindex (user_id, node_id, read, write, admin, source)
+    SELECT user_id, node_id, read, write, admin, 'contributor'
+    FROM osf_contributor;
+
+    INSERT INTO osf_nodepermissionindex (user_id, node_id, read, write, admin, source)
+    SELECT DISTINCT C.user_id, R.descendant_id, TRUE, FALSE, FALSE, 'implicit_admin'
+    FROM osf_noderelationclosure AS R
+    JOIN osf_contributor AS C ON C.node_id = R.ancestor_id
+    WHERE C.admin IS TRUE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0155_noderelationclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodePermissionIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read', models.BooleanField(default=False)),
+                ('write', models.BooleanField(default=False)),
+                ('admin', models.BooleanField(default=False)),
+                ('source', models.CharField(choices=[('contributor', 'Contributor'), ('implicit_admin', 'Implicit admin')], max_length=32)),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='permission_index', to='osf.AbstractNode')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='node_permission_index', to='osf.OSFUser')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodepermissionindex',
+            unique_together=set([('user', 'node', 'source')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='nodepermissionindex',
+            index_together=set([('user', 'read', 'node')]),
+        ),
+        migrations.RunSQL(POPULATE_INDEX, 'DELETE FROM osf_nodepermissionindex;'),
+    ]
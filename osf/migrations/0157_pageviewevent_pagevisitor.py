@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-14 10:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import osf.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0156_nodepermissionindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageViewEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('page', models.CharField(max_length=300)),
+                ('visitor', models.CharField(max_length=64)),
+                ('user_guid', models.CharField(blank=True, max_length=255, null=True)),
+                ('check_contributors', models.BooleanField(default=False)),
+                ('created', osf.utils.fields.NonNaiveDateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageVisitor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.CharField(max_length=300)),
+                ('visitor', models.CharField(max_length=64)),
+                ('date', models.DateField()),
+                ('counted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pagevisitor',
+            unique_together=set([('page', 'visitor', 'date')]),
+        ),
+    ]
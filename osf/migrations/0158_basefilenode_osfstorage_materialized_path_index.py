@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-16 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False  # CREATE INDEX CONCURRENTLY cannot be run in a txn
+
+    dependencies = [
+        ('osf', '0157_pageviewevent_pagevisitor'),
+    ]
+
+    # Stored OsfStorage materialized paths are filled in as file nodes are saved,
+    # and for existing rows by `manage.py check_osfstorage_materialized_paths --repair`
+    operations = [
+        migrations.RunSQL([
+            """
+            CREATE INDEX CONCURRENTLY basefilenode_osfstorage_materialized_path
+            ON osf_basefilenode (target_content_type_id, target_object_id, _materialized_path text_pattern_ops)
+            WHERE provider = 'osfstorage';
+            """,
+        ], [
+            'DROP INDEX IF EXISTS basefilenode_osfstorage_materialized_path RESTRICT;',
+        ])
+    ]
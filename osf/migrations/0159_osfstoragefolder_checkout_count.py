@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-17 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+POPULATE_CHECKOUT_COUNTS = """
+    WITH RECURSIVE ancestors(id, parent_id) AS (
+        SELECT T.id, T.parent_id
+        FROM osf_basefilenode AS T
+        WHERE T.checkout_id IS NOT NULL
+      UNION ALL
+        SELECT T.id, T.parent_id
+        FROM ancestors AS A
+          JOIN osf_basefilenode AS T ON T.id = A.parent_id
+    )
+    UPDATE osf_basefilenode AS T
+    SET checkout_count = A.n
+    FROM (SELECT id, COUNT(*) AS n FROM ancestors GROUP BY id) AS A
+    WHERE T.id = A.id AND T.type = 'osf.osfstoragefolder';
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0158_basefilenode_osfstorage_materialized_path_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basefilenode',
+            name='checkout_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(POPULATE_CHECKOUT_COUNTS, 'UPDATE osf_basefilenode SET checkout_count = 0;'),
+    ]
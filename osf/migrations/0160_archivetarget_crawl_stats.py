@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-21 10:14
+from __future__ import unicode_literals
+
+from django.db import migrations
+import osf.utils.datetime_aware_jsonfield
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0159_osfstoragefolder_checkout_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivetarget',
+            name='crawl_stats',
+            field=osf.utils.datetime_aware_jsonfield.DateTimeAwareJSONField(blank=True, default=dict),
+        ),
+    ]
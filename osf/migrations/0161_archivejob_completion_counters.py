@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-22 14:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+POPULATE_PENDING_TARGET_COUNTS = """
+    UPDATE osf_archivejob AS J
+    SET pending_target_count = P.n
+    FROM (
+        SELECT JT.archivejob_id, COUNT(*) AS n
+        FROM osf_archivejob_target_addons AS JT
+          JOIN osf_archivetarget AS T ON T.id = JT.archivetarget_id
+        WHERE T.status NOT IN ('SUCCESS', 'FAILURE')
+        GROUP BY JT.archivejob_id
+    ) AS P
+    WHERE J.id = P.archivejob_id;
+"""
+
+POPULATE_UNFINISHED_JOB_COUNTS = """
+    UPDATE osf_archivejob AS J
+    SET unfinished_job_count = (
+        SELECT COUNT(*)
+        FROM osf_archivejob AS D
+        WHERE D.pending_target_count > 0 AND (
+            D.id = J.id OR D.dst_node_id IN (
+                SELECT C.descendant_id FROM osf_noderelationclosure AS C WHERE C.ancestor_id = J.dst_node_id
+            )
+        )
+    );
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0160_archivetarget_crawl_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivejob',
+            name='pending_target_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivejob',
+            name='unfinished_job_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL([POPULATE_PENDING_TARGET_COUNTS, POPULATE_UNFINISHED_JOB_COUNTS], migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-24 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0161_archivejob_completion_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationFileIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('name', models.TextField()),
+                ('path', models.TextField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='osf.AbstractNode')),
+                ('registration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_index', to='osf.AbstractNode')),
+                ('source_node', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='osf.AbstractNode')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='registrationfileindex',
+            index_together=set([('registration', 'sha256')]),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-28 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CREATE_UNIQUE_INDEX = """
+    CREATE UNIQUE INDEX osf_storageusage_node_region_uniq ON osf_storageusage (node_id, (COALESCE(region_id, -1)));
+"""
+
+DROP_UNIQUE_INDEX = """
+    DROP INDEX IF EXISTS osf_storageusage_node_region_uniq;
+"""
+
+POPULATE_STORAGE_USAGE = """
+    INSERT INTO osf_storageusage (node_id, region_id, usage, deleted_usage)
+    SELECT F.target_object_id, V.region_id,
+           SUM(CASE WHEN F.type IN ('osf.trashedfile', 'osf.trashedfolder', 'osf.trashedfilenode') THEN 0 ELSE GREATEST(V.size, 0) END),
+           SUM(CASE WHEN F.type IN ('osf.trashedfile', 'osf.trashedfolder', 'osf.trashedfilenode') THEN GREATEST(V.size, 0) ELSE 0 END)
+    FROM osf_basefilenode AS F
+      JOIN osf_basefilenode_versions AS FV ON FV.basefilenode_id = F.id
+      JOIN osf_fileversion AS V ON V.id = FV.fileversion_id
+    WHERE F.provider = 'osfstorage' AND F.target_content_type_id = (
+        SELECT id FROM django_content_type WHERE app_label = 'osf' AND model = 'abstractnode'
+    )
+    GROUP BY F.target_object_id, V.region_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('addons_osfstorage', '0005_region_mfr_url'),
+        ('osf', '0162_registrationfileindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usage', models.BigIntegerField(default=0)),
+                ('deleted_usage', models.BigIntegerField(default=0)),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to='osf.AbstractNode')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='addons_osfstorage.Region')),
+            ],
+        ),
+        migrations.RunSQL(CREATE_UNIQUE_INDEX, DROP_UNIQUE_INDEX),
+        migrations.RunSQL(POPULATE_STORAGE_USAGE, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-02-01 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import osf.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0163_storageusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityDelta',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(db_index=True, max_length=5)),
+                ('action', models.CharField(max_length=255)),
+                ('date', models.CharField(max_length=10)),
+                ('amount', models.PositiveIntegerField(default=1)),
+                ('created', osf.utils.fields.NonNaiveDateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
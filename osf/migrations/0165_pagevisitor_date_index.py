@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-02-01 14:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0164_useractivitydelta'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pagevisitor',
+            name='date',
+            field=models.DateField(db_index=True),
+        ),
+    ]
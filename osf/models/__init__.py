@@ -1,7 +1,7 @@
 from osf.models.metaschema import RegistrationSchema  # noqa
 from osf.models.base import Guid, BlackListGuid  # noqa
 from osf.models.user import OSFUser, Email  # noqa
-from osf.models.contributor import Contributor, RecentlyAddedContributor, PreprintContributor  # noqa
+from osf.models.contributor import Contributor, NodePermissionIndex, RecentlyAddedContributor, PreprintContributor  # noqa
 from osf.models.session import Session  # noqa
 from osf.models.institution import Institution  # noqa
 from osf.models.collection import CollectionSubmission, Collection  # noqa
@@ -14,7 +14,7 @@ from osf.models.tag import Tag  # noqa
 from osf.models.comment import Comment  # noqa
 from osf.models.conference import Conference, MailRecord  # noqa
 from osf.models.citation import CitationStyle  # noqa
-from osf.models.archive import ArchiveJob, ArchiveTarget  # noqa
+from osf.models.archive import ArchiveJob, ArchiveTarget, RegistrationFileIndex  # noqa
 from osf.models.queued_mail import QueuedMail  # noqa
 from osf.models.external import ExternalAccount, ExternalProvider  # noqa
 from osf.models.oauth import ApiOAuth2Application, ApiOAuth2PersonalToken, ApiOAuth2Scope  # noqa
@@ -32,8 +32,8 @@ from osf.models.files import (  # noqa
     File, Folder,  # noqa
     FileVersion, TrashedFile, TrashedFileNode, TrashedFolder, FileVersionUserMetadata,  # noqa
 )  # noqa
-from osf.models.node_relation import NodeRelation  # noqa
-from osf.models.analytics import UserActivityCounter, PageCounter  # noqa
+from osf.models.node_relation import NodeRelation, NodeRelationClosure  # noqa
+from osf.models.analytics import UserActivityCounter, UserActivityDelta, PageCounter, PageViewEvent, PageVisitor  # noqa
 from osf.models.admin_profile import AdminProfile  # noqa
 from osf.models.admin_log_entry import AdminLogEntry  # noqa
 from osf.models.maintenance_state import MaintenanceState  # noqa
@@ -42,5 +42,5 @@ from osf.models.quickfiles import QuickFilesNode  # noqa
 from osf.models.dismissed_alerts import DismissedAlert  # noqa
 from osf.models.action import ReviewAction  # noqa
 from osf.models.action import NodeRequestAction, PreprintRequestAction, ReviewAction  # noqa
-from osf.models.storage import ProviderAssetFile  # noqa
+from osf.models.storage import ProviderAssetFile, StorageUsage  # noqa
 from osf.models.blacklisted_email_domain import BlacklistedEmailDomain  # noqa
@@ -1,14 +1,24 @@
+import functools
+import hashlib
 import logging
+import operator
+from collections import Counter, defaultdict
+from datetime import timedelta
 
 from dateutil import parser
-from django.db import models, transaction
-from django.db.models import Sum
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import Q, Sum
 from django.db.models.expressions import RawSQL
 from django.utils import timezone
+from django_bulk_update.helper import bulk_update
+from flask import has_request_context, request
 
 from framework.sessions import session
 from osf.models.base import BaseModel
+from osf.models.contributor import Contributor, PreprintContributor
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
+from osf.utils.fields import NonNaiveDateTimeField
+from website import settings
 
 logger = logging.getLogger(__name__)
 
@@ -22,38 +32,132 @@ class UserActivityCounter(BaseModel):
     date = DateTimeAwareJSONField(default=dict)
     total = models.PositiveIntegerField(default=0)
 
+    FLUSH_BATCH_SIZE = 1000
+    # Key of the advisory lock held while flushing activity deltas
+    FLUSH_LOCK_ID = 4170
+
     @classmethod
     def get_total_activity_count(cls, user_id):
+        """Flushed count plus the deltas still waiting to be flushed"""
         try:
-            return cls.objects.get(_id=user_id).total
+            total = cls.objects.get(_id=user_id).total
         except cls.DoesNotExist:
-            return 0
+            total = 0
+        pending = UserActivityDelta.objects.filter(user_id=user_id).aggregate(pending=Sum('amount'))['pending']
+        return total + (pending or 0)
+
+    INSERT_MISSING_SQL = """
+        INSERT INTO "{table}" (_id, action, date, total, created, modified)
+        SELECT user_id, '{{}}'::jsonb, '{{}}'::jsonb, 0, now(), now()
+        FROM unnest(%s::varchar[]) AS user_id
+        ON CONFLICT (_id) DO NOTHING;
+    """
 
     @classmethod
     def increment(cls, user_id, action, date_string):
         date = parser.parse(date_string).strftime('%Y/%m/%d')
-        with transaction.atomic():
-            # select_for_update locks the row but only inside a transaction
-            uac, created = cls.objects.select_for_update().get_or_create(_id=user_id)
-            if uac.total > 0:
-                uac.total += 1
-            else:
-                uac.total = 1
-            if action in uac.action:
-                uac.action[action]['total'] += 1
-                if date in uac.action[action]['date']:
-                    uac.action[action]['date'][date] += 1
-                else:
-                    uac.action[action]['date'][date] = 1
-            else:
-                uac.action[action] = dict(total=1, date={date: 1})
-            if date in uac.date:
-                uac.date[date]['total'] += 1
-            else:
-                uac.date[date] = dict(total=1)
-            uac.save()
+        cls.bulk_increment([((user_id, action, date), 1)])
         return True
 
+    @classmethod
+    def record(cls, user_id, action, date_string):
+        """Log an increment; it is applied to the user's counter by ``flush_deltas``."""
+        UserActivityDelta.objects.create(
+            user_id=user_id,
+            action=action,
+            date=parser.parse(date_string).strftime('%Y/%m/%d'),
+        )
+
+    @classmethod
+    def flush_lag(cls):
+        """Seconds the oldest logged UserActivityDelta has waited to be flushed."""
+        oldest = UserActivityDelta.objects.order_by('id').values_list('created', flat=True).first()
+        return (timezone.now() - oldest).total_seconds() if oldest else 0
+
+    @classmethod
+    def flush_deltas(cls, batch_size=None):
+        """Apply logged UserActivityDeltas to the counters, oldest first, and delete them.
+        If a batch cannot be applied, each user's deltas are applied separately and those
+        that still fail are dropped.
+
+        Only one flush runs at a time; returns a ``(flushed, dropped)`` tuple of increment
+        counts, or None if another flush held the lock before any deltas were processed.
+        """
+        batch_size = batch_size or cls.FLUSH_BATCH_SIZE
+        flushed = dropped = 0
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_try_advisory_xact_lock(%s);', [cls.FLUSH_LOCK_ID])
+                    if not cursor.fetchone()[0]:
+                        return (flushed, dropped) if flushed or dropped else None
+                deltas = list(UserActivityDelta.objects.order_by('id')[:batch_size])
+                if not deltas:
+                    return flushed, dropped
+                totals = Counter()
+                for delta in deltas:
+                    totals[(delta.user_id, delta.action, delta.date)] += delta.amount
+                batch_dropped = cls._apply_totals(totals)
+                UserActivityDelta.objects.filter(id__in=[delta.id for delta in deltas]).delete()
+            dropped += batch_dropped
+            flushed += sum(totals.values()) - batch_dropped
+
+    @classmethod
+    def _apply_totals(cls, totals):
+        """Apply ``totals`` of a batch; return the number of increments that could not be applied."""
+        try:
+            with transaction.atomic():
+                cls.bulk_increment(totals.items())
+            return 0
+        except DatabaseError:
+            logger.exception('Failed to flush {} activity deltas, retrying per user'.format(len(totals)))
+        totals_by_user = defaultdict(list)
+        for key, amount in totals.items():
+            totals_by_user[key[0]].append((key, amount))
+        dropped = 0
+        for user_id, user_totals in totals_by_user.items():
+            try:
+                with transaction.atomic():
+                    cls.bulk_increment(user_totals)
+            except DatabaseError:
+                logger.exception('Dropped activity deltas for user {}'.format(user_id))
+                dropped += sum(amount for _, amount in user_totals)
+        return dropped
+
+    @classmethod
+    def bulk_increment(cls, deltas):
+        """Apply ``((user_id, action, date), amount)`` deltas, with dates formatted as
+        'yyyy/mm/dd', using one insert, one locking read and one update for all users.
+        """
+        deltas_by_user = defaultdict(list)
+        for (user_id, action, date), amount in deltas:
+            deltas_by_user[user_id].append((action, date, amount))
+        user_ids = sorted(deltas_by_user)
+        now = timezone.now()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(cls.INSERT_MISSING_SQL.format(table=cls._meta.db_table), [user_ids])
+            # select_for_update locks the rows but only inside a transaction; lock
+            # in a consistent order so concurrent flushes cannot deadlock
+            counters = list(cls.objects.select_for_update().filter(_id__in=user_ids).order_by('_id'))
+            for uac in counters:
+                for action, date, amount in deltas_by_user[uac._id]:
+                    uac._add(action, date, amount)
+                uac.modified = now
+            bulk_update(counters, update_fields=['action', 'date', 'total', 'modified'])
+
+    def _add(self, action, date, amount):
+        self.total += amount
+        if action in self.action:
+            self.action[action]['total'] += amount
+            self.action[action]['date'][date] = self.action[action]['date'].get(date, 0) + amount
+        else:
+            self.action[action] = dict(total=amount, date={date: amount})
+        if date in self.date:
+            self.date[date]['total'] += amount
+        else:
+            self.date[date] = dict(total=amount)
+
 
 class PageCounter(BaseModel):
     primary_identifier_name = '_id'
@@ -67,6 +171,20 @@ class PageCounter(BaseModel):
 
     DOWNLOAD_ALL_VERSIONS_ID_PATTERN = r'^download:[^:]*:{1}[^:]*$'
 
+    ROLLUP_BATCH_SIZE = 10000
+    # Key of the advisory lock held while rolling up page views
+    ROLLUP_LOCK_ID = 4171
+    # Visitors are counted once per page within this window, as they were when
+    # tracked in the session
+    VISITOR_RETENTION = timedelta(seconds=settings.OSF_SESSION_TIMEOUT)
+
+    INSERT_MISSING_SQL = """
+        INSERT INTO "{table}" (_id, date, total, "unique", created, modified)
+        SELECT page, '{{}}'::jsonb, 0, 0, now(), now()
+        FROM unnest(%s::varchar[]) AS page
+        ON CONFLICT (_id) DO NOTHING;
+    """
+
     @classmethod
     def get_all_downloads_on_date(cls, date):
         """
@@ -95,67 +213,136 @@ class PageCounter(BaseModel):
 
     @classmethod
     def update_counter(cls, page, node_info):
+        """Record a hit on ``page``. The hit is counted once ``rollup`` processes it.
+
+        :param str page: Colon-delimited page key
+        :param dict node_info: If given, hits on download and view pages by
+            contributors of the page's node only count towards the daily counts
+        """
         cleaned_page = cls.clean_page(page)
-        date = timezone.now()
-        date_string = date.strftime('%Y/%m/%d')
-        visited_by_date = session.data.get('visited_by_date', {'date': date_string, 'pages': []})
+        user_guid = session.data.get('auth_user_id')
+        PageViewEvent.objects.create(
+            page=cleaned_page,
+            visitor=get_visitor_key(user_guid),
+            user_guid=user_guid,
+            check_contributors=bool(node_info) and cleaned_page.split(':')[0] in ('download', 'view'),
+        )
 
-        with transaction.atomic():
-            model_instance, created = cls.objects.select_for_update().get_or_create(_id=cleaned_page)
-
-            # if they visited something today
-            if date_string == visited_by_date['date']:
-                # if they haven't visited this page today
-                if cleaned_page not in visited_by_date['pages']:
-                    # if the model_instance has today in it
-                    if date_string in model_instance.date.keys():
-                        # increment the number of unique visitors for today
-                        model_instance.date[date_string]['unique'] += 1
-                    else:
-                        # set the number of unique visitors for today to 1
-                        model_instance.date[date_string] = dict(unique=1)
-            # if they haven't visited something today
-            else:
-                # set their visited by date to blank
-                visited_by_date['date'] = date_string
-                visited_by_date['pages'] = []
-                # if the model_instance has today in it
-                if date_string in model_instance.date.keys():
-                    # increment the number of unique visitors for today
-                    model_instance.date[date_string]['unique'] += 1
+    @classmethod
+    def rollup(cls, batch_size=None):
+        """Fold logged PageViewEvents into the counters, oldest first, and delete them.
+
+        Only one rollup runs at a time; returns the number of events rolled up,
+        or None if another rollup held the lock before any were rolled up.
+        """
+        batch_size = batch_size or cls.ROLLUP_BATCH_SIZE
+        rolled_up = 0
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_try_advisory_xact_lock(%s);', [cls.ROLLUP_LOCK_ID])
+                    if not cursor.fetchone()[0]:
+                        return rolled_up or None
+                events = list(PageViewEvent.objects.order_by('id')[:batch_size])
+                if not events:
+                    return rolled_up
+                cls._rollup_events(events)
+                PageViewEvent.objects.filter(id__in=[event.id for event in events]).delete()
+            rolled_up += len(events)
+
+    @classmethod
+    def prune_visitors(cls, batch_size=None):
+        """Delete PageVisitors from before the unique visitor window. Return the number deleted."""
+        batch_size = batch_size or cls.ROLLUP_BATCH_SIZE
+        cutoff = (timezone.now() - cls.VISITOR_RETENTION).date()
+        pruned = 0
+        while True:
+            ids = list(PageVisitor.objects.filter(date__lt=cutoff).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return pruned
+            pruned += PageVisitor.objects.filter(id__in=ids).delete()[0]
+
+    @classmethod
+    def _rollup_events(cls, events):
+        contributor_views = cls._get_contributor_views(events)
+        seen = {
+            (page, visitor, day): counted
+            for page, visitor, day, counted in PageVisitor.objects.filter(
+                page__in={event.page for event in events},
+                visitor__in={event.visitor for event in events},
+            ).values_list('page', 'visitor', 'date', 'counted')
+        }
+        counted_visitors = {(page, visitor) for (page, visitor, _), counted in seen.items() if counted}
+        new_visitors = {}
+        newly_counted = set()
+
+        daily = defaultdict(lambda: defaultdict(Counter))
+        totals = Counter()
+        uniques = Counter()
+        for event in events:
+            day = event.created.date()
+            counts = daily[event.page][day.strftime('%Y/%m/%d')]
+            counts['total'] += 1
+            key = (event.page, event.visitor, day)
+            if key not in seen:
+                seen[key] = False
+                new_visitors[key] = False
+                counts['unique'] += 1
+
+            # Hits by contributors only count towards the daily counts
+            if event.check_contributors and (event.page.split(':')[1], event.user_guid) in contributor_views:
+                continue
+            totals[event.page] += 1
+            if (event.page, event.visitor) not in counted_visitors:
+                counted_visitors.add((event.page, event.visitor))
+                uniques[event.page] += 1
+                if key in new_visitors:
+                    new_visitors[key] = True
                 else:
-                    # set the number of unique visitors to 1
-                    model_instance.date[date_string] = dict(unique=1)
-
-            # update their sessions
-            visited_by_date['pages'].append(cleaned_page)
-            session.data['visited_by_date'] = visited_by_date
-
-            if date_string in model_instance.date.keys():
-                if 'total' not in model_instance.date[date_string].keys():
-                    model_instance.date[date_string].update(total=0)
-                model_instance.date[date_string]['total'] += 1
-            else:
-                model_instance.date[date_string] = dict(total=1)
-
-            # if a download counter is being updated, only perform the update
-            # if the user who is downloading isn't a contributor to the project
-            page_type = cleaned_page.split(':')[0]
-            if page_type in ('download', 'view') and node_info:
-                if node_info['contributors'].filter(guids___id__isnull=False, guids___id=session.data.get('auth_user_id')).exists():
-                    model_instance.save()
-                    return
-
-            visited = session.data.get('visited', [])
-            if page not in visited:
-                model_instance.unique += 1
-                visited.append(page)
-                session.data['visited'] = visited
-
-            session.save()
-            model_instance.total += 1
-
-            model_instance.save()
+                    newly_counted.add(key)
+
+        PageVisitor.objects.bulk_create([
+            PageVisitor(page=page, visitor=visitor, date=day, counted=counted)
+            for (page, visitor, day), counted in new_visitors.items()
+        ])
+        if newly_counted:
+            PageVisitor.objects.filter(functools.reduce(operator.or_, [
+                Q(page=page, visitor=visitor, date=day) for page, visitor, day in newly_counted
+            ])).update(counted=True)
+
+        pages = sorted(daily)
+        with connection.cursor() as cursor:
+            cursor.execute(cls.INSERT_MISSING_SQL.format(table=cls._meta.db_table), [pages])
+        now = timezone.now()
+        counters = list(cls.objects.select_for_update().filter(_id__in=pages).order_by('_id'))
+        for counter in counters:
+            for date_string, counts in daily[counter._id].items():
+                entry = counter.date.setdefault(date_string, {})
+                for name, value in counts.items():
+                    entry[name] = entry.get(name, 0) + value
+            counter.total += totals[counter._id]
+            counter.unique += uniques[counter._id]
+            counter.modified = now
+        bulk_update(counters, update_fields=['date', 'total', 'unique', 'modified'])
+
+    @staticmethod
+    def _get_contributor_views(events):
+        """Return the (target guid, user guid) pairs among ``events`` where the user is a contributor."""
+        pairs = {
+            (event.page.split(':')[1], event.user_guid)
+            for event in events if event.check_contributors and event.user_guid
+        }
+        if not pairs:
+            return set()
+        target_guids = {target for target, _ in pairs}
+        user_guids = {user for _, user in pairs}
+        node_contributors = Contributor.objects.filter(
+            node__guids___id__in=target_guids, user__guids___id__in=user_guids
+        ).values_list('node__guids___id', 'user__guids___id').order_by()
+        preprint_contributors = PreprintContributor.objects.filter(
+            preprint__guids___id__in=target_guids, user__guids___id__in=user_guids
+        ).values_list('preprint__guids___id', 'user__guids___id').order_by()
+        return set(node_contributors.union(preprint_contributors)) & pairs
 
     @classmethod
     def get_basic_counters(cls, page):
@@ -164,3 +351,57 @@ class PageCounter(BaseModel):
             return (counter.unique, counter.total)
         except cls.DoesNotExist:
             return (None, None)
+
+
+class UserActivityDelta(models.Model):
+    """Append-only log of activity increments, applied to UserActivityCounters by
+    ``UserActivityCounter.flush_deltas``.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.CharField(max_length=5, db_index=True)
+    action = models.CharField(max_length=255)
+    # Formatted as 'yyyy/mm/dd', like the keys of UserActivityCounter.date
+    date = models.CharField(max_length=10)
+    amount = models.PositiveIntegerField(default=1)
+    created = NonNaiveDateTimeField(default=timezone.now)
+
+
+class PageViewEvent(models.Model):
+    """Append-only log of page hits, folded into PageCounters by ``PageCounter.rollup``."""
+    id = models.BigAutoField(primary_key=True)
+    page = models.CharField(max_length=300)
+    # Identifies the visitor for unique counts, see ``get_visitor_key``
+    visitor = models.CharField(max_length=64)
+    user_guid = models.CharField(max_length=255, null=True, blank=True)
+    check_contributors = models.BooleanField(default=False)
+    created = NonNaiveDateTimeField(default=timezone.now)
+
+
+class PageVisitor(models.Model):
+    """Visitors already seen on a page on a day, used to count unique visitors
+    when rolling up page views.
+    """
+    page = models.CharField(max_length=300)
+    visitor = models.CharField(max_length=64)
+    date = models.DateField(db_index=True)
+    # Whether the visitor has been counted towards PageCounter.unique
+    counted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('page', 'visitor', 'date')
+
+
+def get_visitor_key(user_guid=None):
+    """Identify the current visitor without writing to their session: by user if
+    logged in, otherwise by session cookie, otherwise by address and user agent.
+    """
+    if user_guid:
+        return 'user:{}'.format(user_guid)
+    if not has_request_context():
+        return 'anonymous'
+    cookie = request.cookies.get(settings.COOKIE_NAME)
+    if cookie:
+        return 'session:{}'.format(hashlib.sha1(cookie).hexdigest())
+    return 'client:{}'.format(hashlib.sha1('{}|{}'.format(
+        request.remote_addr, request.headers.get('User-Agent', '')
+    )).hexdigest())
@@ -1,10 +1,14 @@
 from django.contrib.postgres.fields import ArrayField
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 
 from osf.utils.fields import NonNaiveDateTimeField
 from website import settings
 from osf.models.base import BaseModel, ObjectIDMixin
+from osf.models.node_relation import NodeRelationClosure
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 
 from addons.base.models import BaseStorageAddon
@@ -33,6 +37,8 @@ class ArchiveTarget(ObjectIDMixin, BaseModel):
     # }
     stat_result = DateTimeAwareJSONField(default=dict, blank=True)
     errors = ArrayField(models.TextField(), default=list, blank=True)
+    # Stats of the file tree crawl, see addons.base.crawler.FileTreeCrawler
+    crawl_stats = DateTimeAwareJSONField(default=dict, blank=True)
 
     def __repr__(self):
         return '<{0}(_id={1}, name={2}, status={3})>'.format(
@@ -61,6 +67,15 @@ class ArchiveJob(ObjectIDMixin, BaseModel):
 
     target_addons = models.ManyToManyField('ArchiveTarget')
 
+    # Completion counters, only written with relative updates, see _adjust_pending_targets.
+    # Number of targets that are not finished
+    pending_target_count = models.IntegerField(default=0)
+    # Number of jobs in the registration tree below and including this one with pending targets
+    unfinished_job_count = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ('pending_target_count', 'unfinished_job_count')
+    FINISHED_TARGET_STATUSES = (ARCHIVER_SUCCESS, ARCHIVER_FAILURE)
+
     def __repr__(self):
         return (
             '<{ClassName}(_id={self._id}, done={self.done}, '
@@ -82,10 +97,7 @@ class ArchiveJob(ObjectIDMixin, BaseModel):
 
     @property
     def pending(self):
-        return any([
-            target for target in self.target_addons.all()
-            if target.status not in (ARCHIVER_SUCCESS, ARCHIVER_FAILURE)
-        ])
+        return self.pending_target_count > 0
 
     def info(self):
         return self.src_node, self.dst_node, self.initiator
@@ -96,20 +108,86 @@ class ArchiveJob(ObjectIDMixin, BaseModel):
                 'name': target.name,
                 'status': target.status,
                 'stat_result': target.stat_result,
-                'errors': target.errors
+                'errors': target.errors,
+                'crawl_stats': target.crawl_stats,
             }
             for target in self.target_addons.all()
         ]
 
     def archive_tree_finished(self):
-        if self.pending:
-            return False
-        if not self.children:
-            return True
-        return all([
-            child.archive_tree_finished()
-            for child in self.children
-        ])
+        if self.pk:
+            self.refresh_from_db(fields=['unfinished_job_count'])
+        return self.unfinished_job_count == 0
+
+    def progress(self):
+        """Files and bytes archived per target, for this job and the jobs of all registrations below it."""
+        descendants = NodeRelationClosure.objects.filter(ancestor_id=self.dst_node_id).values('descendant_id')
+        jobs = (
+            ArchiveJob.objects
+            .filter(Q(pk=self.pk) | Q(dst_node_id__in=descendants))
+            .select_related('dst_node')
+            .prefetch_related('target_addons')
+        )
+        targets = []
+        for job in jobs:
+            for target in job.target_addons.all():
+                num_files = target.stat_result.get('num_files', 0)
+                disk_usage = target.stat_result.get('disk_usage', 0)
+                done = target.status == ARCHIVER_SUCCESS
+                targets.append({
+                    'node': job.dst_node._id,
+                    'name': target.name,
+                    'status': target.status,
+                    'files': num_files,
+                    'bytes': disk_usage,
+                    'files_done': num_files if done else 0,
+                    'bytes_done': disk_usage if done else 0,
+                })
+        return {
+            'targets': targets,
+            'files': sum(target['files'] for target in targets),
+            'bytes': sum(target['bytes'] for target in targets),
+            'files_done': sum(target['files_done'] for target in targets),
+            'bytes_done': sum(target['bytes_done'] for target in targets),
+        }
+
+    def save(self, *args, **kwargs):
+        if self.pk and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            # A stale instance must not overwrite counters updated by other workers
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        return super(ArchiveJob, self).save(*args, **kwargs)
+
+    def _adjust_pending_targets(self, delta):
+        """Add ``delta`` to the pending targets of this job, and update the unfinished job
+        counts of this job and the jobs above it if it starts or stops being pending.
+        """
+        with transaction.atomic():
+            pending_target_count = ArchiveJob.objects.select_for_update().values_list(
+                'pending_target_count', flat=True
+            ).get(pk=self.pk)
+            ArchiveJob.objects.filter(pk=self.pk).update(pending_target_count=F('pending_target_count') + delta)
+            self.pending_target_count = pending_target_count + delta
+            if (pending_target_count > 0) != (self.pending_target_count > 0):
+                self._adjust_unfinished_jobs(1 if self.pending_target_count > 0 else -1)
+
+    def _adjust_unfinished_jobs(self, delta):
+        ancestors = NodeRelationClosure.objects.filter(descendant_id=self.dst_node_id).values('ancestor_id')
+        ArchiveJob.objects.filter(
+            Q(pk=self.pk) | Q(dst_node_id__in=ancestors)
+        ).update(unfinished_job_count=F('unfinished_job_count') + delta)
+        self.refresh_from_db(fields=['unfinished_job_count'])
+
+    def _count_unfinished_jobs(self):
+        descendants = NodeRelationClosure.objects.filter(ancestor_id=self.dst_node_id).values('descendant_id')
+        unfinished = ArchiveJob.objects.filter(
+            Q(pk=self.pk) | Q(dst_node_id__in=descendants),
+            pending_target_count__gt=0,
+        ).count()
+        ArchiveJob.objects.filter(pk=self.pk).update(unfinished_job_count=unfinished)
+        self.unfinished_job_count = unfinished
 
     def _fail_above(self):
         """Marks all ArchiveJob instances attached to Nodes above this as failed
@@ -160,15 +238,134 @@ class ArchiveJob(ObjectIDMixin, BaseModel):
                     addons.append(addon.config.short_name)
         for addon in addons:
             self._set_target(addon)
+        # Jobs of registrations below this one are created first
+        self._count_unfinished_jobs()
         self.save()
 
+    def record_stat_result(self, addon_short_name, stat_result):
+        target = self.get_target(addon_short_name)
+        target.stat_result = stat_result
+        target.save()
+
     def update_target(self, addon_short_name, status, stat_result=None, errors=None):
-        stat_result = stat_result or {}
         errors = errors or []
 
         target = self.get_target(addon_short_name)
+        was_pending = target.status not in self.FINISHED_TARGET_STATUSES
         target.status = status
         target.errors = errors
-        target.stat_result = stat_result
+        if stat_result is not None:
+            target.stat_result = stat_result
         target.save()
+        is_pending = target.status not in self.FINISHED_TARGET_STATUSES
+        if was_pending != is_pending:
+            self._adjust_pending_targets(1 if is_pending else -1)
         self._post_update_target()
+
+
+class RegistrationFileIndex(models.Model):
+    """Persisted sha256 -> file lookup for the OSFStorage files of a registration and its
+    primary descendants, used to re-point files selected in registration schemas at their
+    archived copies. Rows are written in one batch by ``build`` once the archive is complete.
+    """
+    # Root of the indexed registration tree
+    registration = models.ForeignKey('AbstractNode', related_name='file_index', on_delete=models.CASCADE)
+    # Registration node (the root or a component) the file belongs to
+    node = models.ForeignKey('AbstractNode', related_name='+', on_delete=models.CASCADE)
+    # The node that ``node`` was registered from
+    source_node = models.ForeignKey('AbstractNode', related_name='+', null=True, on_delete=models.SET_NULL)
+    sha256 = models.CharField(max_length=64)
+    name = models.TextField()
+    path = models.TextField()
+
+    class Meta:
+        index_together = (
+            ('registration', 'sha256'),
+        )
+
+    def __repr__(self):
+        return '<{self.__class__.__name__}(registration={self.registration_id}, node={self.node_id}, path={self.path})>'.format(self=self)
+
+    @staticmethod
+    def _iter_files(file_tree):
+        """Yield the files of an OSFStorage file tree, breadth first."""
+        stack = [file_tree]
+        while stack:
+            tree_node = stack.pop(0)
+            if tree_node['kind'] == 'file':
+                yield tree_node
+            else:
+                stack.extend(tree_node['children'])
+
+    @classmethod
+    def build(cls, registration):
+        """(Re)build the index of ``registration`` from the OSFStorage file tree of each node in it.
+        Nodes are visited depth first, so rows are ordered the way lookups should prefer them.
+        """
+        entries = []
+        stack = [registration]
+        while stack:
+            node = stack.pop()
+            file_tree = node.get_addon('osfstorage')._get_file_tree(user=node.creator)
+            entries.extend(
+                cls(
+                    registration=registration,
+                    node=node,
+                    source_node_id=node.registered_from_id,
+                    sha256=file_node['extra']['hashes']['sha256'],
+                    name=file_node['name'],
+                    path=file_node['path'],
+                )
+                for file_node in cls._iter_files(file_tree)
+            )
+            stack.extend(reversed(list(node.nodes_primary)))
+        with transaction.atomic():
+            cls.objects.filter(registration=registration).delete()
+            cls.objects.bulk_create(entries)
+        return len(entries)
+
+    @classmethod
+    def ensure_built(cls, registration):
+        if not cls.objects.filter(registration=registration).exists():
+            cls.build(registration)
+
+    @classmethod
+    def lookup(cls, registration, sha256, name, source_node_guid):
+        """Return the first indexed file of ``registration`` with the given hash and name that was
+        archived from the node ``source_node_guid``, as ``(file metadata, node guid)``, or ``(None, None)``.
+        """
+        match = cls.objects.filter(
+            registration=registration,
+            sha256=sha256,
+            name=name,
+            source_node__guids___id=source_node_guid,
+        ).order_by('id').values('sha256', 'name', 'path', 'node__guids___id').first()
+        if match is None:
+            return None, None
+        node_id = match.pop('node__guids___id')
+        return match, node_id
+
+
+##### Signal listeners #####
+@receiver(m2m_changed, sender=ArchiveJob.target_addons.through)
+def adjust_pending_target_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep ArchiveJob.pending_target_count in step with the targets added to or removed from jobs."""
+    pending = ArchiveTarget.objects.exclude(status__in=ArchiveJob.FINISHED_TARGET_STATUSES)
+    if action == 'pre_clear':
+        if reverse:
+            jobs = instance.archivejob_set.all() if instance.status not in ArchiveJob.FINISHED_TARGET_STATUSES else []
+            pairs = [(job, -1) for job in jobs]
+        else:
+            pairs = [(instance, -pending.filter(archivejob=instance).count())]
+    elif action in ('post_add', 'post_remove') and pk_set:
+        sign = 1 if action == 'post_add' else -1
+        if reverse:
+            jobs = ArchiveJob.objects.filter(pk__in=pk_set) if instance.status not in ArchiveJob.FINISHED_TARGET_STATUSES else []
+            pairs = [(job, sign) for job in jobs]
+        else:
+            pairs = [(instance, sign * pending.filter(pk__in=pk_set).count())]
+    else:
+        return
+    for job, delta in pairs:
+        if delta:
+            job._adjust_pending_targets(delta)
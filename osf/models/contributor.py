@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import connection, models
 from include import IncludeManager
 
+from osf.models.node_relation import NodeRelationClosure
 from osf.utils.fields import NonNaiveDateTimeField
 from osf.utils.permissions import (
     READ,
@@ -111,6 +112,83 @@ class InstitutionalContributor(AbstractBaseContributor):
         unique_together = ('user', 'institution')
 
 
+class NodePermissionIndex(models.Model):
+    """Denormalized (user, node) permissions used by node list and visibility queries.
+
+    Rows with ``source == CONTRIBUTOR`` mirror the user's Contributor record on the node.
+    Rows with ``source == IMPLICIT_ADMIN`` grant read access to every primary descendant
+    of a node that the user administers. Both are rebuilt for a node's subtree by
+    ``refresh_subtree`` whenever contributors or the node hierarchy change.
+    """
+    CONTRIBUTOR = 'contributor'
+    IMPLICIT_ADMIN = 'implicit_admin'
+    SOURCE_CHOICES = (
+        (CONTRIBUTOR, 'Contributor'),
+        (IMPLICIT_ADMIN, 'Implicit admin'),
+    )
+
+    user = models.ForeignKey('OSFUser', related_name='node_permission_index', on_delete=models.CASCADE)
+    node = models.ForeignKey('AbstractNode', related_name='permission_index', on_delete=models.CASCADE)
+    read = models.BooleanField(default=False)
+    write = models.BooleanField(default=False)
+    admin = models.BooleanField(default=False)
+    source = models.CharField(max_length=32, choices=SOURCE_CHOICES)
+
+    SUBTREE_SQL = """
+        SELECT %(node)s
+        UNION ALL
+        SELECT descendant_id FROM "{closure}" WHERE ancestor_id = %(node)s
+    """
+
+    REFRESH_SQL = """
+        DELETE FROM "{index}"
+        WHERE node_id IN ({subtree}) {user_clause};
+
+        INSERT INTO "{index}" (user_id, node_id, read, write, admin, source)
+        SELECT C.user_id, C.node_id, C.read, C.write, C.admin, '{contributor}'
+        FROM "{contributor_table}" AS C
+        WHERE C.node_id IN ({subtree}) {contributor_user_clause};
+
+        INSERT INTO "{index}" (user_id, node_id, read, write, admin, source)
+        SELECT DISTINCT C.user_id, R.descendant_id, TRUE, FALSE, FALSE, '{implicit_admin}'
+        FROM "{closure}" AS R
+        JOIN "{contributor_table}" AS C ON C.node_id = R.ancestor_id
+        WHERE C.admin IS TRUE AND R.descendant_id IN ({subtree}) {contributor_user_clause};
+    """
+
+    class Meta:
+        unique_together = ('user', 'node', 'source')
+        index_together = (
+            ('user', 'read', 'node'),
+        )
+
+    def __repr__(self):
+        return ('<{self.__class__.__name__}(user={self.user_id}, node={self.node_id}, '
+                'read={self.read}, write={self.write}, admin={self.admin}, '
+                'source={self.source})>').format(self=self)
+
+    @classmethod
+    def refresh_subtree(cls, node_id, user_id=None):
+        """Rebuild the index rows of ``node_id`` and all of its primary descendants.
+
+        :param int node_id: pk of the node whose contributors or position in the hierarchy changed
+        :param int user_id: If given, only rebuild the rows of this user
+        """
+        closure = NodeRelationClosure._meta.db_table
+        sql = cls.REFRESH_SQL.format(
+            index=cls._meta.db_table,
+            contributor_table=Contributor._meta.db_table,
+            closure=closure,
+            subtree=cls.SUBTREE_SQL.format(closure=closure),
+            contributor=cls.CONTRIBUTOR,
+            implicit_admin=cls.IMPLICIT_ADMIN,
+            user_clause='AND user_id = %(user)s' if user_id else '',
+            contributor_user_clause='AND C.user_id = %(user)s' if user_id else '',
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'node': node_id, 'user': user_id})
+
+
 class RecentlyAddedContributor(models.Model):
     user = models.ForeignKey('OSFUser', on_delete=models.CASCADE)  # the user who added the contributor
     contributor = models.ForeignKey('OSFUser', related_name='recently_added_by', on_delete=models.CASCADE)  # the added contributor
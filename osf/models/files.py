@@ -2,16 +2,18 @@ from __future__ import unicode_literals
 
 import logging
 import os
+from collections import defaultdict
 
 import requests
 from dateutil.parser import parse as parse_date
 from django.apps import apps
-from django.db import models, IntegrityError
+from django.db import connection, models, transaction, IntegrityError
 from django.db.models import Manager
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django_bulk_update.helper import bulk_update
 from typedmodels.models import TypedModel, TypedModelManager
 from include import IncludeManager
 
@@ -20,6 +22,7 @@ from framework import sentry
 from osf.models.base import BaseModel, OptionalGuidMixin, ObjectIDMixin
 from osf.models.comment import CommentableMixin
 from osf.models.mixins import Taggable
+from osf.models.storage import StorageUsage
 from osf.models.validators import validate_location
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 from osf.utils.fields import NonNaiveDateTimeField
@@ -111,6 +114,69 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
     objects = BaseFileNodeManager()
     active = ActiveFileNodeManager()
 
+    # Trashes the non-trashed descendants of a folder and returns their ids, new types and providers
+    TRASH_DESCENDANTS_SQL = """
+        WITH RECURSIVE descendants(id) AS (
+            SELECT T.id
+            FROM "{table}" AS T
+            WHERE T.parent_id = %(id)s AND NOT T.type = ANY(%(trashed_types)s)
+          UNION ALL
+            SELECT T.id
+            FROM descendants AS D
+              JOIN "{table}" AS T ON T.parent_id = D.id
+            WHERE NOT T.type = ANY(%(trashed_types)s)
+        )
+        UPDATE "{table}" AS T
+        SET type = CASE WHEN T.type = ANY(%(folder_types)s) THEN %(trashed_folder)s ELSE %(trashed_file)s END,
+            deleted_on = %(deleted_on)s,
+            deleted_by_id = %(deleted_by)s,
+            _path = {trashed_path}
+        FROM descendants AS D
+        WHERE T.id = D.id
+        RETURNING T.id, T.type, T.provider;
+    """
+    # SQL expression for the stored path of a descendant being trashed
+    TRASHED_PATH_SQL = 'T._path'
+    # Stored path of a descendant restored as this class; None keeps the trashed path
+    RESTORED_PATH = None
+
+    # Moves the non-trashed descendants of a folder to another target and returns the ids and types of the moved rows
+    UPDATE_DESCENDANT_TARGETS_SQL = """
+        WITH RECURSIVE descendants(id) AS (
+            SELECT T.id
+            FROM "{table}" AS T
+            WHERE T.parent_id = %(id)s AND NOT T.type = ANY(%(trashed_types)s)
+          UNION ALL
+            SELECT T.id
+            FROM descendants AS D
+              JOIN "{table}" AS T ON T.parent_id = D.id
+            WHERE NOT T.type = ANY(%(trashed_types)s)
+        )
+        UPDATE "{table}" AS T
+        SET target_content_type_id = %(content_type_id)s,
+            target_object_id = %(object_id)s
+        FROM descendants AS D
+        WHERE T.id = D.id AND (T.target_content_type_id, T.target_object_id) != (%(content_type_id)s, %(object_id)s)
+        RETURNING T.id, T.type;
+    """
+
+    # Lists the trashed descendants of a folder that were trashed along with it
+    TRASHED_DESCENDANTS_SQL = """
+        WITH RECURSIVE descendants(id, provider, type) AS (
+            SELECT T.id, T.provider, T.type
+            FROM "{table}" AS T
+            WHERE T.parent_id = %(id)s AND T.type = ANY(%(trashed_types)s) AND T.deleted_on = %(deleted_on)s
+          UNION ALL
+            SELECT T.id, T.provider, T.type
+            FROM descendants AS D
+              JOIN "{table}" AS T ON T.parent_id = D.id
+            WHERE T.type = ANY(%(trashed_types)s) AND T.deleted_on = %(deleted_on)s
+        )
+        SELECT id, provider, type FROM descendants;
+    """
+
+    SEARCH_BATCH_SIZE = 1000
+
     class Meta:
         base_manager_name = 'objects'
         index_together = (
@@ -204,11 +270,7 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         if materialized_path.endswith('/'):
             # it's a folder
             folder_children = cls.objects.filter(provider=provider, target_object_id=target.id, target_content_type=content_type, _materialized_path__startswith=materialized_path)
-            for item in folder_children:
-                if item.kind == 'file':
-                    guid = item.get_guid()
-                    if guid:
-                        guids.append(guid._id)
+            guids.extend(cls.get_file_guid_ids([item.pk for item in folder_children if item.kind == 'file']))
         else:
             # it's a file
             try:
@@ -223,6 +285,20 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
 
         return guids
 
+    @classmethod
+    def get_file_guid_ids(cls, file_ids):
+        """Return the _id of the guid of each file in ``file_ids`` that has one, as
+        ``get_guid`` would, in one query.
+        """
+        Guid = apps.get_model('osf.Guid')
+        guids = {}
+        # get_guid returns the newest guid, so walk oldest first and let later guids win
+        for object_id, _id in Guid.objects.filter(
+            content_type=ContentType.objects.get_for_model(BaseFileNode), object_id__in=file_ids
+        ).order_by('created', 'id').values_list('object_id', '_id'):
+            guids[object_id] = _id
+        return guids.values()
+
     def has_permission(self, user, perm):
         return self.node and self.node.has_permission(user, perm)
 
@@ -242,30 +318,98 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         """
         return cls.objects.filter(checkout=user)
 
+    @classmethod
+    def build_class_registry(cls):
+        """Map ``(provider, kind)`` to the file node class ``resolve_class`` returns for them.
+        Called when the osf app is ready, after every addon's file node classes are defined.
+        """
+        registry = {}
+        for subclass in BaseFileNode.__subclasses__():
+            registry.setdefault((subclass._provider, cls.ANY), subclass)
+            for subsubclass in subclass.__subclasses__():
+                for kind, type_cls in ((cls.FOLDER, Folder), (cls.FILE, File)):
+                    if issubclass(subsubclass, type_cls):
+                        registry.setdefault((subsubclass._provider, kind), subsubclass)
+        # Update in place rather than clearing, so concurrent lookups never see an empty map
+        PROVIDER_MAP.update(registry)
+        return registry
+
     @classmethod
     def resolve_class(cls, provider, type_integer):
         type_mapping = {0: Folder, 1: File, 2: None}
         type_cls = type_mapping[type_integer]
 
-        for subclass in BaseFileNode.__subclasses__():
-            if type_cls:
-                for subsubclass in subclass.__subclasses__():
-                    if issubclass(subsubclass, type_cls) and subsubclass._provider == provider:
-                        return subsubclass
-            else:
-                if subclass._provider == provider:
-                    return subclass
-        raise UnableToResolveFileClass('Could not resolve class for {} and {}'.format(provider, type_cls))
+        resolved = cls._lookup_class(provider, type_integer)
+        if resolved is None:
+            raise UnableToResolveFileClass('Could not resolve class for {} and {}'.format(provider, type_cls))
+        return resolved
+
+    @classmethod
+    def _lookup_class(cls, provider, kind):
+        key = (provider, kind)
+        if key not in PROVIDER_MAP:
+            # Classes defined after the app was ready, e.g. in tests, are picked up on a miss
+            cls.build_class_registry()
+        return PROVIDER_MAP.get(key)
 
     def _resolve_class(self, type_cls):
-        for subclass in BaseFileNode.__subclasses__():
-            if type_cls:
-                for subsubclass in subclass.__subclasses__():
-                    if issubclass(subsubclass, type_cls) and subsubclass._provider == self.provider:
-                        return subsubclass
-            else:
-                if subclass._provider == self.provider:
-                    return subclass
+        kind = {Folder: self.FOLDER, File: self.FILE, None: self.ANY}[type_cls]
+        return self._lookup_class(self.provider, kind)
+
+    @classmethod
+    def bulk_get_or_create_from_waterbutler(cls, target, files_list, user=None):
+        """Touch or create the file node for every item of a WaterButler folder listing, with
+        one query for the existing file nodes. Returns the file nodes in listing order.
+
+        Mirrors ``get_or_create`` followed by ``update`` for each item.
+        """
+        content_type = ContentType.objects.get_for_model(target)
+        items = []
+        for item in files_list:
+            attrs = item['attributes']
+            file_class = cls.resolve_class(
+                attrs['provider'],
+                cls.FOLDER if attrs['kind'] == 'folder' else cls.FILE,
+            )
+            items.append((file_class, '/' + attrs['path'].lstrip('/'), attrs))
+        if not items:
+            return []
+
+        file_nodes = {}
+        for file_node in BaseFileNode.objects.filter(
+            target_object_id=target.id,
+            target_content_type=content_type,
+            type__in=set(file_class._typedmodels_type for file_class, _, _ in items),
+            _path__in=set(path for _, path, _ in items),
+        ).order_by('id'):
+            file_nodes.setdefault((file_node.type, file_node._path), file_node)
+
+        to_update, to_create, listed = [], [], []
+        to_update_pks = set()
+        for file_class, path, attrs in items:
+            key = (file_class._typedmodels_type, path)
+            file_node = file_nodes.get(key)
+            if file_node is None:
+                # bulk_create bypasses BaseFileNode.save, which sets the provider
+                file_node = file_nodes[key] = file_class(target=target, _path=path, provider=file_class._provider)
+                to_create.append(file_node)
+            elif file_node.pk and file_node.pk not in to_update_pks:
+                to_update_pks.add(file_node.pk)
+                to_update.append(file_node)
+            file_node.update(None, attrs, user=user, save=False)
+            listed.append(file_node)
+
+        bulk_update(to_update)
+        BaseFileNode.objects.bulk_create(to_create)
+        return listed
+
+    @classmethod
+    def get_folder_types(cls):
+        """Types of all folder classes, including trashed folders"""
+        return [
+            type_ for type_, subclass in BaseFileNode._typedmodels_registry.items()
+            if issubclass(subclass, (Folder, TrashedFolder))
+        ]
 
     def get_version(self, revision, required=False):
         """Find a version with identifier revision
@@ -386,10 +530,29 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         if self.parent is not None:
             self.target = self.parent.target
         if save:
-            self.save()
-        if recursive and not self.is_file:
-            for child in self.children:
-                child._update_node(save=save)
+            with transaction.atomic():
+                self.save()
+                if recursive and not self.is_file:
+                    self._update_descendant_targets()
+
+    def _update_descendant_targets(self):
+        """Point every non-trashed file node below this folder at this folder's target."""
+        from website.search import search
+
+        with connection.cursor() as cursor:
+            cursor.execute(self.UPDATE_DESCENDANT_TARGETS_SQL.format(table=self._meta.db_table), {
+                'id': self.pk,
+                'trashed_types': TrashedFileNode._typedmodels_subtypes,
+                'content_type_id': self.target_content_type_id,
+                'object_id': self.target_object_id,
+            })
+            moved = cursor.fetchall()
+
+        # OsfStorageFile.save reindexes files
+        OsfStorageFile = apps.get_model('osf.OsfStorageFile')
+        indexed_ids = [pk for pk, type_ in moved if type_ == OsfStorageFile._typedmodels_type]
+        for start in range(0, len(indexed_ids), self.SEARCH_BATCH_SIZE):
+            search.bulk_update_files(OsfStorageFile.objects.filter(id__in=indexed_ids[start:start + self.SEARCH_BATCH_SIZE]))
 
     # TODO: Remove unused parent param
     def delete(self, user=None, parent=None, save=True, deleted_on=None):
@@ -404,12 +567,10 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         """
         self.deleted_by = user
         self.deleted_on = deleted_on = deleted_on or timezone.now()
+        trashed_path_sql = self.TRASHED_PATH_SQL
 
         if not self.is_file:
             self.recast(TrashedFolder._typedmodels_type)
-
-            for child in BaseFileNode.objects.filter(parent=self.id).exclude(type__in=TrashedFileNode._typedmodels_subtypes):
-                child.delete(user=user, save=save, deleted_on=deleted_on)
         else:
             self.recast(TrashedFile._typedmodels_type)
 
@@ -419,10 +580,83 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
                 Comment.objects.filter(root_target=guid).update(root_target=None)
 
         if save:
-            self.save()
+            with transaction.atomic():
+                self.save()
+                if not self.is_file:
+                    self._trash_descendants(trashed_path_sql)
+                else:
+                    StorageUsage.adjust_for_files([self.pk], usage_sign=-1, deleted_sign=1)
 
         return self
 
+    def _trash_descendants(self, trashed_path_sql):
+        """Trash every file node below this folder that is not already trashed, with the
+        deletion fields of this folder. Called after this folder has been recast.
+        """
+        from website.search import search
+        Comment = apps.get_model('osf.Comment')
+
+        with connection.cursor() as cursor:
+            cursor.execute(self.TRASH_DESCENDANTS_SQL.format(table=self._meta.db_table, trashed_path=trashed_path_sql), {
+                'id': self.pk,
+                'trashed_types': TrashedFileNode._typedmodels_subtypes,
+                'folder_types': BaseFileNode.get_folder_types(),
+                'trashed_folder': TrashedFolder._typedmodels_type,
+                'trashed_file': TrashedFile._typedmodels_type,
+                'deleted_on': self.deleted_on,
+                'deleted_by': self.deleted_by_id,
+            })
+            trashed = cursor.fetchall()
+
+        file_ids = [pk for pk, type_, _ in trashed if type_ == TrashedFile._typedmodels_type]
+        StorageUsage.adjust_for_files(file_ids, usage_sign=-1, deleted_sign=1)
+        # Comments on trashed files are no longer listed under their target
+        Comment.objects.filter(
+            root_target__content_type=ContentType.objects.get_for_model(BaseFileNode),
+            root_target__object_id__in=file_ids,
+        ).update(root_target=None)
+
+        # OsfStorageFile.delete removes files from the search index
+        indexed_ids = [pk for pk, type_, provider in trashed if type_ == TrashedFile._typedmodels_type and provider == 'osfstorage']
+        for start in range(0, len(indexed_ids), self.SEARCH_BATCH_SIZE):
+            search.bulk_update_files(
+                TrashedFile.objects.filter(id__in=indexed_ids[start:start + self.SEARCH_BATCH_SIZE]).only('id', '_id', 'type'),
+                delete=True,
+            )
+
+    def _restore_descendants(self, deleted_on):
+        """Restore the descendants trashed at ``deleted_on``, recasting them by provider and kind."""
+        from website.search import search
+
+        with connection.cursor() as cursor:
+            cursor.execute(self.TRASHED_DESCENDANTS_SQL.format(table=self._meta.db_table), {
+                'id': self.pk,
+                'trashed_types': TrashedFileNode._typedmodels_subtypes,
+                'deleted_on': deleted_on,
+            })
+            trashed = cursor.fetchall()
+
+        restored_types = defaultdict(list)
+        for pk, provider, type_ in trashed:
+            kind = BaseFileNode.FOLDER if type_ == TrashedFolder._typedmodels_type else BaseFileNode.FILE
+            restored_types[BaseFileNode.resolve_class(provider, kind)].append(pk)
+        for restored_cls, ids in restored_types.items():
+            updates = {'type': restored_cls._typedmodels_type}
+            if restored_cls.RESTORED_PATH is not None:
+                updates['_path'] = restored_cls.RESTORED_PATH
+            BaseFileNode.objects.filter(id__in=ids).update(**updates)
+        StorageUsage.adjust_for_files(
+            [pk for pk, _, type_ in trashed if type_ == TrashedFile._typedmodels_type],
+            usage_sign=1,
+            deleted_sign=-1,
+        )
+
+        # OsfStorageFile.save reindexes files
+        OsfStorageFile = apps.get_model('osf.OsfStorageFile')
+        indexed_ids = restored_types.get(OsfStorageFile, [])
+        for start in range(0, len(indexed_ids), self.SEARCH_BATCH_SIZE):
+            search.bulk_update_files(OsfStorageFile.objects.filter(id__in=indexed_ids[start:start + self.SEARCH_BATCH_SIZE]))
+
     def _serialize(self, **kwargs):
         return {
             'id': self._id,
@@ -637,7 +871,10 @@ class TrashedFileNode(BaseFileNode):
         self.recast(self._resolve_class(type_cls)._typedmodels_type)
 
         if save:
-            self.save()
+            with transaction.atomic():
+                self.save()
+                if type_cls is File:
+                    StorageUsage.adjust_for_files([self.pk], usage_sign=1, deleted_sign=-1)
 
         return self
 
@@ -694,12 +931,13 @@ class TrashedFolder(TrashedFileNode):
         :param deleted_on:
         :return:
         """
-        tf = super(TrashedFolder, self).restore(recursive=True, parent=None, save=True, deleted_on=None)
+        # Restore the folder and its subtree together so a failure cannot leave
+        # a live folder over trashed descendants
+        with transaction.atomic():
+            tf = super(TrashedFolder, self).restore(recursive=True, parent=None, save=True, deleted_on=None)
 
-        if not self.is_file and recursive:
-            deleted_on = deleted_on or self.deleted_on
-            for child in TrashedFileNode.objects.filter(parent=self.id, deleted_on=deleted_on):
-                child.restore(recursive=True, save=save, deleted_on=deleted_on)
+            if not self.is_file and recursive:
+                self._restore_descendants(deleted_on or self.deleted_on)
         return tf
 
 
@@ -852,6 +852,10 @@ class ContributorMixin(models.Model):
     def clear_permissions(self, user):
         return
 
+    def update_permission_index(self, user):
+        # Override on models that maintain a denormalized permission index
+        return
+
     def is_contributor(self, user):
         """Return whether ``user`` is a contributor on the object."""
         kwargs = self.contributor_kwargs
@@ -928,6 +932,7 @@ class ContributorMixin(models.Model):
                 # Preprint permissions passed in as a string
                 self.add_permission(contrib_to_add, permissions, save=True)
             contributor_obj.save()
+            self.update_permission_index(contrib_to_add)
 
             if log:
                 params = self.log_params
@@ -1086,6 +1091,8 @@ class ContributorMixin(models.Model):
             return False
         contrib_obj.user = new
         contrib_obj.save()
+        self.update_permission_index(old)
+        self.update_permission_index(new)
 
         # Remove unclaimed record for the project
         if self._id in old.unclaimed_records:
@@ -1169,6 +1176,7 @@ class ContributorMixin(models.Model):
         contrib_obj.delete()
 
         self.clear_permissions(contributor)
+        self.update_permission_index(contributor)
         # After remove callback
         for addon in self.get_addons():
             message = addon.after_remove_contributor(self, contributor, auth)
@@ -1440,6 +1448,7 @@ class ContributorMixin(models.Model):
             for perm in expand_permissions(permission):
                 setattr(contributor, perm, True)
             contributor.save()
+            self.update_permission_index(user)
         else:
             if getattr(contributor, permission, False):
                 raise ValueError('User already has permission {0}'.format(permission))
@@ -1465,6 +1474,7 @@ class ContributorMixin(models.Model):
             else:
                 setattr(contrib_obj, permission_level, False)
         contrib_obj.save()
+        self.update_permission_index(user)
         if save:
             self.save()
 
@@ -1482,6 +1492,7 @@ class ContributorMixin(models.Model):
             for perm in expand_permissions(permission):
                 setattr(contributor, perm, False)
             contributor.save()
+            self.update_permission_index(user)
         else:
             raise ValueError('User does not have permission {0}'.format(permission))
         if save:
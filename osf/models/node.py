@@ -3,6 +3,7 @@ import itertools
 import logging
 import re
 import urlparse
+from collections import defaultdict, namedtuple
 import warnings
 import httplib
 
@@ -21,7 +22,6 @@ from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from keen import scoped_keys
-from psycopg2._psycopg import AsIs
 from typedmodels.models import TypedModel, TypedModelManager
 from include import IncludeManager
 
@@ -32,14 +32,14 @@ from framework.exceptions import PermissionsError, HTTPError
 from framework.sentry import log_exception
 from osf.exceptions import (InvalidTagError, NodeStateError,
                             TagNotFoundError, UserNotAffiliatedError)
-from osf.models.contributor import (Contributor, get_contributor_permissions)
+from osf.models.contributor import (Contributor, NodePermissionIndex, get_contributor_permissions)
 
 from osf.models.collection import CollectionSubmission
 from osf.models.identifiers import Identifier, IdentifierMixin
 from osf.models.licenses import NodeLicenseRecord
 from osf.models.mixins import (AddonModelMixin, CommentableMixin, Loggable, ContributorMixin,
                                NodeLinkMixin, Taggable, TaxonomizableMixin, SpamOverrideMixin)
-from osf.models.node_relation import NodeRelation
+from osf.models.node_relation import NodeRelation, NodeRelationClosure
 from osf.models.nodelog import NodeLog
 from osf.models.sanctions import RegistrationApproval
 from osf.models.private_link import PrivateLink
@@ -49,9 +49,10 @@ from osf.models.validators import validate_title
 from framework.auth.core import Auth
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 from osf.utils.fields import NonNaiveDateTimeField
+from osf.utils.forking import BulkNodeForker, BulkNodeTemplater
 from osf.utils.requests import DummyRequest, get_request_and_user_id
 from osf.utils import sanitize
-from website import language, settings
+from website import settings
 from website.citations.utils import datetime_to_csl
 from website.project.licenses import set_license
 from website.project import signals as project_signals
@@ -60,13 +61,15 @@ from website.project.model import NodeUpdateError
 from website.identifiers.tasks import update_doi_metadata_on_change
 from website.identifiers.clients import DataCiteClient
 from osf.utils.requests import get_headers_from_request
-from osf.utils.permissions import ADMIN, CREATOR_PERMISSIONS, DEFAULT_CONTRIBUTOR_PERMISSIONS, expand_permissions
+from osf.utils.permissions import ADMIN, DEFAULT_CONTRIBUTOR_PERMISSIONS, expand_permissions
 from website.util import api_url_for, api_v2_url, web_url_for
 from .base import BaseModel, GuidMixin, GuidMixinQuerySet
 
 
 logger = logging.getLogger(__name__)
 
+Descendant = namedtuple('Descendant', ['node', 'depth', 'parent_id', 'is_node_link'])
+
 
 class AbstractNodeQuerySet(GuidMixinQuerySet):
 
@@ -75,53 +78,18 @@ class AbstractNodeQuerySet(GuidMixinQuerySet):
 
     def get_children(self, root, active=False, include_root=False):
         # If `root` is a root node, we can use the 'descendants' related name
-        # rather than doing a recursive query
+        # rather than joining against the hierarchy closure table
         if root.id == root.root_id:
             query = root.descendants.all() if include_root else root.descendants.exclude(id=root.id)
             if active:
                 query = query.filter(is_deleted=False)
             return query
         else:
-            sql = """
-                WITH RECURSIVE descendants AS (
-                SELECT
-                    parent_id,
-                    child_id,
-                    1 AS LEVEL,
-                    ARRAY[parent_id] as pids
-                FROM %s
-                %s
-                WHERE is_node_link IS FALSE AND parent_id = %s %s
-                UNION ALL
-                SELECT
-                    d.parent_id,
-                    s.child_id,
-                    d.level + 1,
-                    d.pids || s.parent_id
-                FROM descendants AS d
-                    JOIN %s AS s
-                    ON d.child_id = s.parent_id
-                WHERE s.is_node_link IS FALSE AND %s = ANY(pids)
-                ) SELECT array_agg(DISTINCT child_id)
-                FROM descendants
-                WHERE parent_id = %s;
-            """
-            with connection.cursor() as cursor:
-                node_relation_table = AsIs(NodeRelation._meta.db_table)
-                cursor.execute(sql, [
-                    node_relation_table,
-                    AsIs('LEFT JOIN osf_abstractnode ON {}.child_id = osf_abstractnode.id'.format(node_relation_table) if active else ''),
-                    root.pk,
-                    AsIs('AND osf_abstractnode.is_deleted IS FALSE' if active else ''),
-                    node_relation_table,
-                    root.pk,
-                    root.pk])
-                row = cursor.fetchone()[0]
-                if not row:
-                    return AbstractNode.objects.filter(id=root.pk) if include_root else AbstractNode.objects.none()
-                if include_root:
-                    row.append(root.pk)
-                return AbstractNode.objects.filter(id__in=row)
+            descendant_ids = NodeRelationClosure.objects.filter(ancestor_id=root.pk).values('descendant_id')
+            query = AbstractNode.objects.filter(Q(id__in=descendant_ids) | Q(id=root.pk)) if include_root else AbstractNode.objects.filter(id__in=descendant_ids)
+            if active:
+                query = query.filter(is_deleted=False)
+            return query
 
     def can_view(self, user=None, private_link=None):
         qs = self.filter(is_public=True)
@@ -140,23 +108,9 @@ class AbstractNodeQuerySet(GuidMixinQuerySet):
             if not isinstance(user, int):
                 raise TypeError('"user" must be either {} or {}. Got {!r}'.format(int, OSFUser, user))
 
-            sqs = Contributor.objects.filter(node=models.OuterRef('pk'), user__id=user, read=True)
-            qs |= self.annotate(can_view=models.Exists(sqs)).filter(can_view=True)
-            qs |= self.extra(where=["""
-                "osf_abstractnode".id in (
-                    WITH RECURSIVE implicit_read AS (
-                        SELECT "osf_contributor"."node_id"
-                        FROM "osf_contributor"
-                        WHERE "osf_contributor"."user_id" = %s
-                        AND "osf_contributor"."admin" is TRUE
-                    UNION ALL
-                        SELECT "osf_noderelation"."child_id"
-                        FROM "implicit_read"
-                        LEFT JOIN "osf_noderelation" ON "osf_noderelation"."parent_id" = "implicit_read"."node_id"
-                        WHERE "osf_noderelation"."is_node_link" IS FALSE
-                    ) SELECT * FROM implicit_read
-                )
-            """], params=(user, ))
+            # Explicit contributors and implicit read access from admin ancestors
+            readable_ids = NodePermissionIndex.objects.filter(user_id=user, read=True).values('node_id')
+            qs |= self.filter(id__in=readable_ids)
 
         return qs
 
@@ -275,6 +229,42 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
     ) SELECT {fields} FROM "{nodelicenserecord}"
     WHERE id = (SELECT node_license_id FROM ascendants WHERE node_license_id IS NOT NULL) LIMIT 1;""")
 
+    DESCENDANTS_QUERY = re.sub(r'\s+', ' ', """WITH RECURSIVE descendants AS (
+            SELECT
+                R.child_id,
+                R.parent_id,
+                R.is_node_link,
+                1 AS depth,
+                ARRAY[R.parent_id, R.child_id] AS visited,
+                ARRAY[{sort_key}, R.child_id::numeric] AS sort_path
+            FROM "{noderelation}" AS R
+                JOIN "{abstractnode}" AS N ON N.id = R.child_id
+            WHERE R.parent_id = %s {relation_filter}
+        UNION ALL
+            SELECT
+                R.child_id,
+                R.parent_id,
+                R.is_node_link,
+                D.depth + 1,
+                D.visited || R.child_id,
+                D.sort_path || ARRAY[{sort_key}, R.child_id::numeric]
+            FROM descendants AS D
+                JOIN "{noderelation}" AS R ON R.parent_id = D.child_id
+                JOIN "{abstractnode}" AS N ON N.id = R.child_id
+            WHERE NOT R.child_id = ANY(D.visited) {recursion_filter} {relation_filter}
+    ) SELECT {fields}, D.depth, D.parent_id, D.is_node_link
+    FROM descendants AS D
+        JOIN "{abstractnode}" AS N ON N.id = D.child_id
+    {where}
+    ORDER BY D.sort_path {limit};""")
+
+    # Each level of sort_path pairs the sort key with the child id, so siblings with
+    # equal keys still sort apart and their subtrees stay contiguous
+    DESCENDANTS_SORT_KEYS = {
+        '_order': 'R._order::numeric',
+        'created': 'EXTRACT(EPOCH FROM N.created)::numeric',
+    }
+
     affiliated_institutions = models.ManyToManyField('Institution', related_name='nodes')
     category = models.CharField(max_length=255,
                                 choices=CATEGORY_MAP.items(),
@@ -1229,39 +1219,15 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
         return self.private_links.filter(is_deleted=True).values_list('key', flat=True)
 
     def get_root(self):
-        sql = """
-            WITH RECURSIVE ascendants AS (
-              SELECT
-                parent_id,
-                child_id,
-                1 AS LEVEL,
-                ARRAY[child_id] as cids
-              FROM %s
-              WHERE is_node_link IS FALSE and child_id = %s
-              UNION ALL
-              SELECT
-                S.parent_id,
-                D.child_id,
-                D.level + 1,
-                D.cids || S.child_id
-              FROM ascendants AS D
-                JOIN %s AS S
-                  ON D.parent_id = S.child_id
-              WHERE S.is_node_link IS FALSE
-                AND %s = ANY(cids)
-            ) SELECT parent_id
-              FROM ascendants
-              WHERE child_id = %s
-              ORDER BY level DESC
-              LIMIT 1;
-        """
-        with connection.cursor() as cursor:
-            node_relation_table = AsIs(NodeRelation._meta.db_table)
-            cursor.execute(sql, [node_relation_table, self.pk, node_relation_table, self.pk, self.pk])
-            res = cursor.fetchone()
-            if res:
-                return AbstractNode.objects.get(pk=res[0])
-            return self
+        root_id = (
+            NodeRelationClosure.objects.filter(descendant_id=self.pk)
+            .order_by('-depth')
+            .values_list('ancestor_id', flat=True)
+            .first()
+        )
+        if root_id:
+            return AbstractNode.objects.get(pk=root_id)
+        return self
 
     def find_readable_antecedent(self, auth):
         """ Returns first antecendant node readable by <user>.
@@ -1280,6 +1246,10 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
             contrib.node = self
             contribs.append(contrib)
         Contributor.objects.bulk_create(contribs)
+        NodePermissionIndex.refresh_subtree(self.pk)
+
+    def update_permission_index(self, user):
+        NodePermissionIndex.refresh_subtree(self.pk, user_id=user.pk)
 
     def register_node(self, schema, auth, data, parent=None, child_ids=None, provider=None):
         """Make a frozen copy of a node.
@@ -1454,19 +1424,48 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
     def get_primary(self, node):
         return NodeRelation.objects.filter(parent=self, child=node, is_node_link=False).exists()
 
-    # TODO optimize me
+    def iter_descendants(self, primary_only=False, follow_links=False, order_by='_order',
+                         is_node_link=None, limit=None, **filters):
+        """Yield a ``Descendant(node, depth, parent_id, is_node_link)`` for each node below
+        this one, depth first, ordered within each parent by ``order_by``. The whole subtree
+        is fetched with a single query.
+
+        :param bool primary_only: Skip node links entirely
+        :param bool follow_links: Also descend into linked nodes. Otherwise linked nodes
+            are yielded but their children are not.
+        :param str order_by: ``'_order'`` (component order) or ``'created'``
+        :param bool is_node_link: Only yield nodes reached through (or not through) a node link
+        :param int limit: Yield at most this many nodes
+        :param filters: Lookups the yielded nodes must match, e.g. ``is_deleted=False``.
+            Filtered out nodes are still traversed.
+        """
+        where, params = [], [self.pk]
+        if filters:
+            subquery, subquery_params = AbstractNode.objects.filter(**filters).values('id').query.sql_with_params()
+            where.append('N.id IN ({})'.format(subquery))
+            params.extend(subquery_params)
+        if is_node_link is not None:
+            where.append('D.is_node_link IS {}'.format('TRUE' if is_node_link else 'FALSE'))
+        sql = self.DESCENDANTS_QUERY.format(
+            abstractnode=AbstractNode._meta.db_table,
+            noderelation=NodeRelation._meta.db_table,
+            fields=', '.join('N."{}"'.format(f.column) for f in AbstractNode._meta.concrete_fields),
+            sort_key=self.DESCENDANTS_SORT_KEYS[order_by],
+            relation_filter='AND R.is_node_link IS FALSE' if primary_only else '',
+            recursion_filter='' if follow_links else 'AND D.is_node_link IS FALSE',
+            where='WHERE {}'.format(' AND '.join(where)) if where else '',
+            limit='LIMIT {:d}'.format(limit) if limit is not None else '',
+        )
+        field_count = len(AbstractNode._meta.concrete_fields)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for row in cursor.fetchall():
+                node = AbstractNode.from_db(self._state.db, None, row[:field_count])
+                yield Descendant(node, *row[field_count:])
+
     def get_descendants_recursive(self, primary_only=False):
-        query = self.nodes_primary if primary_only else self._nodes
-        for node in query.all():
-            yield node
-            if not primary_only:
-                primary = self.get_primary(node)
-                if primary:
-                    for descendant in node.get_descendants_recursive(primary_only=primary_only):
-                        yield descendant
-            else:
-                for descendant in node.get_descendants_recursive(primary_only=primary_only):
-                    yield descendant
+        for descendant in self.iter_descendants(primary_only=primary_only):
+            yield descendant.node
 
     @property
     def nodes_primary(self):
@@ -1482,128 +1481,29 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
         """Recursively checks whether the current node or any of its nodes
         contains a pointer.
         """
-        if self.linked_nodes.exists():
-            return True
-        for node in self.nodes_primary:
-            if node.has_pointers_recursive:
-                return True
-        return False
+        return any(True for _ in self.iter_descendants(is_node_link=True, limit=1))
 
-    # TODO: Optimize me (e.g. use bulk create)
-    def fork_node(self, auth, title=None, parent=None):
-        """Recursively fork a node.
+    def fork_node(self, auth, title=None, progress=None):
+        """Fork a node and all of its non-deleted primary descendants that the
+        user can read. See ``osf.utils.forking.BulkNodeForker``.
 
         :param Auth auth: Consolidated authorization
         :param str title: Optional text to prepend to forked title
-        :param Node parent: Sets parent, should only be non-null when recursing
+        :param callable progress: Optional ``progress(phase, completed, total)`` callback
         :return: Forked node
         """
-        Registration = apps.get_model('osf.Registration')
-        PREFIX = 'Fork of '
         user = auth.user
 
         # Non-contributors can't fork private nodes
         if not (self.is_public or self.has_permission(user, 'read')):
             raise PermissionsError('{0!r} does not have permission to fork node {1!r}'.format(user, self._id))
 
-        when = timezone.now()
-
-        original = self
-
-        if original.is_deleted:
+        if self.is_deleted:
             raise NodeStateError('Cannot fork deleted node.')
 
-        # Note: Cloning a node will clone each WikiPage on the node and all the related WikiVersions
-        # and point them towards the fork
-        forked = original.clone()
-        if isinstance(forked, Registration):
-            forked.recast('osf.node')
-
-        forked.custom_citation = ''
-        forked.is_fork = True
-        forked.forked_date = when
-        forked.forked_from = original
-        forked.creator = user
-        forked.node_license = original.license.copy() if original.license else None
-        forked.wiki_private_uuids = {}
-
-        # Forks default to private status
-        forked.is_public = False
-
-        # Need to save here in order to access m2m fields
-        forked.save()
-
-        forked.tags.add(*self.all_tags.values_list('pk', flat=True))
-        forked.subjects.add(*self.subjects.values_list('pk', flat=True))
-
-        if parent:
-            node_relation = NodeRelation.objects.get(parent=parent.forked_from, child=original)
-            NodeRelation.objects.get_or_create(_order=node_relation._order, parent=parent, child=forked)
-
-        for node_relation in original.node_relations.filter(child__is_deleted=False):
-            node_contained = node_relation.child
-            # Fork child nodes
-            if not node_relation.is_node_link:
-                try:  # Catch the potential PermissionsError above
-                    node_contained.fork_node(
-                        auth=auth,
-                        title='',
-                        parent=forked,
-                    )
-                except PermissionsError:
-                    pass  # If this exception is thrown omit the node from the result set
-            else:
-                # Copy linked nodes
-                NodeRelation.objects.get_or_create(
-                    is_node_link=True,
-                    parent=forked,
-                    child=node_contained
-                )
-
-        if title is None:
-            forked.title = PREFIX + original.title
-        elif title == '':
-            forked.title = original.title
-        else:
-            forked.title = title
-
-        if len(forked.title) > 512:
-            forked.title = forked.title[:512]
-
-        forked.add_contributor(
-            contributor=user,
-            permissions=CREATOR_PERMISSIONS,
-            log=False,
-            save=False
-        )
-
-        forked.root = None  # Recompute root on save
-
-        forked.add_log(
-            action=NodeLog.NODE_FORKED,
-            params={
-                'parent_node': original.parent_id,
-                'node': original._primary_key,
-                'registration': forked._primary_key,  # TODO: Remove this in favor of 'fork'
-                'fork': forked._primary_key,
-            },
-            auth=auth,
-            log_date=when,
-            save=False,
-        )
-
-        # Clone each log from the original node for this fork.
-        self.clone_logs(forked)
-
-        # After fork callback
-        for addon in original.get_addons():
-            addon.after_fork(original, forked, user)
-
-        forked.save()
-
-        # Need to call this after save for the notifications to be created with the _primary_key
-        project_signals.contributor_added.send(forked, contributor=user, auth=auth, email_template='false')
-
+        forker = BulkNodeForker(self, auth, title=title, progress=progress)
+        forked = forker.run()
+        forked.fork_report = forker.report
         return forked
 
     def clone_logs(self, node, page_size=100):
@@ -1630,27 +1530,19 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
             ]
             NodeLog.objects.bulk_create(logs_to_create)
 
-    def use_as_template(self, auth, changes=None, top_level=True, parent=None):
-        """Create a new project, using an existing project as a template.
+    def use_as_template(self, auth, changes=None, top_level=True, progress=None):
+        """Create a new project, using an existing project as a template. Non-deleted
+        primary descendants the user can read are templated as well. See
+        ``osf.utils.forking.BulkNodeTemplater``.
 
         :param auth: The user to be assigned as creator
         :param changes: A dictionary of changes, keyed by node id, which
                         override the attributes of the template project or its
                         children.
         :param Bool top_level: indicates existence of parent TODO: deprecate
-        :param Node parent: parent template. Should only be passed in during recursion
+        :param callable progress: Optional ``progress(phase, completed, total)`` callback
         :return: The `Node` instance created.
         """
-        Registration = apps.get_model('osf.Registration')
-        changes = changes or dict()
-
-        # build the dict of attributes to change for the new node
-        try:
-            attributes = changes[self._id]
-            # TODO: explicitly define attributes which may be changed.
-        except (AttributeError, KeyError):
-            attributes = dict()
-
         if self.is_deleted:
             raise NodeStateError('Cannot use deleted node as template.')
 
@@ -1658,102 +1550,45 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
         if not (self.is_public or self.has_permission(auth.user, 'read')):
             raise PermissionsError('{0!r} does not have permission to template node {1!r}'.format(auth.user, self._id))
 
-        new = self.clone()
-        if isinstance(new, Registration):
-            new.recast('osf.node')
-
-        new._is_templated_clone = True  # This attribute may be read in post_save handlers
-
-        # Clear quasi-foreign fields
-        new.wiki_private_uuids.clear()
-        new.file_guid_to_share_uuids.clear()
-
-        # set attributes which may be overridden by `changes`
-        new.is_public = False
-        new.description = ''
-        new.custom_citation = ''
-
-        # apply `changes`
-        for attr, val in attributes.items():
-            setattr(new, attr, val)
-
-        # set attributes which may NOT be overridden by `changes`
-        new.creator = auth.user
-        new.template_node = self
-        # Need to save in order to access contributors m2m table
-        new.save(suppress_log=True)
-        new.add_contributor(contributor=auth.user, permissions=CREATOR_PERMISSIONS, log=False, save=False)
-        new.is_fork = False
-        new.node_license = self.license.copy() if self.license else None
-
-        # If that title hasn't been changed, apply the default prefix (once)
-        if (
-            new.title == self.title and top_level and
-            language.TEMPLATED_FROM_PREFIX not in new.title
-        ):
-            new.title = ''.join((language.TEMPLATED_FROM_PREFIX, new.title,))
-
-        if len(new.title) > 512:
-            new.title = new.title[:512]
-
-        # Slight hack - created is a read-only field.
-        new.created = timezone.now()
-
-        new.save(suppress_log=True)
-
-        # Need to call this after save for the notifications to be created with the _primary_key
-        project_signals.contributor_added.send(new, contributor=auth.user, auth=auth, email_template='false')
-
-        # Log the creation
-        new.add_log(
-            NodeLog.CREATED_FROM,
-            params={
-                'node': new._primary_key,
-                'template_node': {
-                    'id': self._primary_key,
-                    'url': self.url,
-                    'title': self.title,
-                },
-            },
-            auth=auth,
-            log_date=new.created,
-            save=False,
-        )
-        new.save()
-
-        if parent:
-            node_relation = NodeRelation.objects.get(parent=parent.template_node, child=self)
-            NodeRelation.objects.get_or_create(_order=node_relation._order, parent=parent, child=new)
-
-        # deal with the children of the node, if any
-        for node_relation in self.node_relations.select_related('child').filter(child__is_deleted=False):
-            node_contained = node_relation.child
-            # template child nodes
-            if not node_relation.is_node_link:
-                try:  # Catch the potential PermissionsError above
-                    node_contained.use_as_template(auth, changes, top_level=False, parent=new)
-                except PermissionsError:
-                    pass
-
-        new.root = None
-        new.save()  # Recompute root on save()
+        templater = BulkNodeTemplater(self, auth, changes=changes, top_level=top_level, progress=progress)
+        new = templater.run()
+        new.template_report = templater.report
         return new
 
     def next_descendants(self, auth, condition=lambda auth, node: True):
         """
-        Recursively find the first set of descedants under a given node that meet a given condition
+        Find the first set of descedants under a given node that meet a given condition
 
         returns a list of [(node, [children]), ...]
         """
-        ret = []
-        for node in self._nodes.order_by('created').all():
-            if condition(auth, node):
-                # base case
-                ret.append((node, []))
+        # Rebuild the tree from the depth first listing, skipping the
+        # descendants of nodes that meet the condition
+        tree = []
+        stack = [(0, tree)]
+        matched_depth = None
+        for node, depth, _, _ in self.iter_descendants(follow_links=True, order_by='created'):
+            if matched_depth is not None:
+                if depth > matched_depth:
+                    continue
+                matched_depth = None
+            while stack[-1][0] >= depth:
+                stack.pop()
+            children = []
+            matched = condition(auth, node)
+            stack[-1][1].append((node, children, matched))
+            if matched:
+                matched_depth = depth
             else:
-                ret.append((node, node.next_descendants(auth, condition)))
-        ret = [item for item in ret if item[1] or condition(auth, item[0])]  # prune empty branches
-        return ret
+                stack.append((depth, children))
+
+        def prune(items):
+            ret = []
+            for node, children, matched in items:
+                children = prune(children)
+                if matched or children:  # prune empty branches
+                    ret.append((node, children))
+            return ret
+        return prune(tree)
 
     def node_and_primary_descendants(self):
         """Return an iterator for a node and all of its primary (non-pointer) descendants.
@@ -1762,40 +1597,42 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
         """
         return itertools.chain([self], self.get_descendants_recursive(primary_only=True))
 
-    def get_active_contributors_recursive(self, unique_users=False, *args, **kwargs):
+    def _get_contributors_recursive(self, unique_users=False, **filters):
+        """Yield (user, node) tuples for the contributors matching ``filters`` on this
+        node and its primary descendants, fetching all contributors in one query.
+        """
+        nodes = list(self.node_and_primary_descendants())
+        contributors = defaultdict(list)
+        for contrib in (Contributor.objects.filter(node_id__in=[node.pk for node in nodes], user__is_active=True, **filters)
+                        .select_related('user').order_by('_order')):
+            contributors[contrib.node_id].append(contrib.user)
+        visited_user_ids = set()
+        for node in nodes:
+            for user in contributors[node.pk]:
+                if unique_users:
+                    if user.pk in visited_user_ids:
+                        continue
+                    visited_user_ids.add(user.pk)
+                yield (user, node)
+
+    def get_active_contributors_recursive(self, unique_users=False, include=lambda n: True):
         """Yield (admin, node) tuples for this node and
         descendant nodes. Excludes contributors on node links and inactive users.
 
         :param bool unique_users: If True, a given admin will only be yielded once
             during iteration.
+        :param callable include: Optional predicate contributors must satisfy
         """
-        visited_user_ids = []
-        for node in self.node_and_primary_descendants(*args, **kwargs):
-            for contrib in node.active_contributors(*args, **kwargs):
-                if unique_users:
-                    if contrib._id not in visited_user_ids:
-                        visited_user_ids.append(contrib._id)
-                        yield (contrib, node)
-                else:
-                    yield (contrib, node)
+        return ((contrib, node) for contrib, node in self._get_contributors_recursive(unique_users=unique_users) if include(contrib))
 
-    def get_admin_contributors_recursive(self, unique_users=False, *args, **kwargs):
+    def get_admin_contributors_recursive(self, unique_users=False):
         """Yield (admin, node) tuples for this node and
         descendant nodes. Excludes contributors on node links and inactive users.
 
         :param bool unique_users: If True, a given admin will only be yielded once
             during iteration.
         """
-        visited_user_ids = []
-        for node in self.node_and_primary_descendants(*args, **kwargs):
-            for contrib in node.contributors.all():
-                if node.has_permission(contrib, ADMIN) and contrib.is_active:
-                    if unique_users:
-                        if contrib._id not in visited_user_ids:
-                            visited_user_ids.append(contrib._id)
-                            yield (contrib, node)
-                    else:
-                        yield (contrib, node)
+        return self._get_contributors_recursive(unique_users=unique_users, admin=True)
 
     def set_access_requests_enabled(self, access_requests_enabled, auth, save=False):
         user = auth.user
@@ -2269,6 +2106,7 @@ def add_creator_as_contributor(sender, instance, created, **kwargs):
             write=True,
             admin=True
         )
+        instance.update_permission_index(instance.creator)
 
 
 @receiver(post_save, sender=Node)
@@ -2311,11 +2149,16 @@ def add_default_node_addons(sender, instance, created, **kwargs):
 @receiver(post_save, sender='osf.QuickFilesNode')
 def set_parent_and_root(sender, instance, created, *args, **kwargs):
     if getattr(instance, '_parent', None):
-        NodeRelation.objects.get_or_create(
+        _, created = NodeRelation.objects.get_or_create(
             parent=instance._parent,
             child=instance,
             is_node_link=False
         )
+        if not created:
+            # New relations are added to the closure by their post_save listener;
+            # make sure pre-existing ones are represented before computing the root
+            NodeRelationClosure.link(instance._parent.pk, instance.pk)
+            NodePermissionIndex.refresh_subtree(instance.pk)
         # remove cached copy of parent_node
         try:
             del instance.__dict__['parent_node']
@@ -1,4 +1,7 @@
-from django.db import models
+from django.apps import apps
+from django.db import connection, models
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
 
 from .base import BaseModel, ObjectIDMixin
 
@@ -25,3 +28,88 @@ class NodeRelation(ObjectIDMixin, BaseModel):
         index_together = (
             ('is_node_link', 'child', 'parent'),
         )
+
+
+class NodeRelationClosure(models.Model):
+    """Transitive closure of the primary (non node link) NodeRelations.
+
+    Stores one row per (ancestor, descendant) pair, annotated with the number of
+    primary links between them, so that hierarchy lookups are a single indexed
+    query regardless of tree depth. Nodes are not stored as their own ancestors.
+    Rows are maintained by the NodeRelation signal listeners below.
+    """
+    ancestor = models.ForeignKey('AbstractNode', related_name='descendant_closures', on_delete=models.CASCADE)
+    descendant = models.ForeignKey('AbstractNode', related_name='ancestor_closures', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField()
+
+    LINK_SQL = """
+        INSERT INTO "{closure}" (ancestor_id, descendant_id, depth)
+        SELECT A.ancestor_id, D.descendant_id, A.depth + D.depth + 1
+        FROM (
+            SELECT %(parent)s AS ancestor_id, 0 AS depth
+            UNION ALL
+            SELECT ancestor_id, depth FROM "{closure}" WHERE descendant_id = %(parent)s
+        ) AS A CROSS JOIN (
+            SELECT %(child)s AS descendant_id, 0 AS depth
+            UNION ALL
+            SELECT descendant_id, depth FROM "{closure}" WHERE ancestor_id = %(child)s
+        ) AS D
+        WHERE A.ancestor_id != D.descendant_id
+        ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
+    """
+
+    UNLINK_SQL = """
+        DELETE FROM "{closure}"
+        WHERE ancestor_id IN (
+            SELECT %(parent)s
+            UNION ALL
+            SELECT ancestor_id FROM "{closure}" WHERE descendant_id = %(parent)s
+        ) AND descendant_id IN (
+            SELECT %(child)s
+            UNION ALL
+            SELECT descendant_id FROM "{closure}" WHERE ancestor_id = %(child)s
+        );
+    """
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        index_together = (
+            ('descendant', 'depth'),
+        )
+
+    def __unicode__(self):
+        return 'ancestor={}, descendant={}, depth={}'.format(self.ancestor_id, self.descendant_id, self.depth)
+
+    @classmethod
+    def _execute(cls, sql, parent_id, child_id):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(closure=cls._meta.db_table), {'parent': parent_id, 'child': child_id})
+
+    @classmethod
+    def link(cls, parent_id, child_id):
+        """Record that ``child_id`` (and its subtree) now sits below ``parent_id``.
+        Idempotent, so it is safe to call for relations that already exist.
+        """
+        cls._execute(cls.LINK_SQL, parent_id, child_id)
+
+    @classmethod
+    def unlink(cls, parent_id, child_id):
+        """Remove every path that passed through the ``parent_id`` -> ``child_id`` link."""
+        cls._execute(cls.UNLINK_SQL, parent_id, child_id)
+
+
+##### Signal listeners #####
+@receiver(post_save, sender=NodeRelation)
+def add_relation_to_closure(sender, instance, created, **kwargs):
+    if created and not instance.is_node_link:
+        NodeRelationClosure.link(instance.parent_id, instance.child_id)
+        apps.get_model('osf.NodePermissionIndex').refresh_subtree(instance.child_id)
+
+
+@receiver(pre_delete, sender=NodeRelation)
+def remove_relation_from_closure(sender, instance, **kwargs):
+    # Runs before the delete so that paths through the subtree can still be
+    # resolved when the relation is removed by a cascading node delete
+    if not instance.is_node_link:
+        NodeRelationClosure.unlink(instance.parent_id, instance.child_id)
+        apps.get_model('osf.NodePermissionIndex').refresh_subtree(instance.child_id)
@@ -1,5 +1,8 @@
 
-from django.db import models
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
+from django.db.models import Q, Sum
 
 from osf.models.base import BaseModel
 
@@ -24,3 +27,234 @@ class ProviderAssetFile(BaseModel):
     name = models.CharField(choices=PROVIDER_ASSET_NAME_CHOICES, max_length=63)
     file = models.FileField(upload_to='assets')
     providers = models.ManyToManyField('AbstractProvider', blank=True, related_name='asset_files')
+
+
+class StorageUsage(models.Model):
+    """Bytes stored in OSFStorage by a node, per region. ``usage`` counts the versions of live
+    files and ``deleted_usage`` those of trashed files; files that share a version (copies,
+    forks, registrations) each count it. Rows are adjusted by deltas as files are uploaded,
+    trashed, restored, moved and copied, and can be recomputed exactly with ``repair``.
+    """
+    node = models.ForeignKey('AbstractNode', related_name='storage_usage', on_delete=models.CASCADE)
+    region = models.ForeignKey('addons_osfstorage.Region', null=True, blank=True, on_delete=models.CASCADE)
+    usage = models.BigIntegerField(default=0)
+    deleted_usage = models.BigIntegerField(default=0)
+
+    # Adds the (node_id, region_id, usage, deleted_usage) rows selected by ``deltas``.
+    # Rows are unique on (node_id, COALESCE(region_id, -1)).
+    APPLY_DELTAS_SQL = """
+        INSERT INTO "{table}" AS U (node_id, region_id, usage, deleted_usage)
+        {deltas}
+        ON CONFLICT (node_id, (COALESCE(region_id, -1))) DO UPDATE
+        SET usage = U.usage + EXCLUDED.usage,
+            deleted_usage = U.deleted_usage + EXCLUDED.deleted_usage;
+    """
+
+    # Version sizes of the given OSFStorage files of nodes, signed by whether they count as live or trashed
+    FILE_DELTAS_SQL = """
+        SELECT F.target_object_id, V.region_id,
+               %(usage_sign)s * SUM(GREATEST(V.size, 0)),
+               %(deleted_sign)s * SUM(GREATEST(V.size, 0))
+        FROM "{file_table}" AS F
+          JOIN "{file_versions_table}" AS FV ON FV.basefilenode_id = F.id
+          JOIN "{version_table}" AS V ON V.id = FV.fileversion_id
+        WHERE F.id = ANY(%(ids)s) AND F.provider = 'osfstorage' AND F.target_content_type_id = %(node_type)s
+        GROUP BY F.target_object_id, V.region_id
+    """
+
+    # Exact usage of every node, or of the nodes ``node_ids``, from their file versions
+    EXACT_USAGE_SQL = """
+        SELECT F.target_object_id AS node_id, V.region_id,
+               SUM(CASE WHEN F.type = ANY(%(trashed_types)s) THEN 0 ELSE GREATEST(V.size, 0) END)::BIGINT AS usage,
+               SUM(CASE WHEN F.type = ANY(%(trashed_types)s) THEN GREATEST(V.size, 0) ELSE 0 END)::BIGINT AS deleted_usage
+        FROM "{file_table}" AS F
+          JOIN "{file_versions_table}" AS FV ON FV.basefilenode_id = F.id
+          JOIN "{version_table}" AS V ON V.id = FV.fileversion_id
+        WHERE F.provider = 'osfstorage' AND F.target_content_type_id = %(node_type)s {node_clause}
+        GROUP BY F.target_object_id, V.region_id
+    """
+
+    DRIFT_SQL = """
+        WITH exact AS ({exact}),
+        stored AS (
+            SELECT node_id, region_id, usage, deleted_usage FROM "{table}"
+        )
+        SELECT COALESCE(E.node_id, S.node_id), COALESCE(E.region_id, S.region_id),
+               COALESCE(S.usage, 0), COALESCE(S.deleted_usage, 0),
+               COALESCE(E.usage, 0), COALESCE(E.deleted_usage, 0)
+        FROM exact AS E
+          FULL OUTER JOIN stored AS S ON S.node_id = E.node_id AND COALESCE(S.region_id, -1) = COALESCE(E.region_id, -1)
+        WHERE (COALESCE(S.usage, 0), COALESCE(S.deleted_usage, 0)) != (COALESCE(E.usage, 0), COALESCE(E.deleted_usage, 0));
+    """
+
+    REPAIR_SQL = """
+        DELETE FROM "{table}" WHERE node_id = ANY(%(node_ids)s);
+        INSERT INTO "{table}" (node_id, region_id, usage, deleted_usage) {exact};
+    """
+
+    # Usage of each root node with its descendants
+    ROOT_USAGE_SQL = """
+        SELECT N.root_id AS id, SUM(U.usage)::BIGINT AS usage, SUM(U.deleted_usage)::BIGINT AS deleted_usage
+        FROM "{table}" AS U
+          JOIN "{node_table}" AS N ON N.id = U.node_id
+          JOIN "{node_table}" AS R ON R.id = N.root_id
+        WHERE NOT R.type = ANY(%(excluded_types)s) AND NOT R.id = ANY(%(excluded_ids)s)
+        GROUP BY N.root_id
+    """
+
+    ROOTS_OVER_SQL = """
+        WITH roots AS ({roots})
+        SELECT id, usage, deleted_usage
+        FROM roots
+        WHERE usage + deleted_usage >= %(limit)s;
+    """
+
+    # Usage of the users who can write to root nodes, summed over those nodes
+    USER_USAGE_SQL = """
+        WITH roots AS ({roots})
+        SELECT C.user_id, SUM(R.usage)::BIGINT, SUM(R.deleted_usage)::BIGINT
+        FROM roots AS R
+          JOIN "{contributor_table}" AS C ON C.node_id = R.id
+        WHERE C.write IS TRUE
+        GROUP BY C.user_id
+        HAVING SUM(R.usage + R.deleted_usage) >= %(limit)s;
+    """
+
+    def __repr__(self):
+        return '<{self.__class__.__name__}(node={self.node_id}, region={self.region_id}, usage={self.usage}, deleted_usage={self.deleted_usage})>'.format(self=self)
+
+    @staticmethod
+    def _node_type_id():
+        return ContentType.objects.get_for_model(apps.get_model('osf.AbstractNode')).id
+
+    @classmethod
+    def _file_tables(cls):
+        BaseFileNode = apps.get_model('osf.BaseFileNode')
+        return {
+            'table': cls._meta.db_table,
+            'file_table': BaseFileNode._meta.db_table,
+            'file_versions_table': BaseFileNode.versions.through._meta.db_table,
+            'version_table': apps.get_model('osf.FileVersion')._meta.db_table,
+        }
+
+    @classmethod
+    def adjust(cls, node_id, region_id, usage=0, deleted_usage=0):
+        if not usage and not deleted_usage:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                cls.APPLY_DELTAS_SQL.format(table=cls._meta.db_table, deltas='SELECT %(node)s, %(region)s, %(usage)s, %(deleted_usage)s'), {
+                    'node': node_id,
+                    'region': region_id,
+                    'usage': usage,
+                    'deleted_usage': deleted_usage,
+                }
+            )
+
+    @classmethod
+    def adjust_for_files(cls, file_ids, usage_sign=0, deleted_sign=0):
+        """Add (``sign`` = 1) or subtract (``sign`` = -1) the version sizes of the files ``file_ids``
+        to the usage or deleted usage of their nodes. Files of other providers and targets are ignored.
+        """
+        if not file_ids or not (usage_sign or deleted_sign):
+            return
+        tables = cls._file_tables()
+        with connection.cursor() as cursor:
+            cursor.execute(cls.APPLY_DELTAS_SQL.format(deltas=cls.FILE_DELTAS_SQL.format(**tables), **tables), {
+                'ids': list(file_ids),
+                'usage_sign': usage_sign,
+                'deleted_sign': deleted_sign,
+                'node_type': cls._node_type_id(),
+            })
+
+    @classmethod
+    def _exact_usage_sql(cls, node_ids=None):
+        return cls.EXACT_USAGE_SQL.format(
+            node_clause='AND F.target_object_id = ANY(%(node_ids)s)' if node_ids is not None else '',
+            **cls._file_tables()
+        )
+
+    @classmethod
+    def _exact_usage_params(cls, node_ids=None):
+        TrashedFileNode = apps.get_model('osf.TrashedFileNode')
+        return {
+            'trashed_types': TrashedFileNode._typedmodels_subtypes,
+            'node_type': cls._node_type_id(),
+            'node_ids': list(node_ids or []),
+        }
+
+    @classmethod
+    def drift(cls):
+        """Return (node_id, region_id, stored usage, stored deleted usage, usage, deleted usage)
+        for every (node, region) whose stored usage differs from its file versions.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                cls.DRIFT_SQL.format(table=cls._meta.db_table, exact=cls._exact_usage_sql()),
+                cls._exact_usage_params()
+            )
+            return cursor.fetchall()
+
+    @classmethod
+    def repair(cls, node_ids):
+        """Recompute the usage of the nodes ``node_ids`` from their file versions."""
+        node_ids = list(set(node_ids))
+        if not node_ids:
+            return
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    cls.REPAIR_SQL.format(table=cls._meta.db_table, exact=cls._exact_usage_sql(node_ids)),
+                    cls._exact_usage_params(node_ids)
+                )
+
+    @classmethod
+    def _totals(cls, queryset):
+        totals = queryset.aggregate(usage=Sum('usage'), deleted_usage=Sum('deleted_usage'))
+        return {key: value or 0 for key, value in totals.items()}
+
+    @classmethod
+    def for_node(cls, node, descendants=True):
+        """Return the usage and deleted usage of ``node``, including its descendants if ``descendants``."""
+        condition = Q(node_id=node.id)
+        if descendants:
+            NodeRelationClosure = apps.get_model('osf.NodeRelationClosure')
+            condition |= Q(node_id__in=NodeRelationClosure.objects.filter(ancestor_id=node.id).values('descendant_id'))
+        return cls._totals(cls.objects.filter(condition))
+
+    @classmethod
+    def for_region(cls, region):
+        return cls._totals(cls.objects.filter(region=region))
+
+    @classmethod
+    def _root_params(cls, excluded_ids, limit):
+        return {
+            'excluded_types': ['osf.collection', 'osf.quickfilesnode'],
+            'excluded_ids': list(excluded_ids or []),
+            'limit': limit,
+        }
+
+    @classmethod
+    def roots_over(cls, limit, excluded_ids=None):
+        """Return (node_id, usage, deleted_usage) for each project, with its components, that uses
+        at least ``limit`` bytes. The root nodes ``excluded_ids`` are skipped.
+        """
+        node_table = apps.get_model('osf.AbstractNode')._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(cls.ROOTS_OVER_SQL.format(
+                roots=cls.ROOT_USAGE_SQL.format(table=cls._meta.db_table, node_table=node_table),
+            ), cls._root_params(excluded_ids, limit))
+            return cursor.fetchall()
+
+    @classmethod
+    def users_over(cls, limit, excluded_ids=None):
+        """Return (user_id, usage, deleted_usage) for each user whose projects they can write to
+        use at least ``limit`` bytes. The root nodes ``excluded_ids`` are not counted.
+        """
+        node_table = apps.get_model('osf.AbstractNode')._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(cls.USER_USAGE_SQL.format(
+                roots=cls.ROOT_USAGE_SQL.format(table=cls._meta.db_table, node_table=node_table),
+                contributor_table=apps.get_model('osf.Contributor')._meta.db_table,
+            ), cls._root_params(excluded_ids, limit))
+            return cursor.fetchall()
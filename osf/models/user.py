@@ -709,6 +709,8 @@ class OSFUser(DirtyFieldsMixin, GuidMixin, BaseModel, AbstractBaseUser, Permissi
             else:
                 node.contributor_set.filter(user=user).update(user=self)
 
+            node.update_permission_index(user)
+            node.update_permission_index(self)
             node.save()
 
         # Skip bookmark collections
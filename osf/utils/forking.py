@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""Set-based copying of a node and its primary descendants, for forks and templates.
+
+``BulkNodeForker`` and ``BulkNodeTemplater`` produce the same nodes as the
+original per-node recursive implementations of ``AbstractNode.fork_node`` and
+``AbstractNode.use_as_template``, but read the subtree once and write nodes,
+guids, relations, contributors, tags, subjects and logs with ``bulk_create``.
+Addon hooks are batched per addon.
+"""
+import contextlib
+import copy
+import logging
+import time
+from collections import OrderedDict, defaultdict
+
+import bson
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from framework.analytics import increment_user_activity_counters
+from osf.utils.permissions import CREATOR_PERMISSIONS
+from website import language, settings
+from website.project import signals as project_signals
+
+logger = logging.getLogger(__name__)
+
+FORK_TITLE_PREFIX = 'Fork of '
+MAX_TITLE_LENGTH = 512
+
+# Fields reported as changed when the on_node_updated task is enqueued for a new fork
+FORK_SAVED_FIELDS = [
+    'title', 'category', 'description', 'is_fork', 'forked_from', 'forked_date',
+    'is_public', 'creator', 'node_license', 'contributors',
+]
+# Fields reported as changed when the on_node_updated task is enqueued for a new templated node
+TEMPLATE_SAVED_FIELDS = [
+    'title', 'category', 'description', 'is_fork', 'template_node',
+    'is_public', 'creator', 'node_license', 'contributors',
+]
+
+LOG_BATCH_SIZE = 1000
+
+
+class NodeCopyReport(object):
+    """Per-phase timings and object counts of a bulk fork or template instantiation."""
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.counts = OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.time() - start
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+    def to_dict(self):
+        return {
+            'timings': dict(self.timings),
+            'counts': dict(self.counts),
+            'total': self.total,
+        }
+
+
+class BulkNodeCopier(object):
+    """Copy ``node`` and every non-deleted primary descendant ``auth.user`` can read.
+
+    Permission and state checks for ``node`` itself are done by the calling model
+    method. Subclasses set ``PHASES`` and implement ``prepare_copy`` and ``build_logs``.
+
+    :param Node node: The node to copy
+    :param Auth auth: Consolidated authorization
+    :param callable progress: Optional ``progress(phase, completed, total)`` callback
+    """
+    PHASES = ()
+    SAVED_FIELDS = ()
+    # Whether node links of the copied nodes are copied as well
+    copy_node_links = False
+
+    def __init__(self, node, auth, progress=None):
+        self.node = node
+        self.auth = auth
+        self.user = auth.user
+        self.progress = progress
+        self.report = NodeCopyReport()
+        self.when = timezone.now()
+
+        self.originals = OrderedDict()  # original pk -> original, in tree order
+        self.copies = OrderedDict()  # original pk -> copy
+        self.parents = {}  # original pk -> original parent pk
+        self.relations = defaultdict(list)  # original parent pk -> NodeRelation values
+
+    def _progress(self, phase):
+        if self.progress:
+            self.progress(phase, self.PHASES.index(phase) + 1, len(self.PHASES))
+
+    def run(self):
+        with transaction.atomic():
+            for phase in self.PHASES:
+                with self.report.phase(phase):
+                    getattr(self, phase)()
+                self._progress(phase)
+        logger.info('{} copied {} nodes from {} in {:.2f}s: {}'.format(
+            self.__class__.__name__, len(self.copies), self.node._id, self.report.total, self.report.to_dict()
+        ))
+        return self.copies[self.node.pk]
+
+    def prepare_copy(self, node_copy, original):
+        """Set the attributes of the unsaved ``node_copy`` of ``original``."""
+        raise NotImplementedError()
+
+    def build_logs(self):
+        """Return the unsaved NodeLogs recording the creation of each copy."""
+        raise NotImplementedError()
+
+    # Phases
+
+    def read_subtree(self):
+        AbstractNode = apps.get_model('osf.AbstractNode')
+        NodeRelation = apps.get_model('osf.NodeRelation')
+        NodeRelationClosure = apps.get_model('osf.NodeRelationClosure')
+        NodePermissionIndex = apps.get_model('osf.NodePermissionIndex')
+
+        subtree_ids = [self.node.pk] + list(
+            NodeRelationClosure.objects.filter(ancestor=self.node).values_list('descendant_id', flat=True)
+        )
+        nodes = {node.pk: node for node in AbstractNode.objects.filter(id__in=subtree_ids)}
+        readable_ids = set(
+            NodePermissionIndex.objects.filter(user=self.user, node_id__in=subtree_ids, read=True)
+            .values_list('node_id', flat=True)
+        )
+        relations = NodeRelation.objects.filter(parent_id__in=subtree_ids, child__is_deleted=False)
+        if not self.copy_node_links:
+            relations = relations.filter(is_node_link=False)
+        for relation in relations.order_by('parent_id', '_order').values('parent_id', 'child_id', 'is_node_link', '_order'):
+            self.relations[relation['parent_id']].append(relation)
+
+        # Walk the tree breadth first, omitting children the user cannot read
+        # along with their subtrees, just like the recursive implementations
+        queue = [self.node.pk]
+        nodes[self.node.pk] = self.node
+        while queue:
+            node_id = queue.pop(0)
+            self.originals[node_id] = nodes[node_id]
+            for relation in self.relations[node_id]:
+                child = nodes.get(relation['child_id'])
+                if relation['is_node_link'] or child is None:
+                    continue
+                if child.is_public or child.pk in readable_ids:
+                    self.parents[child.pk] = node_id
+                    queue.append(child.pk)
+        self.report.count('nodes', len(self.originals))
+
+    def create_nodes(self):
+        AbstractNode = apps.get_model('osf.AbstractNode')
+        NodeLicenseRecord = apps.get_model('osf.NodeLicenseRecord')
+
+        licenses = self._resolve_licenses()
+        license_copies = {
+            pk: NodeLicenseRecord(
+                node_license_id=record.node_license_id,
+                year=record.year,
+                copyright_holders=record.copyright_holders,
+            )
+            for pk, record in licenses.items() if record
+        }
+        NodeLicenseRecord.objects.bulk_create(license_copies.values())
+
+        for pk, original in self.originals.items():
+            node_copy = self._clone(original)
+            self.prepare_copy(node_copy, original)
+            node_copy.node_license = license_copies.get(pk)
+            node_copy.title = node_copy.title[:MAX_TITLE_LENGTH]
+            self.copies[pk] = node_copy
+
+        AbstractNode.objects.bulk_create(self.copies.values())
+        top = self.copies[self.node.pk]
+        AbstractNode.objects.filter(id__in=[each.pk for each in self.copies.values()]).update(root_id=top.pk)
+        for node_copy in self.copies.values():
+            node_copy.root_id = top.pk
+
+    def create_guids(self):
+        # Imported here to avoid a circular import with osf.models.node
+        from osf.models.base import guid_allocator
+        Guid = apps.get_model('osf.Guid')
+        AbstractNode = apps.get_model('osf.AbstractNode')
+
+        content_type = ContentType.objects.get_for_model(AbstractNode)
+        copies = list(self.copies.values())
+        guid_ids = guid_allocator.allocate(len(copies), length=AbstractNode.__guid_min_length__)
+        Guid.objects.bulk_create([
+            Guid(_id=guid_id, content_type=content_type, object_id=node_copy.pk)
+            for guid_id, node_copy in zip(guid_ids, copies)
+        ])
+        for guid_id, node_copy in zip(guid_ids, copies):
+            # Prime GuidMixin._id so later phases do not query for it
+            setattr(node_copy, '__id_cache', guid_id)
+
+    def create_relations(self):
+        NodeRelation = apps.get_model('osf.NodeRelation')
+        NodeRelationClosure = apps.get_model('osf.NodeRelationClosure')
+
+        relations = []
+        for pk, node_copy in self.copies.items():
+            # Relations are renumbered in their original order, since skipping
+            # unreadable children leaves gaps that copied links could collide with
+            created = 0
+            for relation in self.relations[pk]:
+                if relation['is_node_link']:
+                    # Linked nodes are copied as links
+                    child_id = relation['child_id']
+                elif relation['child_id'] in self.copies:
+                    child_id = self.copies[relation['child_id']].pk
+                else:
+                    continue
+                relations.append(NodeRelation(
+                    parent_id=node_copy.pk,
+                    child_id=child_id,
+                    is_node_link=relation['is_node_link'],
+                    _order=created,
+                ))
+                created += 1
+        NodeRelation.objects.bulk_create(relations)
+
+        closure = []
+        for pk in self.copies:
+            parent_pk, depth = self.parents.get(pk), 1
+            while parent_pk is not None:
+                closure.append(NodeRelationClosure(
+                    ancestor_id=self.copies[parent_pk].pk,
+                    descendant_id=self.copies[pk].pk,
+                    depth=depth,
+                ))
+                parent_pk, depth = self.parents.get(parent_pk), depth + 1
+        NodeRelationClosure.objects.bulk_create(closure)
+        self.report.count('relations', len(relations))
+
+    def create_contributors(self):
+        Contributor = apps.get_model('osf.Contributor')
+        NodePermissionIndex = apps.get_model('osf.NodePermissionIndex')
+
+        permissions = {perm: True for perm in CREATOR_PERMISSIONS}
+        Contributor.objects.bulk_create([
+            Contributor(user=self.user, node_id=node_copy.pk, visible=True, _order=0, **permissions)
+            for node_copy in self.copies.values()
+        ])
+        NodePermissionIndex.refresh_subtree(self.copies[self.node.pk].pk)
+
+    def create_logs(self):
+        NodeLog = apps.get_model('osf.NodeLog')
+        logs = self.build_logs()
+        NodeLog.objects.bulk_create(logs)
+        self.report.count('logs', len(logs))
+        for log in logs:
+            increment_user_activity_counters(self.user._primary_key, log.action, log.date.isoformat())
+
+    def notify(self):
+        for node_copy in self.copies.values():
+            node_copy.update_or_enqueue_on_node_updated(self.user._id, first_save=True, saved_fields=self.SAVED_FIELDS)
+            # Need to call this after save for the notifications to be created with the _primary_key
+            project_signals.contributor_added.send(node_copy, contributor=self.user, auth=self.auth, email_template='false')
+
+    # Helpers
+
+    def _resolve_licenses(self):
+        """Return the (possibly inherited) license record of each original node."""
+        licenses = {}
+        for pk, original in self.originals.items():
+            if original.node_license_id:
+                licenses[pk] = original.node_license
+            elif pk in self.parents:
+                licenses[pk] = licenses[self.parents[pk]]
+            else:
+                licenses[pk] = original.license
+        return licenses
+
+    def _clone(self, original):
+        """Return an unsaved copy of ``original`` without re-fetching it.
+
+        Like ``BaseModel.clone``, all foreign keys are cleared.
+        """
+        values = {
+            field.attname: copy.deepcopy(getattr(original, field.attname))
+            for field in original._meta.concrete_fields
+            if not field.primary_key and not field.is_relation
+        }
+        node_copy = original.__class__(**values)
+        if isinstance(node_copy, apps.get_model('osf.Registration')):
+            node_copy.recast('osf.node')
+        return node_copy
+
+
+class BulkNodeForker(BulkNodeCopier):
+    """Fork ``node`` and its readable primary descendants, along with their node
+    links, tags, subjects, logs and addon settings.
+
+    :param str title: Optional title; ``None`` prepends "Fork of " to the original title
+    """
+    PHASES = (
+        'read_subtree', 'create_nodes', 'create_guids', 'create_relations',
+        'create_contributors', 'copy_tags_and_subjects', 'create_logs', 'addons', 'notify',
+    )
+    SAVED_FIELDS = FORK_SAVED_FIELDS
+    copy_node_links = True
+
+    def __init__(self, node, auth, title=None, progress=None):
+        super(BulkNodeForker, self).__init__(node, auth, progress=progress)
+        self.title = title
+
+    def prepare_copy(self, fork, original):
+        fork.custom_citation = ''
+        fork.is_fork = True
+        fork.forked_date = self.when
+        fork.forked_from = original
+        fork.creator = self.user
+        fork.wiki_private_uuids = {}
+        fork.last_logged = self.when
+        # Forks default to private status
+        fork.is_public = False
+
+        if original.pk == self.node.pk:
+            if self.title is None:
+                fork.title = FORK_TITLE_PREFIX + original.title
+            elif self.title != '':
+                fork.title = self.title
+
+    def build_logs(self):
+        NodeLog = apps.get_model('osf.NodeLog')
+        logs = []
+        for pk, fork in self.copies.items():
+            original = self.originals[pk]
+            if pk in self.parents:
+                parent_id = self.originals[self.parents[pk]]._id
+            else:
+                parent_id = original.parent_id
+            logs.append(NodeLog(
+                action=NodeLog.NODE_FORKED,
+                user=self.user,
+                params={
+                    'parent_node': parent_id,
+                    'node': original._primary_key,
+                    'registration': fork._primary_key,  # TODO: Remove this in favor of 'fork'
+                    'fork': fork._primary_key,
+                },
+                node_id=fork.pk,
+                original_node_id=original.pk,
+                date=self.when,
+            ))
+        return logs
+
+    def create_logs(self):
+        super(BulkNodeForker, self).create_logs()
+        NodeLog = apps.get_model('osf.NodeLog')
+
+        # Clone each log from the original nodes for the forks
+        fork_ids = {pk: fork.pk for pk, fork in self.copies.items()}
+        cloned = 0
+        batch = []
+        for log in NodeLog.objects.filter(node_id__in=list(fork_ids)).order_by('node_id', 'pk').iterator():
+            batch.append(NodeLog(
+                _id=bson.ObjectId(),
+                action=log.action,
+                date=log.date,
+                params=log.params,
+                should_hide=log.should_hide,
+                foreign_user=log.foreign_user,
+                node_id=fork_ids[log.node_id],
+                user_id=log.user_id,
+                original_node_id=log.original_node_id,
+            ))
+            if len(batch) >= LOG_BATCH_SIZE:
+                NodeLog.objects.bulk_create(batch)
+                cloned += len(batch)
+                batch = []
+        NodeLog.objects.bulk_create(batch)
+        cloned += len(batch)
+        self.report.count('logs', cloned)
+
+    def copy_tags_and_subjects(self):
+        AbstractNode = apps.get_model('osf.AbstractNode')
+        fork_ids = {pk: fork.pk for pk, fork in self.copies.items()}
+
+        for field_name in ('tags', 'subjects'):
+            field = AbstractNode._meta.get_field(field_name)
+            through = field.remote_field.through
+            source = '{}_id'.format(field.m2m_field_name())
+            target = '{}_id'.format(field.m2m_reverse_field_name())
+            rows = through.objects.filter(**{'{}__in'.format(source): list(fork_ids)}).values_list(source, target)
+            created = through.objects.bulk_create([
+                through(**{source: fork_ids[node_id], target: target_id})
+                for node_id, target_id in rows
+            ])
+            self.report.count(field_name, len(created))
+
+    def addons(self):
+        AbstractNode = apps.get_model('osf.AbstractNode')
+        original_ids = list(self.originals)
+        for config in AbstractNode.ADDONS_AVAILABLE:
+            try:
+                settings_model = config.node_settings
+            except LookupError:
+                settings_model = None
+            if not settings_model:
+                continue
+            for addon in settings_model.objects.filter(owner_id__in=original_ids, deleted=False):
+                addon.after_fork(self.originals[addon.owner_id], self.copies[addon.owner_id], self.user)
+                self.report.count('addons', 1)
+
+
+class BulkNodeTemplater(BulkNodeCopier):
+    """Create a new project from ``node`` and its readable primary descendants.
+
+    Node links, tags, logs and wiki pages are not copied, and each new node is
+    private with an empty description unless ``changes`` says otherwise.
+
+    :param dict changes: Attributes to override, keyed by the guid of the template node
+        they apply to. Applied in memory before the new nodes are inserted.
+    :param bool top_level: Whether the new top-level node gets the "Templated from" title prefix
+    """
+    PHASES = (
+        'read_subtree', 'create_nodes', 'create_guids', 'create_relations',
+        'create_contributors', 'create_logs', 'addons', 'notify',
+    )
+    SAVED_FIELDS = TEMPLATE_SAVED_FIELDS
+
+    def __init__(self, node, auth, changes=None, top_level=True, progress=None):
+        super(BulkNodeTemplater, self).__init__(node, auth, progress=progress)
+        self.changes = changes or {}
+        self.top_level = top_level
+
+    def prepare_copy(self, new, original):
+        new._is_templated_clone = True
+
+        # Clear quasi-foreign fields
+        new.wiki_private_uuids = {}
+        new.file_guid_to_share_uuids = {}
+
+        # set attributes which may be overridden by `changes`
+        new.is_public = False
+        new.description = ''
+        new.custom_citation = ''
+
+        # apply `changes`
+        for attr, val in self.changes.get(original._id, {}).items():
+            setattr(new, attr, val)
+
+        # set attributes which may NOT be overridden by `changes`
+        new.creator = self.user
+        new.template_node = original
+        new.is_fork = False
+        new.created = self.when
+        new.last_logged = self.when
+
+        # If that title hasn't been changed, apply the default prefix (once)
+        if (
+            original.pk == self.node.pk and self.top_level and new.title == original.title and
+            language.TEMPLATED_FROM_PREFIX not in new.title
+        ):
+            new.title = ''.join((language.TEMPLATED_FROM_PREFIX, new.title,))
+
+    def build_logs(self):
+        NodeLog = apps.get_model('osf.NodeLog')
+        return [
+            NodeLog(
+                action=NodeLog.CREATED_FROM,
+                user=self.user,
+                params={
+                    'node': new._primary_key,
+                    'template_node': {
+                        'id': self.originals[pk]._primary_key,
+                        'url': self.originals[pk].url,
+                        'title': self.originals[pk].title,
+                    },
+                },
+                node_id=new.pk,
+                original_node_id=new.pk,
+                date=self.when,
+            )
+            for pk, new in self.copies.items()
+        ]
+
+    def addons(self):
+        # bulk_create skips the add_default_node_addons post_save listener
+        default_addons = [addon.short_name for addon in settings.ADDONS_AVAILABLE if 'node' in addon.added_default]
+        for new in self.copies.values():
+            for addon_name in default_addons:
+                new.add_addon(addon_name, auth=None, log=False)
+            self.report.count('addons', len(default_addons))
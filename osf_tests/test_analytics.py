@@ -6,14 +6,15 @@ Unit tests for analytics logic in framework/analytics/__init__.py
 import mock
 import re
 import pytest
+from django.db import DatabaseError
 from django.utils import timezone
 from nose.tools import *  # noqa: F403
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from addons.osfstorage.models import OsfStorageFile
 from framework import analytics
-from osf.models import PageCounter
+from osf.models import PageCounter, PageViewEvent, PageVisitor, UserActivityCounter, UserActivityDelta
 
 from tests.base import OsfTestCase
 from osf_tests.factories import UserFactory, ProjectFactory
@@ -96,12 +97,14 @@ class TestPageCounter:
         page_counter_id = 'download:{}:{}'.format(project._id, file_node.id)
 
         PageCounter.update_counter(page_counter_id, {})
+        PageCounter.rollup()
 
         page_counter = PageCounter.objects.get(_id=page_counter_id)
         assert page_counter.total == 1
         assert page_counter.unique == 1
 
         PageCounter.update_counter(page_counter_id, {})
+        PageCounter.rollup()
 
         page_counter.refresh_from_db()
         assert page_counter.total == 2
@@ -113,16 +116,68 @@ class TestPageCounter:
         page_counter_id = 'download:{}:{}'.format(project._id, file_node.id)
 
         PageCounter.update_counter(page_counter_id, {'contributors': project.contributors})
+        PageCounter.rollup()
         page_counter = PageCounter.objects.get(_id=page_counter_id)
         assert page_counter.total == 0
         assert page_counter.unique == 0
 
         PageCounter.update_counter(page_counter_id, {'contributors': project.contributors})
+        PageCounter.rollup()
 
         page_counter.refresh_from_db()
         assert page_counter.total == 0
         assert page_counter.unique == 0
 
+    @mock.patch('osf.models.analytics.session')
+    def test_update_counter_appends_event_without_session_writes(self, mock_session, project, file_node):
+        mock_session.data = {}
+        page_counter_id = 'download:{}:{}'.format(project._id, file_node.id)
+
+        PageCounter.update_counter(page_counter_id, {})
+
+        assert PageViewEvent.objects.filter(page=page_counter_id).count() == 1
+        assert not PageCounter.objects.filter(_id=page_counter_id).exists()
+        assert mock_session.save.called is False
+        assert mock_session.data == {}
+
+    @mock.patch('osf.models.analytics.get_visitor_key')
+    @mock.patch('osf.models.analytics.session')
+    def test_rollup_counts_unique_visitors(self, mock_session, mock_visitor, project, file_node):
+        mock_session.data = {}
+        page_counter_id = 'download:{}:{}'.format(project._id, file_node.id)
+        for visitor in ('client:a', 'client:b', 'client:a'):
+            mock_visitor.return_value = visitor
+            PageCounter.update_counter(page_counter_id, {})
+
+        assert PageCounter.rollup() == 3
+        assert not PageViewEvent.objects.exists()
+
+        page_counter = PageCounter.objects.get(_id=page_counter_id)
+        today = timezone.now().strftime('%Y/%m/%d')
+        assert page_counter.total == 3
+        assert page_counter.unique == 2
+        assert page_counter.date[today] == {'total': 3, 'unique': 2}
+        assert PageCounter.get_basic_counters(page_counter_id) == (2, 3)
+        assert PageCounter.get_all_downloads_on_date(timezone.now()) == 3
+
+        # Visitors already counted are not counted again in later rollups
+        PageCounter.update_counter(page_counter_id, {})
+        PageCounter.rollup()
+        page_counter.refresh_from_db()
+        assert page_counter.total == 4
+        assert page_counter.unique == 2
+
+    def test_prune_visitors_outside_unique_window(self):
+        today = timezone.now().date()
+        PageVisitor.objects.create(page='view:abcde', visitor='client:a', date=today)
+        PageVisitor.objects.create(
+            page='view:abcde', visitor='client:b',
+            date=today - PageCounter.VISITOR_RETENTION - timedelta(days=1),
+        )
+
+        assert PageCounter.prune_visitors() == 1
+        assert list(PageVisitor.objects.values_list('visitor', flat=True)) == ['client:a']
+
     def test_get_all_downloads_on_date(self, page_counter, page_counter2):
         """
         This method tests that multiple pagecounter objects have their download totals summed properly.
@@ -168,3 +223,71 @@ class TestPageCounterRegex:
 
         match = re.match(PageCounter.DOWNLOAD_ALL_VERSIONS_ID_PATTERN, 'download:guid1:fileid')
         assert match
+
+
+@pytest.mark.django_db
+class TestUserActivityDeltas:
+
+    def test_flush_applies_logged_deltas(self, user):
+        date = timezone.now().isoformat()
+        UserActivityCounter.record(user._id, 'project_created', date)
+        UserActivityCounter.record(user._id, 'project_created', date)
+        UserActivityCounter.record(user._id, 'wiki_updated', date)
+
+        assert not UserActivityCounter.objects.filter(_id=user._id).exists()
+        assert UserActivityCounter.get_total_activity_count(user._id) == 3
+        assert UserActivityCounter.flush_lag() >= 0
+
+        assert UserActivityCounter.flush_deltas(batch_size=2) == (3, 0)
+        counter = UserActivityCounter.objects.get(_id=user._id)
+        day = timezone.now().strftime('%Y/%m/%d')
+        assert counter.total == 3
+        assert counter.action['project_created'] == {'total': 2, 'date': {day: 2}}
+        assert counter.date[day] == {'total': 3}
+        assert not UserActivityDelta.objects.filter(user_id=user._id).exists()
+        assert UserActivityCounter.get_total_activity_count(user._id) == 3
+        assert UserActivityCounter.flush_lag() == 0
+
+    def test_flush_skipped_while_locked(self, user):
+        UserActivityCounter.record(user._id, 'project_created', timezone.now().isoformat())
+        with mock.patch('osf.models.analytics.connection.cursor') as mock_cursor:
+            mock_cursor.return_value.__enter__.return_value.fetchone.return_value = (False,)
+            assert UserActivityCounter.flush_deltas() is None
+        assert UserActivityDelta.objects.filter(user_id=user._id).count() == 1
+
+    def test_failed_flush_keeps_deltas(self, user):
+        UserActivityCounter.record(user._id, 'project_created', timezone.now().isoformat())
+        with mock.patch.object(UserActivityCounter, 'bulk_increment', side_effect=Exception):
+            with pytest.raises(Exception):
+                UserActivityCounter.flush_deltas()
+        assert UserActivityDelta.objects.filter(user_id=user._id).count() == 1
+        assert UserActivityCounter.get_total_activity_count(user._id) == 1
+
+    def test_flush_drops_deltas_that_cannot_be_applied(self, user):
+        other = UserFactory()
+        date = timezone.now().isoformat()
+        UserActivityCounter.record(user._id, 'project_created', date)
+        UserActivityCounter.record(other._id, 'project_created', date)
+        bulk_increment = UserActivityCounter.bulk_increment
+
+        def fail_for_user(deltas):
+            deltas = list(deltas)
+            if any(user_id == user._id for (user_id, _, _), _ in deltas):
+                raise DatabaseError()
+            return bulk_increment(deltas)
+
+        with mock.patch.object(UserActivityCounter, 'bulk_increment', side_effect=fail_for_user):
+            assert UserActivityCounter.flush_deltas() == (1, 1)
+        assert not UserActivityDelta.objects.exists()
+        assert UserActivityCounter.objects.get(_id=other._id).total == 1
+        assert not UserActivityCounter.objects.filter(_id=user._id).exists()
+
+    def test_bulk_increment_merges_existing_counters(self, user):
+        UserActivityCounter.increment(user._id, 'project_created', '2018-02-04T10:00:00')
+        UserActivityCounter.bulk_increment([
+            ((user._id, 'project_created', '2018/02/04'), 2),
+            ((user._id, 'project_created', '2018/02/05'), 1),
+        ])
+        counter = UserActivityCounter.objects.get(_id=user._id)
+        assert counter.total == 4
+        assert counter.action['project_created'] == {'total': 4, 'date': {'2018/02/04': 3, '2018/02/05': 1}}
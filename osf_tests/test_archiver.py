@@ -16,6 +16,7 @@ from nose.tools import *  # noqa: F403
 
 from framework.auth import Auth
 from framework.celery_tasks import handlers
+from framework.exceptions import HTTPError
 
 from website.archiver import (
     ARCHIVER_INITIATED,
@@ -24,13 +25,14 @@ from website.archiver import utils as archiver_utils
 from website.app import *  # noqa: F403
 from website.archiver import listeners
 from website.archiver.tasks import *   # noqa: F403
-from osf.models.archive import ArchiveTarget, ArchiveJob
+from osf.models.archive import ArchiveTarget, ArchiveJob, RegistrationFileIndex
 from website.archiver.decorators import fail_archive_on_error
 
 from website import mails
 from website import settings
 from osf.models import RegistrationSchema, Registration
 from osf.utils.sanitize import strip_html
+from addons.base.crawler import FileTreeCrawler, TokenBucket
 from addons.base.models import BaseStorageAddon
 from api.base.utils import waterbutler_api_url_for
 
@@ -442,6 +444,33 @@ class TestStorageAddonBase(ArchiverTestCase):
         assert_false(any('/1234567' in url for url in requests_made_urls))
         assert_false(any('/qwerty/asdfgh' in url for url in requests_made_urls))
 
+    @responses.activate
+    def test_get_fileobj_child_metadata_raises_status_of_non_json_errors(self):
+        url = waterbutler_api_url_for(
+            self.src._id,
+            'osfstorage',
+            meta=True,
+            path='/',
+            user=self.user,
+            view_only=True,
+            _internal=True,
+            base_url=self.src.osfstorage_region.waterbutler_url
+        )
+        responses.add(
+            responses.Response(
+                responses.GET,
+                url,
+                body='<html><body>502 Bad Gateway</body></html>',
+                status=502,
+                content_type='text/html'
+            )
+        )
+        addon = self.src.get_addon('osfstorage')
+        with pytest.raises(HTTPError) as excinfo:
+            addon._get_fileobj_child_metadata({'path': '/', 'kind': 'folder'}, self.user)
+        assert excinfo.value.code == 502
+        assert FileTreeCrawler._is_retryable(excinfo.value)
+
     def _test_addon(self, addon_short_name):
         self._test__get_file_tree(addon_short_name)
 
@@ -451,6 +480,64 @@ class TestStorageAddonBase(ArchiverTestCase):
         for addon in [a for a in settings.ADDONS_ARCHIVABLE if a not in ['wiki', 'forward']]:
             self._test_addon(addon)
 
+class TestFileTreeCrawler:
+
+    TREE = {
+        '/': [
+            {'path': '/a.txt', 'kind': 'file'},
+            {'path': '/sub/', 'kind': 'folder'},
+        ],
+        '/sub/': [
+            {'path': '/sub/b.txt', 'kind': 'file'},
+            {'path': '/sub/empty/', 'kind': 'folder'},
+        ],
+        '/sub/empty/': [],
+    }
+
+    def fetch(self, filenode):
+        return [dict(child) for child in self.TREE[filenode['path']]]
+
+    def test_crawl_builds_nested_tree(self):
+        crawler = FileTreeCrawler(self.fetch, 'github', concurrency=3, rate=1000)
+        tree = crawler.crawl({'path': '/', 'kind': 'folder'})
+        assert [child['path'] for child in tree['children']] == ['/a.txt', '/sub/']
+        sub = tree['children'][1]
+        assert [child['path'] for child in sub['children']] == ['/sub/b.txt', '/sub/empty/']
+        assert sub['children'][1]['children'] == []
+        assert 'children' not in tree['children'][0]
+        assert crawler.stats['requests'] == 3
+        assert crawler.stats['folders'] == 3
+        assert crawler.stats['files'] == 2
+
+    def test_crawl_retries_transient_errors(self):
+        failures = [HTTPError(503)]
+
+        def flaky_fetch(filenode):
+            if filenode['path'] == '/sub/' and failures:
+                raise failures.pop()
+            return self.fetch(filenode)
+
+        crawler = FileTreeCrawler(flaky_fetch, 'github', rate=1000, backoff=0)
+        tree = crawler.crawl({'path': '/', 'kind': 'folder'})
+        assert len(tree['children'][1]['children']) == 2
+        assert crawler.stats['retries'] == 1
+        assert crawler.stats['requests'] == 4
+
+    def test_crawl_raises_client_errors(self):
+        def forbidden_fetch(filenode):
+            raise HTTPError(403)
+
+        crawler = FileTreeCrawler(forbidden_fetch, 'github', rate=1000, backoff=0)
+        with pytest.raises(HTTPError):
+            crawler.crawl({'path': '/', 'kind': 'folder'})
+        assert crawler.stats['retries'] == 0
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        assert bucket.acquire() == 0
+        assert bucket.acquire() > 0
+
+
 class TestArchiverTasks(ArchiverTestCase):
 
     @mock.patch('framework.celery_tasks.handlers.enqueue_task')
@@ -479,6 +566,13 @@ class TestArchiverTasks(ArchiverTestCase):
         assert_equal(res.target_name, 'osfstorage')
         assert_equal(res.disk_usage, 128 + 256)
 
+    def test_stat_addon_records_crawl_stats(self):
+        with mock.patch.object(BaseStorageAddon, '_get_fileobj_child_metadata', return_value=[]):
+            stat_addon('osfstorage', self.archive_job._id)
+        target = self.archive_job.get_target('osfstorage')
+        assert_equal(target.crawl_stats['requests'], 1)
+        assert_equal(target.crawl_stats['folders'], 1)
+
     @mock.patch('website.archiver.tasks.archive_addon.delay')
     def test_archive_node_pass(self, mock_archive_addon):
         settings.MAX_ARCHIVE_SIZE = 1024 ** 3
@@ -908,64 +1002,73 @@ class TestArchiverUtils(ArchiverTestCase):
         archiver_utils.link_archive_provider(wo, self.user)
         assert_true(archiver_utils.has_archive_provider(wo, self.user))
 
-    def test_get_file_map(self):
+    def test_build_registration_file_index(self):
         node = factories.NodeFactory(creator=self.user)
+        registration = factories.RegistrationFactory(project=node, creator=self.user)
         file_tree = file_tree_factory(3, 3, 3)
         with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)):
-            file_map = archiver_utils.get_file_map(node)
-        stack = [file_tree]
-        file_map = {
-            sha256: value
-            for sha256, value, _ in file_map
+            RegistrationFileIndex.build(registration)
+        entries = {
+            entry.sha256: entry
+            for entry in RegistrationFileIndex.objects.filter(registration=registration)
         }
+        stack = [file_tree]
         while len(stack):
             item = stack.pop(0)
             if item['kind'] == 'file':
-                sha256 = item['extra']['hashes']['sha256']
-                assert_in(sha256, file_map)
-                map_file = file_map[sha256]
-                assert_equal(item, map_file)
+                entry = entries.pop(item['extra']['hashes']['sha256'])
+                assert_equal(entry.node, registration)
+                assert_equal(entry.source_node, node)
+                assert_equal((entry.name, entry.path), (item['name'], item['path']))
             else:
                 stack = stack + item['children']
+        assert_equal(entries, {})
 
-    def test_get_file_map_with_components(self):
-        node = factories.NodeFactory()
-        comp1 = factories.NodeFactory(parent=node)
-        factories.NodeFactory(parent=comp1)
-        factories.NodeFactory(parent=node)
+    def test_build_registration_file_index_with_components(self):
+        node = factories.NodeFactory(creator=self.user)
+        comp1 = factories.NodeFactory(parent=node, creator=self.user)
+        factories.NodeFactory(parent=comp1, creator=self.user)
+        factories.NodeFactory(parent=node, creator=self.user)
+        registration = factories.RegistrationFactory(project=node, creator=self.user)
 
         file_tree = file_tree_factory(3, 3, 3)
-        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)):
-            file_map = archiver_utils.get_file_map(node)
-            stack = [file_tree]
-            file_map = {
-                sha256: value
-                for sha256, value, _ in file_map
-            }
-            while len(stack):
-                item = stack.pop(0)
-                if item['kind'] == 'file':
-                    sha256 = item['extra']['hashes']['sha256']
-                    assert_in(sha256, file_map)
-                    map_file = file_map[sha256]
-                    assert_equal(item, map_file)
-                else:
-                    stack = stack + item['children']
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)) as mock_get_file_tree:
+            num_files = RegistrationFileIndex.build(registration)
+        assert_equal(mock_get_file_tree.call_count, 4)
+        assert_equal(RegistrationFileIndex.objects.filter(registration=registration).count(), num_files)
+        assert_equal(
+            set(RegistrationFileIndex.objects.filter(registration=registration).values_list('node', flat=True)),
+            {each.id for each in registration.node_and_primary_descendants()}
+        )
 
-    def test_get_file_map_memoization(self):
-        node = factories.NodeFactory()
-        comp1 = factories.NodeFactory(parent=node)
-        factories.NodeFactory(parent=comp1)
-        factories.NodeFactory(parent=node)
+        # Rebuilding replaces the rows of the registration
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree_factory(0, 0, 0))):
+            RegistrationFileIndex.build(registration)
+        assert_false(RegistrationFileIndex.objects.filter(registration=registration).exists())
 
-        with mock.patch.object(BaseStorageAddon, '_get_file_tree') as mock_get_file_tree:
-            mock_get_file_tree.return_value = file_tree_factory(3, 3, 3)
+    def test_find_registration_file_uses_index(self):
+        node = factories.NodeFactory(creator=self.user)
+        child = factories.NodeFactory(parent=node, creator=self.user)
+        registration = factories.RegistrationFactory(project=node, creator=self.user)
+        child_reg = registration.nodes[0]
 
-            # first call
-            archiver_utils.get_file_map(node)
+        file_tree = file_tree_factory(3, 3, 3)
+        selected = select_files_from_tree(file_tree).values()
+        with mock.patch.object(BaseStorageAddon, '_get_file_tree', mock.Mock(return_value=file_tree)) as mock_get_file_tree:
+            RegistrationFileIndex.build(registration)
             call_count = mock_get_file_tree.call_count
-            # second call
-            archiver_utils.get_file_map(node)
+            for item in selected:
+                value = {
+                    'sha256': item['extra']['hashes']['sha256'],
+                    'selectedFileName': item['name'],
+                    'nodeId': child._id,
+                }
+                registration_file, node_id = archiver_utils.find_registration_file(value, registration)
+                assert_equal(node_id, child_reg._id)
+                assert_equal(registration_file['path'], item['path'])
+
+                value['nodeId'] = factories.NodeFactory()._id
+                assert_equal(archiver_utils.find_registration_file(value, registration), (None, None))
             assert_equal(mock_get_file_tree.call_count, call_count)
 
 
@@ -1341,6 +1444,57 @@ class TestArchiveJobModel(OsfTestCase):
         for node in reg.node_and_primary_descendants():
             assert_true(node.archive_job.archive_tree_finished())
 
+    def test_completion_counters(self):
+        proj = factories.NodeFactory()
+        factories.NodeFactory(parent=proj)
+        reg = factories.RegistrationFactory(project=proj)
+        rchild = reg._nodes.first()
+        assert_equal(reg.archive_job.pending_target_count, 1)
+        assert_equal(reg.archive_job.unfinished_job_count, 2)
+        assert_equal(rchild.archive_job.unfinished_job_count, 1)
+
+        rchild.archive_job.update_target('osfstorage', ARCHIVER_SUCCESS)
+        assert_equal(reg.archive_job.unfinished_job_count, 1)
+        assert_equal(rchild.archive_job.unfinished_job_count, 0)
+        # Unfinished statuses do not change the counts
+        reg.archive_job.update_target('osfstorage', ARCHIVER_INITIATED)
+        assert_equal(reg.archive_job.pending_target_count, 1)
+
+        reg.archive_job.update_target('osfstorage', ARCHIVER_FAILURE)
+        assert_equal(reg.archive_job.pending_target_count, 0)
+        assert_equal(reg.archive_job.unfinished_job_count, 0)
+
+    def test_save_does_not_overwrite_counters(self):
+        reg = factories.RegistrationFactory(project=factories.NodeFactory())
+        stale = ArchiveJob.objects.get(pk=reg.archive_job.pk)
+        reg.archive_job.update_target('osfstorage', ARCHIVER_SUCCESS)
+        stale.sent = True
+        stale.save()
+        assert_true(reg.archive_job.archive_tree_finished())
+
+    def test_progress(self):
+        proj = factories.NodeFactory()
+        factories.NodeFactory(parent=proj)
+        reg = factories.RegistrationFactory(project=proj)
+        rchild = reg._nodes.first()
+        reg.archive_job.record_stat_result('osfstorage', {'num_files': 3, 'disk_usage': 300})
+        rchild.archive_job.update_target('osfstorage', ARCHIVER_SUCCESS, stat_result={'num_files': 1, 'disk_usage': 50})
+
+        progress = reg.archive_job.progress()
+        assert_equal(len(progress['targets']), 2)
+        assert_equal(progress['files'], 4)
+        assert_equal(progress['files_done'], 1)
+        assert_equal(progress['bytes'], 350)
+        assert_equal(progress['bytes_done'], 50)
+        assert_equal(rchild.archive_job.progress()['files'], 1)
+
+    @mock.patch('website.archiver.tasks.archive')
+    def test_archive_tree_lanes(self, mock_archive):
+        with mock.patch.object(settings, 'ARCHIVER_MAX_CONCURRENT_NODES', 2), mock.patch('celery.chain') as mock_chain:
+            archive_tree(['a', 'b', 'c'])
+        assert_equal(mock_chain.call_count, 2)
+        assert_equal(mock_archive.call_count, 3)
+
 # Regression test for https://openscience.atlassian.net/browse/OSF-9085
 def test_archiver_uncaught_error_mail_renders():
     src = factories.ProjectFactory()
@@ -1,10 +1,15 @@
 import pytest
 
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from addons.github.models import GithubFile, GithubFileNode, GithubFolder
 from addons.osfstorage.models import NodeSettings
 from addons.osfstorage import settings as osfstorage_settings
 from osf.models import BaseFileNode, Folder, File
+from osf.models.files import PROVIDER_MAP
+from website.files.exceptions import UnableToResolveFileClass
 from osf_tests.factories import (
     UserFactory,
     ProjectFactory,
@@ -92,3 +97,56 @@ def test_file_update_respects_region(project, user, create_test_file):
     )
     assert new_region != original_region
     assert new_version.region == new_region
+
+
+def wb_item(path, kind='file', provider='github', name=None):
+    name = name or path.strip('/').split('/')[-1]
+    return {
+        'attributes': {
+            'provider': provider,
+            'kind': kind,
+            'name': name,
+            'path': path,
+            'materialized': path,
+            'modified': None,
+            'size': 10 if kind == 'file' else None,
+            'etag': path,
+        }
+    }
+
+
+def test_resolve_class_uses_provider_registry():
+    assert BaseFileNode.resolve_class('github', BaseFileNode.FILE) is GithubFile
+    assert BaseFileNode.resolve_class('github', BaseFileNode.FOLDER) is GithubFolder
+    assert BaseFileNode.resolve_class('github', BaseFileNode.ANY) is GithubFileNode
+    assert PROVIDER_MAP[('github', BaseFileNode.FILE)] is GithubFile
+
+    with pytest.raises(UnableToResolveFileClass):
+        BaseFileNode.resolve_class('notaprovider', BaseFileNode.FILE)
+
+
+def test_bulk_get_or_create_from_waterbutler(project, user):
+    existing = GithubFile.get_or_create(project, '/existing.txt')
+    existing.name = 'existing.txt'
+    existing.save()
+    items = [
+        wb_item('/new.txt'),
+        wb_item('/existing.txt', name='renamed.txt'),
+        wb_item('/folder/', kind='folder'),
+    ]
+
+    with CaptureQueriesContext(connection) as queries:
+        file_nodes = BaseFileNode.bulk_get_or_create_from_waterbutler(project, items, user=user)
+    # Existing lookup, bulk update and bulk create, regardless of the listing size
+    assert len(queries) <= 4
+
+    assert [each._path for each in file_nodes] == ['/new.txt', '/existing.txt', '/folder/']
+    assert [type(each) for each in file_nodes] == [GithubFile, GithubFile, GithubFolder]
+    assert all(each.pk for each in file_nodes)
+    assert file_nodes[1].pk == existing.pk
+
+    existing.refresh_from_db()
+    assert existing.name == 'renamed.txt'
+    created = GithubFile.objects.get(_path='/new.txt', target_object_id=project.id)
+    assert created.provider == 'github'
+    assert created.history[0]['etag'] == '/new.txt'
@@ -4,7 +4,8 @@ import urllib
 from django.utils import timezone
 from django.core.exceptions import MultipleObjectsReturned
 
-from osf.models import Guid, NodeLicenseRecord, OSFUser
+from osf.models import BlackListGuid, Guid, NodeLicenseRecord, OSFUser
+from osf.models.base import GuidAllocator
 from osf_tests.factories import AuthUserFactory, UserFactory, NodeFactory, NodeLicenseRecordFactory, \
     RegistrationFactory, PreprintFactory, PreprintProviderFactory
 from tests.base import OsfTestCase
@@ -38,6 +39,39 @@ class TestGuid:
         assert obj._id
         assert len(obj._id) == 5
 
+@pytest.mark.django_db
+class TestGuidAllocator:
+
+    @pytest.fixture()
+    def allocator(self):
+        return GuidAllocator(batch_size=10, max_age=60)
+
+    def test_allocate_returns_unique_unused_guids(self, allocator):
+        guids = allocator.allocate(25)
+        assert len(set(guids)) == 25
+        assert all(len(guid) == 5 for guid in guids)
+        assert not Guid.objects.filter(_id__in=guids).exists()
+
+    def test_refill_excludes_used_and_blacklisted_guids(self, allocator):
+        used = Guid.objects.create()._id
+        blacklisted = BlackListGuid.objects.create(guid='zzzzz').guid
+        with mock.patch.object(allocator, '_generate_candidates', return_value={used, blacklisted, 'abcde'}):
+            allocator.refill(count=3)
+        assert allocator.allocate(1) == ['abcde']
+
+    @pytest.mark.django_assert_num_queries
+    def test_refill_is_a_single_query(self, allocator, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            allocator.refill(count=50)
+
+    def test_stale_pool_is_refilled(self, allocator):
+        allocator.refill()
+        with mock.patch('osf.models.base.time.time', return_value=allocator._refilled_at[5] + 61):
+            with mock.patch.object(allocator, 'refill', wraps=allocator.refill) as mock_refill:
+                allocator.allocate(1)
+        assert mock_refill.called
+
+
 @pytest.mark.django_db
 class TestReferent:
 
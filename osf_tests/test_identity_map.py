@@ -0,0 +1,72 @@
+import pytest
+
+from framework import identity_map
+from osf.models import AbstractNode, Guid, OSFUser
+from osf_tests.factories import ProjectFactory, UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture()
+def active_map():
+    current = identity_map.activate()
+    yield current
+    identity_map.deactivate()
+
+
+class TestIdentityMap:
+
+    def test_load_without_active_map_returns_new_instances(self):
+        user = UserFactory()
+        assert OSFUser.load(user._id) is not OSFUser.load(user._id)
+
+    @pytest.mark.django_assert_num_queries
+    def test_repeated_load_returns_same_instance(self, active_map, django_assert_num_queries):
+        project = ProjectFactory()
+        first = AbstractNode.load(project._id)
+        with django_assert_num_queries(0):
+            second = AbstractNode.load(project._id)
+        assert first is second
+        assert active_map.stats()['hits'] == 1
+        assert active_map.stats()['misses'] == 1
+
+    def test_guid_load_is_mapped(self, active_map):
+        user = UserFactory()
+        assert Guid.load(user._id) is Guid.load(user._id)
+
+    def test_save_evicts_instance(self, active_map):
+        user = UserFactory()
+        loaded = OSFUser.load(user._id)
+        loaded.save()
+        assert OSFUser.load(user._id) is not loaded
+
+    def test_save_evicts_instance_loaded_by_other_key(self, active_map):
+        user = UserFactory()
+        by_guid = OSFUser.load(user._id)
+        by_pk = OSFUser.load(user.pk)
+        by_guid.save()
+        assert OSFUser.load(user.pk) is not by_pk
+
+    def test_delete_and_refresh_evict_instance(self, active_map):
+        project = ProjectFactory()
+        loaded = AbstractNode.load(project._id)
+        loaded.refresh_from_db()
+        assert AbstractNode.load(project._id) is not loaded
+
+        guid = Guid.load(project._id)
+        guid.delete()
+        assert Guid.load(project._id) is None
+
+    def test_select_for_update_bypasses_map(self, active_map):
+        user = UserFactory()
+        loaded = OSFUser.load(user._id)
+        assert OSFUser.load(user._id, select_for_update=True) is not loaded
+
+    def test_deactivate_accumulates_counters(self):
+        user = UserFactory()
+        hits = identity_map.counters['hits']
+        identity_map.activate()
+        OSFUser.load(user._id)
+        OSFUser.load(user._id)
+        identity_map.deactivate()
+        assert identity_map.counters['hits'] == hits + 1
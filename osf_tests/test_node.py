@@ -26,6 +26,7 @@ from osf.utils.permissions import READ, WRITE, ADMIN, expand_permissions, DEFAUL
 from osf.models import (
     AbstractNode,
     Email,
+    Guid,
     Node,
     Tag,
     NodeLog,
@@ -33,6 +34,8 @@ from osf.models import (
     RegistrationSchema,
     Sanction,
     NodeRelation,
+    NodeRelationClosure,
+    NodePermissionIndex,
     Registration,
     DraftRegistration,
     DraftRegistrationApproval,
@@ -40,6 +43,7 @@ from osf.models import (
 
 from addons.wiki.models import WikiPage, WikiVersion
 from osf.models.node import AbstractNodeQuerySet
+from osf.utils.forking import BulkNodeForker, BulkNodeTemplater
 from osf.models.spam import SpamStatus
 from osf.exceptions import ValidationError, ValidationValueError, UserStateError
 from osf.utils.workflows import DefaultStates
@@ -322,6 +326,40 @@ class TestParentNode:
         assert AbstractNode.objects.get_roots().count() == 1
         assert top_level in AbstractNode.objects.get_roots()
 
+    def test_closure_tracks_primary_descendants(self):
+        root = ProjectFactory()
+        child = NodeFactory(parent=root)
+        grandchild = NodeFactory(parent=child)
+        linked = ProjectFactory()
+        child.add_node_link(linked, auth=Auth(child.creator), save=True)
+
+        closure = NodeRelationClosure.objects.filter(ancestor=root)
+        assert set(closure.values_list('descendant_id', 'depth')) == {(child.id, 1), (grandchild.id, 2)}
+        assert not NodeRelationClosure.objects.filter(descendant=linked).exists()
+        assert not NodeRelationClosure.objects.filter(descendant=root).exists()
+
+    def test_closure_removes_paths_through_deleted_relation(self):
+        root = ProjectFactory()
+        child = NodeFactory(parent=root)
+        grandchild = NodeFactory(parent=child)
+
+        NodeRelation.objects.get(parent=root, child=child).delete()
+
+        assert not NodeRelationClosure.objects.filter(ancestor=root).exists()
+        assert NodeRelationClosure.objects.filter(ancestor=child, descendant=grandchild, depth=1).exists()
+        assert grandchild.get_root() == child
+
+    @pytest.mark.django_assert_num_queries
+    def test_get_children_of_component_uses_closure(self, django_assert_num_queries):
+        root = ProjectFactory()
+        child = NodeFactory(parent=root)
+        grandchild = NodeFactory(parent=child)
+        greatgrandchild = NodeFactory(parent=grandchild)
+
+        with django_assert_num_queries(1):
+            result = list(Node.objects.get_children(child))
+        assert set(result) == {grandchild, greatgrandchild}
+
     def test_license_searches_parent_nodes(self):
         license_record = NodeLicenseRecordFactory()
         project = ProjectFactory(node_license=license_record)
@@ -1543,6 +1581,33 @@ class TestPermissionMethods:
         assert child_node.can_view(Auth(user=project.creator)) is True
         assert child_node.can_edit(Auth(user=project.creator)) is False
 
+    def test_permission_index_tracks_contributor_changes(self, project):
+        user = UserFactory()
+        project.add_contributor(user, permissions=[READ, WRITE], auth=Auth(project.creator), save=True)
+        entry = NodePermissionIndex.objects.get(user=user, node=project, source=NodePermissionIndex.CONTRIBUTOR)
+        assert (entry.read, entry.write, entry.admin) == (True, True, False)
+
+        project.set_permissions(user, [READ, WRITE, ADMIN], save=True)
+        entry.refresh_from_db()
+        assert entry.admin is True
+
+        project.remove_contributor(user, auth=Auth(project.creator))
+        assert not NodePermissionIndex.objects.filter(user=user, node=project).exists()
+
+    def test_permission_index_grants_implicit_read_to_ancestor_admins(self, project):
+        child = NodeFactory(parent=project, creator=UserFactory())
+        grandchild = NodeFactory(parent=child, creator=child.creator)
+        for node in (child, grandchild):
+            assert NodePermissionIndex.objects.filter(
+                user=project.creator, node=node, read=True, admin=False,
+                source=NodePermissionIndex.IMPLICIT_ADMIN,
+            ).exists()
+        assert Node.objects.can_view(user=project.creator).filter(id=grandchild.id).exists()
+
+        NodeRelation.objects.get(parent=project, child=child).delete()
+        assert not NodePermissionIndex.objects.filter(user=project.creator, node__in=[child, grandchild]).exists()
+        assert not Node.objects.can_view(user=project.creator).filter(id=grandchild.id).exists()
+
     def test_can_view_parent_write(self, project):
         user = UserFactory()
         node = NodeFactory(parent=project, creator=user)
@@ -2554,6 +2619,52 @@ class TestNodeTraversals:
         descendants = list(point1.get_descendants_recursive())
         assert len(descendants) == 1
 
+    def test_iter_descendants_returns_depth_and_parent(self, user, root, auth):
+        comp1 = NodeFactory(creator=user, parent=root)
+        comp1a = NodeFactory(creator=user, parent=comp1)
+        comp2 = NodeFactory(creator=user, parent=root)
+        linked = ProjectFactory(creator=user)
+        NodeFactory(creator=user, parent=linked)
+        comp1.add_pointer(linked, auth=auth)
+
+        descendants = list(root.iter_descendants())
+        assert [(d.node, d.depth, d.parent_id, d.is_node_link) for d in descendants] == [
+            (comp1, 1, root.pk, False),
+            (comp1a, 2, comp1.pk, False),
+            (linked, 2, comp1.pk, True),
+            (comp2, 1, root.pk, False),
+        ]
+        assert [d.node for d in root.iter_descendants(primary_only=True)] == [comp1, comp1a, comp2]
+
+    def test_iter_descendants_keeps_subtrees_of_tied_siblings_together(self, user, root):
+        comp1 = NodeFactory(creator=user, parent=root)
+        comp2 = NodeFactory(creator=user, parent=root)
+        comp1a = NodeFactory(creator=user, parent=comp1)
+        comp2a = NodeFactory(creator=user, parent=comp2)
+        NodeRelation.objects.filter(parent=root).update(_order=0)
+
+        nodes = [d.node for d in root.iter_descendants()]
+        assert nodes in ([comp1, comp1a, comp2, comp2a], [comp2, comp2a, comp1, comp1a])
+
+    def test_iter_descendants_filters_in_sql(self, user, root):
+        comp1 = NodeFactory(creator=user, parent=root, is_deleted=True)
+        comp1a = NodeFactory(creator=user, parent=comp1)
+        assert [d.node for d in root.iter_descendants(is_deleted=False)] == [comp1a]
+
+    @pytest.mark.django_assert_num_queries
+    def test_descendant_helpers_query_count_does_not_grow(self, user, root, auth, django_assert_num_queries):
+        parent = root
+        for _ in range(4):
+            parent = NodeFactory(creator=user, parent=parent)
+        parent.add_pointer(ProjectFactory(creator=user), auth=auth)
+
+        with django_assert_num_queries(1):
+            assert len(list(root.get_descendants_recursive(primary_only=True))) == 4
+        with django_assert_num_queries(1):
+            assert root.has_pointers_recursive is True
+        with django_assert_num_queries(2):
+            assert len(list(root.get_admin_contributors_recursive())) == 5
+
     def test_linked_from(self, node, auth):
         registration_to_link = RegistrationFactory()
         node_to_link = NodeFactory()
@@ -2954,6 +3065,49 @@ class TestForkNode:
         assert fork_wiki_version._id != wiki._id
         assert fork_wiki_version.identifier == 1
 
+class TestBulkNodeForker:
+
+    @pytest.fixture()
+    def project(self, user):
+        project = ProjectFactory(creator=user)
+        child = NodeFactory(parent=project, creator=user)
+        NodeFactory(parent=child, creator=user)
+        return project
+
+    def test_fork_report_has_phase_timings(self, project, auth):
+        fork = project.fork_node(auth)
+        report = fork.fork_report.to_dict()
+        assert list(fork.fork_report.timings.keys()) == list(BulkNodeForker.PHASES)
+        assert report['counts']['nodes'] == 3
+        assert report['total'] >= 0
+
+    def test_fork_reports_progress(self, project, auth):
+        progress = mock.Mock()
+        project.fork_node(auth, progress=progress)
+        assert progress.call_count == len(BulkNodeForker.PHASES)
+        progress.assert_called_with('notify', len(BulkNodeForker.PHASES), len(BulkNodeForker.PHASES))
+
+    def test_fork_maintains_hierarchy_indexes(self, project, auth, user):
+        fork = project.fork_node(auth)
+        fork_child = fork.nodes[0]
+        fork_grandchild = fork_child.nodes[0]
+        assert fork_grandchild.root == fork
+        assert fork_grandchild.get_root() == fork
+        assert NodeRelationClosure.objects.filter(ancestor=fork, descendant=fork_grandchild, depth=2).exists()
+        assert NodePermissionIndex.objects.filter(user=user, node=fork_grandchild, admin=True).exists()
+        assert fork_grandchild._id == Guid.objects.get(object_id=fork_grandchild.pk, content_type__model='abstractnode')._id
+
+    def test_fork_renumbers_relations_around_omitted_children(self, project, auth):
+        NodeFactory(parent=project, creator=project.creator, is_deleted=True)
+        readable = NodeFactory(parent=project, creator=project.creator)
+        project.add_pointer(ProjectFactory(is_public=True), auth=auth, save=True)
+
+        fork = project.fork_node(auth)
+        relations = list(fork.node_relations.order_by('_order').values_list('is_node_link', '_order'))
+        assert relations == [(False, 0), (False, 1), (True, 2)]
+        assert fork.nodes[1].forked_from == readable
+
+
 class TestContributorOrdering:
 
     def test_can_get_contributor_order(self, node):
@@ -4026,6 +4180,33 @@ class TestTemplateNode:
                 ['read', 'write', 'admin']
             )
 
+    def test_template_report_has_phase_timings(self, project, auth, component, subproject):
+        new = project.use_as_template(auth=auth)
+        assert list(new.template_report.timings.keys()) == list(BulkNodeTemplater.PHASES)
+        assert new.template_report.counts['nodes'] == 3
+        assert new.template_report.counts['logs'] == 3
+
+    def test_template_maintains_hierarchy_indexes(self, project, auth, user, subproject):
+        grandchild = NodeFactory(creator=user, parent=subproject)
+        new = project.use_as_template(auth=auth)
+        new_grandchild = new.nodes[0].nodes[0]
+        assert new_grandchild.template_node == grandchild
+        assert new_grandchild.root == new
+        assert NodeRelationClosure.objects.filter(ancestor=new, descendant=new_grandchild, depth=2).exists()
+        assert NodePermissionIndex.objects.filter(user=user, node=new_grandchild, admin=True).exists()
+        assert new_grandchild.has_addon('wiki')
+        self._verify_log(new_grandchild)
+
+    def test_template_applies_changes_to_descendants(self, project, auth, subproject):
+        new = project.use_as_template(auth=auth, changes={
+            subproject._id: {'title': 'Changed', 'description': 'Described', 'is_public': True},
+        })
+        new_subproject = new.nodes[0]
+        assert new_subproject.title == 'Changed'
+        assert new_subproject.description == 'Described'
+        assert new_subproject.is_public is True
+        assert new_subproject.creator == auth.user
+
 # copied from tests/test_models.py
 class TestNodeLog:
 
@@ -0,0 +1,96 @@
+import mock
+
+from website.files.metadata_cache import DjangoMetadataCacheBackend, LocalMetadataCacheBackend, WaterButlerMetadataCache
+
+
+def make_cache(max_entries=100, timeout=30):
+    return WaterButlerMetadataCache(backend=LocalMetadataCacheBackend(max_entries), timeout=timeout)
+
+
+class TestWaterButlerMetadataCache:
+
+    def test_get_returns_copy_of_cached_data(self):
+        cache = make_cache()
+        fingerprint = cache.credential_fingerprint(authorization='Bearer abc')
+        data = [{'attributes': {'name': 'file.txt', 'modified': None}}]
+        assert cache.get('abc12', 'github', '/', None, fingerprint) is None
+
+        cache.set('abc12', 'github', '/', None, fingerprint, data)
+        cached = cache.get('abc12', 'github', '/', None, fingerprint)
+        assert cached == data
+        cached[0]['attributes']['modified'] = 'changed'
+        assert cache.get('abc12', 'github', '/', None, fingerprint) == data
+
+        assert cache.stats()['hits'] == 2
+        assert cache.stats()['misses'] == 1
+        assert cache.hit_ratio == 2.0 / 3
+
+    def test_entries_are_keyed_by_credentials(self):
+        cache = make_cache()
+        mine = cache.credential_fingerprint(cookie='mine')
+        theirs = cache.credential_fingerprint(cookie='theirs')
+        cache.set('abc12', 'github', '/', None, mine, {'data': 1})
+        assert cache.get('abc12', 'github', '/', None, theirs) is None
+        assert cache.get('abc12', 'github', '/', None, cache.credential_fingerprint(cookie='mine', view_only='link')) is None
+
+    def test_entries_expire(self):
+        cache = make_cache(timeout=30)
+        cache.set('abc12', 'github', '/', None, 'key', {'data': 1})
+        with mock.patch('website.files.metadata_cache.time.time', return_value=10 ** 10):
+            assert cache.get('abc12', 'github', '/', None, 'key') is None
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = make_cache(max_entries=2)
+        cache.set('abc12', 'github', '/a/', None, 'key', 'a')
+        cache.set('abc12', 'github', '/b/', None, 'key', 'b')
+        cache.get('abc12', 'github', '/a/', None, 'key')
+        cache.set('abc12', 'github', '/c/', None, 'key', 'c')
+        assert cache.get('abc12', 'github', '/a/', None, 'key') == 'a'
+        assert cache.get('abc12', 'github', '/b/', None, 'key') is None
+
+    def test_disabled_without_timeout(self):
+        cache = make_cache(timeout=0)
+        cache.set('abc12', 'github', '/', None, 'key', {'data': 1})
+        assert cache.get('abc12', 'github', '/', None, 'key') is None
+
+    def test_invalidate_for_payload(self):
+        cache = make_cache()
+        for target_id, provider in (('abc12', 'github'), ('abc12', 'box'), ('def34', 'box')):
+            cache.set(target_id, provider, '/', None, 'key', provider)
+
+        cache.invalidate_for_payload('abc12', {'provider': 'github', 'metadata': {'path': '/file.txt'}})
+        assert cache.get('abc12', 'github', '/', None, 'key') is None
+        assert cache.get('abc12', 'box', '/', None, 'key') == 'box'
+
+        cache.invalidate_for_payload('abc12', {
+            'source': {'nid': 'def34', 'provider': 'box'},
+            'destination': {'nid': 'abc12', 'provider': 'box'},
+        })
+        assert cache.get('abc12', 'box', '/', None, 'key') is None
+        assert cache.get('def34', 'box', '/', None, 'key') is None
+        assert cache.stats()['invalidations'] == 3
+
+    def test_invalidate_is_skipped_while_disabled(self):
+        cache = make_cache(timeout=0)
+        cache.invalidate('abc12', 'github')
+        assert len(cache.backend) == 0
+        assert cache.stats()['invalidations'] == 0
+
+    def test_generations_expire_with_entries(self):
+        cache = make_cache(timeout=30)
+        cache.set('abc12', 'github', '/', None, 'key', 'old')
+        cache.invalidate('abc12', 'github')
+        cache.set('abc12', 'github', '/', None, 'key', 'new')
+        with mock.patch('website.files.metadata_cache.time.time', return_value=10 ** 10):
+            assert cache.get('abc12', 'github', '/', None, 'key') is None
+        # The expired generation and the listing looked up under it were dropped
+        assert len(cache.backend) == 1
+
+    def test_django_backend_shares_invalidations_between_instances(self):
+        api_cache = WaterButlerMetadataCache(backend=DjangoMetadataCacheBackend(100), timeout=30)
+        web_cache = WaterButlerMetadataCache(backend=DjangoMetadataCacheBackend(100), timeout=30)
+        api_cache.set('abc12', 'github', '/', None, 'key', {'data': 1})
+        assert web_cache.get('abc12', 'github', '/', None, 'key') == {'data': 1}
+
+        web_cache.invalidate('abc12', 'github')
+        assert api_cache.get('abc12', 'github', '/', None, 'key') is None
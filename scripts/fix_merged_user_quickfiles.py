@@ -25,6 +25,9 @@ def main():
             bad_contrib = node._contributors.get()
             logger.info('Fixing {} (quickfiles node): Replacing {} (bad contributor) with {} (creator)'.format(node._id, bad_contrib._id, node.creator._id))
             node.contributor_set.filter(user=bad_contrib).update(user=node.creator)
+            # Queryset updates skip the contributor hooks that maintain the permission index
+            node.update_permission_index(bad_contrib)
+            node.update_permission_index(node.creator)
             node.save()
         if dry:
             raise Exception('Abort Transaction - Dry Run')
@@ -4,21 +4,14 @@ Projects or users can have their GUID whitelisted via `usage_audit whitelist [GU
 User usage is defined as the total usage of all projects they have > READ access on
 Project usage is defined as the total usage of it and all its children
 total usage is defined as the sum of the size of all verions associated with X via OsfStorageFileNode and OsfStorageTrashedFileNode
+Usage is read from the StorageUsage counters; `repair=True` first recomputes drifted counters from the file versions
 """
 
 import os
-import gc
 import json
 import logging
-import functools
-
-from collections import defaultdict
-from django.contrib.contenttypes.models import ContentType
-
-import progressbar
 
 from framework.celery_tasks import app as celery_app
-from osf.models import TrashedFile, Node
 
 from website import mails
 from website.app import init_app
@@ -28,7 +21,8 @@ from scripts import utils as scripts_utils
 # App must be init'd before django models are imported
 init_app(set_backends=True, routes=False)
 
-from osf.models import BaseFileNode, FileVersion, OSFUser, AbstractNode
+from osf.management.commands.check_storage_usage import check_storage_usage
+from osf.models import OSFUser, AbstractNode, StorageUsage
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -58,50 +52,24 @@ def add_to_white_list(gtg):
     logger.info('Whitelist updated to {}'.format(WHITE_LIST))
 
 
-def get_usage(node):
-    node_content_type = ContentType.objects.get_for_model(Node)
-
-    vids = [each for each in BaseFileNode.active.filter(provider='osfstorage', target_object_id=node.id, target_content_type=node_content_type).values_list('versions', flat=True) if each]
-    t_vids = [each for eac in TrashedFile.objects.filter(provider='osfstorage', target_object_id=node.id, target_content_type=node_content_type).values_list('versions', flat=True) if each]
-
-    usage = sum([v.size or 0 for v in FileVersion.objects.filter(id__in=vids)])
-    trashed_usage = sum([v.size or 0 for v in FileVersion.objects.filter(id__in=t_vids)])
-
-    return list(map(sum, zip(*([(usage, trashed_usage)] + [get_usage(child) for child in node.nodes_primary]))))  # Adds tuples together, map(sum, zip((a, b), (c, d))) -> (a+c, b+d)
-
-
-def limit_filter(limit, (item, usage)):
-    """Note: usage is a tuple(current_usage, deleted_usage)"""
-    return item not in WHITE_LIST and sum(usage) >= limit
-
-
-def main(send_email=False):
+def main(send_email=False, repair=False):
     logger.info('Starting Project storage audit')
+    if repair:
+        logger.info('Repaired {} drifted storage usage counters'.format(check_storage_usage(repair=True)))
 
     lines = []
-    projects = {}
-    users = defaultdict(lambda: (0, 0))
-
-    top_level_nodes = AbstractNode.objects.get_roots()
-    progress_bar = progressbar.ProgressBar(maxval=top_level_nodes.count()).start()
-    top_level_nodes = top_level_nodes.iterator()
-
-    for i, node in enumerate(top_level_nodes):
-        progress_bar.update(i+1)
-        if node._id in WHITE_LIST:
-            continue  # Dont count whitelisted nodes against users
-        projects[node._id] = get_usage(node)
-        for contrib in node.contributors:
-            if node.can_edit(user=contrib):
-                users[contrib._id] = tuple(map(sum, zip(users[contrib._id], projects[node._id])))  # Adds tuples together, map(sum, zip((a, b), (c, d))) -> (a+c, b+d)
-
-        if i % 25 == 0:
-            gc.collect()
-    progress_bar.finish()
-
-    for model, collection, limit in ((OSFUser, users, USER_LIMIT), (AbstractNode, projects, PROJECT_LIMIT)):
-        for item, (used, deleted) in filter(functools.partial(limit_filter, limit), collection.items()):
-            line = '{!r} has exceeded the limit {:.2f}GBs ({}b) with {:.2f}GBs ({}b) used and {:.2f}GBs ({}b) deleted.'.format(model.load(item), limit / GBs, limit, used / GBs, used, deleted / GBs, deleted)
+    # Whitelisted projects are not counted against their contributors
+    white_listed_ids = AbstractNode.objects.filter(guids___id__in=WHITE_LIST).values_list('id', flat=True)
+
+    for model, offenders, limit in (
+        (OSFUser, StorageUsage.users_over(USER_LIMIT, excluded_ids=white_listed_ids), USER_LIMIT),
+        (AbstractNode, StorageUsage.roots_over(PROJECT_LIMIT, excluded_ids=white_listed_ids), PROJECT_LIMIT),
+    ):
+        for item_id, used, deleted in offenders:
+            item = model.objects.get(id=item_id)
+            if item._id in WHITE_LIST:
+                continue
+            line = '{!r} has exceeded the limit {:.2f}GBs ({}b) with {:.2f}GBs ({}b) used and {:.2f}GBs ({}b) deleted.'.format(item, limit / GBs, limit, used / GBs, used, deleted / GBs, deleted)
             logger.info(line)
             lines.append(line)
 
@@ -117,9 +85,9 @@ def main(send_email=False):
 
 
 @celery_app.task(name='scripts.osfstorage.usage_audit')
-def run_main(send_mail=False, white_list=None):
+def run_main(send_mail=False, white_list=None, repair=False):
     scripts_utils.add_file_logger(logger, __file__)
     if white_list:
         add_to_white_list(white_list)
     else:
-        main(send_mail)
+        main(send_mail, repair=repair)
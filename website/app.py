@@ -15,6 +15,7 @@ from django.apps import apps
 from framework.addons.utils import render_addon_capabilities
 from framework.celery_tasks import handlers as celery_task_handlers
 from framework.django import handlers as django_handlers
+from framework.identity_map import handlers as identity_map_handlers
 from framework.csrf import handlers as csrf_handlers
 from framework.flask import add_handlers, app
 # Import necessary to initialize the root logger
@@ -56,6 +57,7 @@ def attach_handlers(app, settings):
     """Add callback handlers to ``app`` in the correct order."""
     # Add callback handlers to application
     add_handlers(app, django_handlers.handlers)
+    add_handlers(app, identity_map_handlers.handlers)
     add_handlers(app, celery_task_handlers.handlers)
     add_handlers(app, transaction_handlers.handlers)
     add_handlers(app, postcommit_handlers.handlers)
@@ -1,4 +1,4 @@
-import celery
+import logging
 
 from framework.celery_tasks import handlers
 
@@ -10,6 +10,8 @@ from website.archiver import signals as archiver_signals
 
 from website.project import signals as project_signals
 
+logger = logging.getLogger(__name__)
+
 @project_signals.after_create_registration.connect
 def after_register(src, dst, user):
     """Blinker listener for registration initiations. Enqueqes a chain
@@ -24,9 +26,8 @@ def after_register(src, dst, user):
     archiver_utils.before_archive(dst, user)
     if dst.root != dst:  # if not top-level registration
         return
-    archive_tasks = [tasks.archive(job_pk=t.archive_job._id) for t in dst.node_and_primary_descendants()]
     handlers.enqueue_task(
-        celery.chain(archive_tasks)
+        tasks.archive_tree([t.archive_job._id for t in dst.node_and_primary_descendants()])
     )
 
 
@@ -40,6 +41,10 @@ def archive_callback(dst):
     root = dst.root
     root_job = root.archive_job
     if not root_job.archive_tree_finished():
+        progress = root_job.progress()
+        logger.info('Archiving {}: {}/{} files, {}/{} bytes'.format(
+            root._id, progress['files_done'], progress['files'], progress['bytes_done'], progress['bytes']
+        ))
         return
     if root_job.sent:
         return
@@ -31,6 +31,7 @@ from osf.models import (
     ArchiveJob,
     AbstractNode,
     DraftRegistration,
+    RegistrationFileIndex,
 )
 
 
@@ -138,6 +139,14 @@ def stat_addon(addon_short_name, job_pk):
             errors=[e.data['error']],
         )
         raise
+    finally:
+        crawl_stats = getattr(src_addon, 'crawl_stats', None)
+        if isinstance(crawl_stats, dict):
+            logger.info('Crawled {0} on node {1}: {2}'.format(addon_short_name, src._id, crawl_stats))
+            target = job.get_target(addon_short_name)
+            if target:
+                target.crawl_stats = crawl_stats
+                target.save()
     result = AggregateStatResult(
         src_addon._id,
         addon_short_name,
@@ -239,9 +248,12 @@ def archive_node(stat_results, job_pk):
             job.status = ARCHIVER_SUCCESS
             job.save()
         for result in stat_result.targets:
+            # Only the totals are kept, for progress reporting
+            totals = {'num_files': result['num_files'], 'disk_usage': result['disk_usage']}
             if not result['num_files']:
-                job.update_target(result['target_name'], ARCHIVER_SUCCESS)
+                job.update_target(result['target_name'], ARCHIVER_SUCCESS, stat_result=totals)
             else:
+                job.record_stat_result(result['target_name'], totals)
                 archive_addon.delay(
                     addon_short_name=result['target_name'],
                     job_pk=job_pk
@@ -278,6 +290,21 @@ def archive(job_pk):
     )
 
 
+def archive_tree(job_pks):
+    """Archives the jobs of a registration tree in up to ARCHIVER_MAX_CONCURRENT_NODES
+    parallel lanes. Each lane is a chain of #archive for some of the jobs; the addons of
+    each node are statted and copied concurrently within it.
+
+    :param job_pks: primary keys of the ArchiveJobs of the registration tree
+    :return: celery.group of lanes
+    """
+    lane_count = max(1, min(len(job_pks), settings.ARCHIVER_MAX_CONCURRENT_NODES))
+    lanes = [[] for _ in range(lane_count)]
+    for i, job_pk in enumerate(job_pks):
+        lanes[i % lane_count].append(archive(job_pk=job_pk))
+    return celery.group([celery.chain(lane) for lane in lanes])
+
+
 @celery_app.task(base=ArchiverTask, ignore_result=False)
 @logged('archive_success')
 def archive_success(dst_pk, job_pk):
@@ -289,13 +316,8 @@ def archive_success(dst_pk, job_pk):
 
     :param str dst_pk: primary key of registration Node
 
-    note:: At first glance this task makes redundant calls to utils.get_file_map (which
-    returns a generator yielding  (<sha256>, <file_metadata>) pairs) on the dst Node. Two
-    notes about utils.get_file_map: 1) this function memoizes previous results to reduce
-    overhead and 2) this function returns a generator that lazily fetches the file metadata
-    of child Nodes (it is possible for a selected file to belong to a child Node) using a
-    non-recursive DFS. Combined this allows for a relatively effient implementation with
-    seemingly redundant calls.
+    note:: Selected files are looked up in a RegistrationFileIndex of the registration's
+    OSFStorage files, which is built once here and shared by every schema with files.
     """
     create_app_context()
     dst = AbstractNode.load(dst_pk)
@@ -304,9 +326,11 @@ def archive_success(dst_pk, job_pk):
     # questions. These files are references to files on the unregistered Node, and
     # consequently we must migrate those file paths after archiver has run. Using
     # sha256 hashes is a convenient way to identify files post-archival.
-    for schema in dst.registered_schema.all():
-        if schema.has_files:
-            utils.migrate_file_metadata(dst, schema)
+    schemas = [schema for schema in dst.registered_schema.all() if schema.has_files]
+    if schemas:
+        RegistrationFileIndex.build(dst)
+    for schema in schemas:
+        utils.migrate_file_metadata(dst, schema)
     job = ArchiveJob.load(job_pk)
     if not job.sent:
         job.sent = True
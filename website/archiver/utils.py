@@ -1,5 +1,3 @@
-import functools
-
 from framework.auth import Auth
 
 from website.archiver import (
@@ -180,47 +178,11 @@ def before_archive(node, user):
     )
     job.set_targets()
 
-def _do_get_file_map(file_tree):
-    """Reduces a tree of folders and files into a list of (<sha256>, <file_metadata>) pairs
-    """
-    file_map = []
-    stack = [file_tree]
-    while len(stack):
-        tree_node = stack.pop(0)
-        if tree_node['kind'] == 'file':
-            file_map.append((tree_node['extra']['hashes']['sha256'], tree_node))
-        else:
-            stack = stack + tree_node['children']
-    return file_map
-
-def _memoize_get_file_map(func):
-    cache = {}
-
-    @functools.wraps(func)
-    def wrapper(node):
-        if node._id not in cache:
-            osf_storage = node.get_addon('osfstorage')
-            file_tree = osf_storage._get_file_tree(user=node.creator)
-            cache[node._id] = _do_get_file_map(file_tree)
-        return func(node, cache[node._id])
-    return wrapper
-
-@_memoize_get_file_map
-def get_file_map(node, file_map):
-    """
-    note:: file_map is injected implictly by the decorator; this method is called like:
-
-    get_file_map(node)
-    """
-    for (key, value) in file_map:
-        yield (key, value, node._id)
-    for child in node.nodes_primary:
-        for key, value, node_id in get_file_map(child):
-            yield (key, value, node_id)
-
 def find_registration_file(value, node):
-    from osf.models import AbstractNode
-    orig_sha256 = value['sha256']
+    """Find the archived copy of a file selected in a registration schema among the
+    files indexed for the registration ``node``. Return ``(file metadata, node guid)``.
+    """
+    from osf.models import RegistrationFileIndex
     orig_name = unescape_entities(
         value['selectedFileName'],
         safe={
@@ -228,13 +190,7 @@ def find_registration_file(value, node):
             '&gt;': '>'
         }
     )
-    orig_node = value['nodeId']
-    file_map = get_file_map(node)
-    for sha256, value, node_id in file_map:
-        registered_from_id = AbstractNode.load(node_id).registered_from._id
-        if sha256 == orig_sha256 and registered_from_id == orig_node and orig_name == value['name']:
-            return value, node_id
-    return None, None
+    return RegistrationFileIndex.lookup(node, value['sha256'], orig_name, value['nodeId'])
 
 def find_registration_files(values, node):
     ret = []
@@ -295,6 +251,8 @@ def deep_get(obj, path):
     return item
 
 def migrate_file_metadata(dst, schema):
+    from osf.models import RegistrationFileIndex
+    RegistrationFileIndex.ensure_built(dst)
     metadata = dst.registered_meta[schema._id]
     missing_files = []
     selected_files = find_selected_files(schema, metadata)
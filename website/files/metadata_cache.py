@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Short-lived cache of WaterButler metadata responses for addon providers.
+
+Entries are keyed by ``(target, provider, path, version, credential fingerprint)``,
+so that a response fetched with one user's credentials is never served to another.
+Every ``(target, provider)`` pair has a generation that is part of the key;
+WaterButler callbacks replace it, which invalidates all cached listings of that
+provider at once. Generations are stored as cache entries with the same timeout,
+so they expire once every listing cached under an older generation has. The
+store is pluggable. Invalidations only reach processes sharing the store, so the
+cache should only be enabled with a shared store such as the Django cache
+backend over Redis or memcached; the local backend keeps entries in process
+memory.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from website import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LocalMetadataCacheBackend(object):
+    """Thread-safe in-process store with per-entry expiry. The least recently used
+    entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + timeout, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DjangoMetadataCacheBackend(object):
+    """Store in the Django cache named by ``WATERBUTLER_METADATA_CACHE_ALIAS``, shared
+    between processes when that cache is. Eviction is left to the cache.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.cache = caches[settings.WATERBUTLER_METADATA_CACHE_ALIAS]
+
+    def __len__(self):
+        # Not tracked by the Django cache API
+        return 0
+
+    @staticmethod
+    def _cache_key(key):
+        return 'wb-metadata:{}'.format(hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.cache.get(self._cache_key(key))
+
+    def set(self, key, value, timeout):
+        self.cache.set(self._cache_key(key), value, timeout)
+
+
+class WaterButlerMetadataCache(object):
+
+    # Log stats after this many lookups
+    STATS_LOG_INTERVAL = 1000
+
+    def __init__(self, backend=None, timeout=None):
+        self.backend = backend or import_string(settings.WATERBUTLER_METADATA_CACHE_BACKEND)(settings.WATERBUTLER_METADATA_CACHE_MAX_ENTRIES)
+        self._timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def timeout(self):
+        return self._timeout if self._timeout is not None else settings.WATERBUTLER_METADATA_CACHE_TIMEOUT
+
+    @property
+    def enabled(self):
+        return self.timeout > 0
+
+    @staticmethod
+    def credential_fingerprint(authorization=None, cookie=None, view_only=None):
+        """Digest of everything WaterButler authorizes a metadata request with."""
+        return hashlib.sha256(
+            '\0'.join(value or '' for value in (authorization, cookie, view_only)).encode('utf-8')
+        ).hexdigest()
+
+    def _key(self, target_id, provider, path, version, fingerprint):
+        generation = self.backend.get(('generation', target_id, provider)) or '0'
+        return (target_id, provider, generation, path, version, fingerprint)
+
+    def get(self, target_id, provider, path, version, fingerprint):
+        """Return the cached response data, or None."""
+        if not self.enabled:
+            return None
+        value = self.backend.get(self._key(target_id, provider, path, version, fingerprint))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if (self.hits + self.misses) % self.STATS_LOG_INTERVAL == 0:
+            logger.info('WaterButler metadata cache stats: {}'.format(self.stats()))
+        # Stored serialized, so callers may modify what they get back
+        return json.loads(value) if value is not None else None
+
+    def set(self, target_id, provider, path, version, fingerprint, data):
+        if self.enabled:
+            self.backend.set(self._key(target_id, provider, path, version, fingerprint), json.dumps(data), self.timeout)
+
+    def invalidate(self, target_id, provider):
+        """Drop every cached response for ``provider`` on ``target_id``."""
+        if not self.enabled:
+            return
+        self.backend.set(('generation', target_id, provider), uuid.uuid4().hex, self.timeout)
+        self.invalidations += 1
+
+    def invalidate_for_payload(self, target_id, payload):
+        """Invalidate the targets and providers changed by a WaterButler callback."""
+        if payload.get('source') and payload.get('destination'):
+            for bundle in (payload['source'], payload['destination']):
+                self.invalidate(bundle.get('nid') or target_id, bundle.get('provider'))
+        else:
+            self.invalidate(target_id, payload.get('provider'))
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+            'invalidations': self.invalidations,
+        }
+
+
+metadata_cache = WaterButlerMetadataCache()
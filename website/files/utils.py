@@ -1,3 +1,180 @@
+import logging
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.db import connection, transaction
+
+from osf.utils.forking import NodeCopyReport
+
+logger = logging.getLogger(__name__)
+
+
+class BulkFileCopier(object):
+    """Copy a file node and its non-trashed descendants to ``target``.
+
+    The source subtree is read once and copied level by level with ``bulk_create``;
+    version relations are written in one batch. If the newest version of a file is
+    stored in a different region than the target's osfstorage region, the copy gets
+    a clone of that version in the target's region and shares all older versions.
+
+    :param BaseFileNode src: The file or folder to copy
+    :param target: The node or preprint to copy to
+    :param Folder parent: The parent of the copy of ``src``, if applicable
+    :param str name: New name for the copy of ``src``
+    """
+    PHASES = ('read_subtree', 'create_file_nodes', 'create_versions', 'update_storage_usage', 'update_search')
+
+    SUBTREE_SQL = """
+        WITH RECURSIVE subtree(id, depth) AS (
+            SELECT %(id)s, 0
+          UNION ALL
+            SELECT T.id, S.depth + 1
+            FROM subtree AS S
+              JOIN "{table}" AS T ON T.parent_id = S.id
+            WHERE NOT T.type = ANY(%(trashed_types)s)
+        )
+        SELECT id, depth FROM subtree;
+    """
+
+    # Fields that are cleared on copies, as in BaseModel.clone
+    CLEARED_FILE_NODE_FIELDS = ('checkout_id', 'deleted_by_id', 'parent_id', 'copied_from_id', 'target_content_type_id', 'target_object_id')
+
+    def __init__(self, src, target, parent=None, name=None):
+        assert not parent or not parent.is_file, 'Parent must be a folder'
+        self.src = src
+        self.target = target
+        self.parent = parent
+        self.name = name
+        self.report = NodeCopyReport()
+
+        self.levels = defaultdict(list)  # depth -> originals
+        self.copies = OrderedDict()  # original pk -> copy
+
+    def run(self):
+        with transaction.atomic():
+            for phase in self.PHASES:
+                with self.report.phase(phase):
+                    getattr(self, phase)()
+        logger.info('Copied {} file nodes from {} in {:.2f}s: {}'.format(
+            len(self.copies), self.src._id, self.report.total, self.report.to_dict()
+        ))
+        cloned = self.copies[self.src.pk]
+        cloned.copy_report = self.report
+        return cloned
+
+    def _clone(self, original):
+        """Return an unsaved copy of ``original`` without refetching it."""
+        values = {
+            field.attname: getattr(original, field.attname)
+            for field in original._meta.concrete_fields
+            if not field.primary_key and field.attname not in self.CLEARED_FILE_NODE_FIELDS
+        }
+        values['_id'] = original._meta.get_field('_id').get_default()
+        cloned = original.__class__(**values)
+        cloned.target = self.target
+        cloned.copied_from = original
+        return cloned
+
+    # Phases
+
+    def read_subtree(self):
+        BaseFileNode = apps.get_model('osf.BaseFileNode')
+        TrashedFileNode = apps.get_model('osf.TrashedFileNode')
+
+        with connection.cursor() as cursor:
+            cursor.execute(self.SUBTREE_SQL.format(table=BaseFileNode._meta.db_table), {
+                'id': self.src.pk,
+                'trashed_types': TrashedFileNode._typedmodels_subtypes,
+            })
+            depths = dict(cursor.fetchall())
+        # Descendants are read in their subclasses; the source is used as passed
+        originals = {self.src.pk: self.src}
+        originals.update({
+            each.pk: each for each in BaseFileNode.objects.filter(id__in=depths).exclude(id=self.src.pk)
+        })
+        for pk, depth in depths.items():
+            self.levels[depth].append(originals[pk])
+        self.report.count('file_nodes', len(originals))
+
+    def create_file_nodes(self):
+        BaseFileNode = apps.get_model('osf.BaseFileNode')
+        OsfStorageFileNode = apps.get_model('osf.OsfStorageFileNode')
+
+        for depth in sorted(self.levels):
+            level = []
+            for original in self.levels[depth]:
+                cloned = self._clone(original)
+                if depth == 0:
+                    cloned.parent = self.parent
+                    cloned.name = self.name or cloned.name
+                else:
+                    cloned.parent = self.copies[original.parent_id]
+                if isinstance(cloned, OsfStorageFileNode):
+                    # What OsfStorageFileNode.save would set
+                    cloned._path = ''
+                    cloned.checkout_count = 0
+                    cloned._materialized_path = cloned._compute_materialized_path()
+                self.copies[original.pk] = cloned
+                level.append(cloned)
+            BaseFileNode.objects.bulk_create(level)
+
+    def create_versions(self):
+        BaseFileNode = apps.get_model('osf.BaseFileNode')
+        FileVersion = apps.get_model('osf.FileVersion')
+        Through = BaseFileNode.versions.through
+
+        versions = defaultdict(list)  # original file pk -> versions, newest first
+        for row in Through.objects.filter(
+            basefilenode_id__in=[pk for pk, cloned in self.copies.items() if cloned.is_file]
+        ).select_related('fileversion').order_by('basefilenode_id', '-fileversion__created'):
+            versions[row.basefilenode_id].append(row.fileversion)
+
+        target_region = None
+        relations, relocated = [], []  # (file node copy, version)
+        for pk, file_versions in versions.items():
+            cloned = self.copies[pk]
+            newest = file_versions[0]
+            if newest.region_id:
+                if target_region is None:
+                    target_region = self.target.osfstorage_region
+                if newest.region_id != target_region.id:
+                    # Share all versions but the newest, which is cloned into the target's region
+                    relations.extend((cloned, version) for version in file_versions[1:])
+                    relocated.append((cloned, self._clone_version(newest, target_region)))
+                    continue
+            relations.extend((cloned, version) for version in file_versions)
+
+        FileVersion.objects.bulk_create([version for _, version in relocated])
+        Through.objects.bulk_create([
+            Through(basefilenode_id=cloned.pk, fileversion_id=version.pk)
+            for cloned, version in relations + relocated
+        ])
+        self.report.count('versions', len(relations) + len(relocated))
+        self.report.count('relocated_versions', len(relocated))
+
+    def _clone_version(self, version, region):
+        FileVersion = apps.get_model('osf.FileVersion')
+        values = {
+            field.attname: getattr(version, field.attname)
+            for field in FileVersion._meta.concrete_fields
+            if not field.primary_key and field.attname not in ('creator_id', 'region_id')
+        }
+        values['_id'] = FileVersion._meta.get_field('_id').get_default()
+        return FileVersion(region=region, **values)
+
+    def update_storage_usage(self):
+        StorageUsage = apps.get_model('osf.StorageUsage')
+        StorageUsage.adjust_for_files([cloned.pk for cloned in self.copies.values() if cloned.is_file], usage_sign=1)
+
+    def update_search(self):
+        from website.search import search
+        OsfStorageFile = apps.get_model('osf.OsfStorageFile')
+
+        # OsfStorageFile.save indexes each file it saves
+        files = [cloned for cloned in self.copies.values() if isinstance(cloned, OsfStorageFile)]
+        if files:
+            search.bulk_update_files(files)
+
 
 def copy_files(src, target_node, parent=None, name=None):
     """Copy the files from src to the target node
@@ -5,31 +182,4 @@ def copy_files(src, target_node, parent=None, name=None):
     :param Node target_node: The node to copy files to
     :param Folder parent: The parent of to attach the clone of src to, if applicable
     """
-    assert not parent or not parent.is_file, 'Parent must be a folder'
-
-    cloned = src.clone()
-    cloned.parent = parent
-    cloned.target = target_node
-    cloned.name = name or cloned.name
-    cloned.copied_from = src
-
-    cloned.save()
-
-    if src.is_file and src.versions.exists():
-        fileversions = src.versions.select_related('region').order_by('-created')
-        most_recent_fileversion = fileversions.first()
-        if most_recent_fileversion.region and most_recent_fileversion.region != target_node.osfstorage_region:
-            # add all original version except the most recent
-            cloned.versions.add(*fileversions[1:])
-            # create a new most recent version and update the region before adding
-            new_fileversion = most_recent_fileversion.clone()
-            new_fileversion.region = target_node.osfstorage_region
-            new_fileversion.save()
-            cloned.versions.add(new_fileversion)
-        else:
-            cloned.versions.add(*src.versions.all())
-    if not src.is_file:
-        for child in src.children:
-            copy_files(child, target_node, parent=cloned)
-
-    return cloned
+    return BulkFileCopier(src, target_node, parent=parent, name=name).run()
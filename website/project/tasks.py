@@ -88,6 +88,24 @@ def _async_update_node_share(self, node_id):
         else:
             send_desk_share_error(node, resp, self.request.retries)
 
+@celery_app.task(bind=True, acks_late=True)
+def fork_node(self, node_id, user_id, title=None):
+    """Fork a node in the background, reporting the completed fork phase as task progress.
+
+    :return: dict with the fork's guid and the per-phase fork report
+    """
+    from framework.auth import Auth
+    AbstractNode = apps.get_model('osf.AbstractNode')
+    OSFUser = apps.get_model('osf.OSFUser')
+    node = AbstractNode.load(node_id)
+    user = OSFUser.load(user_id)
+
+    def progress(phase, completed, total):
+        self.update_state(state='PROGRESS', meta={'phase': phase, 'completed': completed, 'total': total})
+
+    fork = node.fork_node(Auth(user), title=title, progress=progress)
+    return {'fork': fork._id, 'report': fork.fork_report.to_dict()}
+
 def send_share_node_data(data):
     resp = requests.post('{}api/normalizeddata/'.format(settings.SHARE_URL), json=data, headers={'Authorization': 'Bearer {}'.format(settings.SHARE_API_TOKEN), 'Content-Type': 'application/vnd.api+json'})
     logger.debug(resp.content)
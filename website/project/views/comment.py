@@ -40,12 +40,11 @@ def update_file_guid_referent(self, target, event_type, payload, user=None):
         target=source_node
     )
 
-    for guid in file_guids:
-        obj = Guid.load(guid)
-        if source_node != destination_node and Comment.objects.filter(root_target___id=guid).count() != 0:
-            update_comment_node(guid, source_node, destination_node)
+    if source_node != destination_node and Comment.objects.filter(root_target___id__in=file_guids).exists():
+        update_comment_node(file_guids, source_node, destination_node)
 
-        if source['provider'] != destination['provider'] or source['provider'] != 'osfstorage':
+    if source['provider'] != destination['provider'] or source['provider'] != 'osfstorage':
+        for obj in Guid.objects.filter(_id__in=file_guids):
             old_file = BaseFileNode.load(obj.referent._id)
             obj.referent = create_new_file(obj, source, destination, destination_node)
             obj.save()
@@ -99,8 +98,8 @@ def find_and_create_file_from_metadata(children, source, destination, destinatio
             return new_file
 
 
-def update_comment_node(root_target_id, source_node, destination_node):
-    Comment.objects.filter(root_target___id=root_target_id).update(node=destination_node)
+def update_comment_node(root_target_ids, source_node, destination_node):
+    Comment.objects.filter(root_target___id__in=root_target_ids).update(node=destination_node)
     source_node.save()
     destination_node.save()
 
@@ -646,9 +646,10 @@ def update_user(user, index=None):
 
     client().index(index=index, doc_type='user', body=user_doc, id=user._id, refresh=True)
 
-@requires_search
-def update_file(file_, index=None, delete=False):
-    index = index or INDEX
+def serialize_file(file_, delete=False):
+    """Return the search document for ``file_``, or None if it should not be in the index."""
+    if delete:
+        return None
     target = file_.target
 
     # TODO: Can remove 'not file_.name' if we remove all base file nodes with name=None
@@ -657,28 +658,14 @@ def update_file(file_, index=None, delete=False):
     ) or bool(
         set(settings.DO_NOT_INDEX_LIST['tags']).intersection(target.tags.all().values_list('name', flat=True))
     ) or any(substring in target.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
-    if not file_.name or not target.is_public or delete or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
+    if not file_.name or not target.is_public or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
             target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
-        client().delete(
-            index=index,
-            doc_type='file',
-            id=file_._id,
-            refresh=True,
-            ignore=[404]
-        )
-        return
+        return None
 
     if isinstance(target, Preprint):
         if not getattr(target, 'verified_publishable', False) or target.primary_file != file_ or target.is_spam or (
                 target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
-            client().delete(
-                index=index,
-                doc_type='file',
-                id=file_._id,
-                refresh=True,
-                ignore=[404]
-            )
-            return
+            return None
 
     # We build URLs manually here so that this function can be
     # run outside of a Flask request context (e.g. in a celery task)
@@ -698,7 +685,7 @@ def update_file(file_, index=None, delete=False):
         guid_url = '/{file_guid}/'.format(file_guid=file_guid._id)
     # File URL's not provided for preprint files, because the File Detail Page will
     # just reroute to preprints detail
-    file_doc = {
+    return {
         'id': file_._id,
         'deep_url': None if isinstance(target, Preprint) else file_deep_url,
         'guid_url': None if isinstance(target, Preprint) else guid_url,
@@ -713,6 +700,20 @@ def update_file(file_, index=None, delete=False):
         'extra_search_terms': clean_splitters(file_.name),
     }
 
+@requires_search
+def update_file(file_, index=None, delete=False):
+    index = index or INDEX
+    file_doc = serialize_file(file_, delete=delete)
+    if file_doc is None:
+        client().delete(
+            index=index,
+            doc_type='file',
+            id=file_._id,
+            refresh=True,
+            ignore=[404]
+        )
+        return
+
     client().index(
         index=index,
         doc_type='file',
@@ -721,6 +722,21 @@ def update_file(file_, index=None, delete=False):
         refresh=True
     )
 
+@requires_search
+def bulk_update_files(files, index=None, delete=False):
+    """Index or remove ``files`` with a single bulk request."""
+    index = index or INDEX
+    actions = []
+    for file_ in files:
+        file_doc = serialize_file(file_, delete=delete)
+        if file_doc is None:
+            actions.append({'_op_type': 'delete', '_index': index, '_type': 'file', '_id': file_._id})
+        else:
+            actions.append({'_op_type': 'index', '_index': index, '_type': 'file', '_id': file_._id, '_source': file_doc})
+    if actions:
+        # Files missing from the index are expected when removing
+        helpers.bulk(client(), actions, refresh=True, raise_on_error=False)
+
 @requires_search
 def update_institution(institution, index=None):
     index = index or INDEX
@@ -99,6 +99,11 @@ def update_file(file_, index=None, delete=False):
     index = index or settings.ELASTIC_INDEX
     search_engine.update_file(file_, index=index, delete=delete)
 
+@requires_search
+def bulk_update_files(files, index=None, delete=False):
+    index = index or settings.ELASTIC_INDEX
+    search_engine.bulk_update_files(files, index=index, delete=delete)
+
 @requires_search
 def update_institution(institution, index=None):
     index = index or settings.ELASTIC_INDEX
@@ -112,6 +112,24 @@ ELASTIC_KWARGS = {
     # 'client_key': None
 }
 
+# Number of verified-unique guids generated per refill of the guid pool
+GUID_POOL_BATCH_SIZE = 100
+# Seconds after which unused pooled guids are discarded and re-verified
+GUID_POOL_MAX_AGE = 60
+
+# Reuse model instances loaded via `load` within a single request
+ENABLE_IDENTITY_MAP = False
+
+# WaterButler metadata responses for addon providers are cached per user
+WATERBUTLER_METADATA_CACHE_BACKEND = 'website.files.metadata_cache.LocalMetadataCacheBackend'
+# Django cache used by website.files.metadata_cache.DjangoMetadataCacheBackend
+WATERBUTLER_METADATA_CACHE_ALIAS = 'default'
+# Maximum number of cached responses
+WATERBUTLER_METADATA_CACHE_MAX_ENTRIES = 10000
+# Seconds a response is served from the cache; 0 disables caching. Only enable with a
+# backend shared by the web and API processes, or invalidations will not reach all of them
+WATERBUTLER_METADATA_CACHE_TIMEOUT = 0
+
 # Sessions
 COOKIE_NAME = 'osf'
 # TODO: Override OSF_COOKIE_DOMAIN in local.py in production
@@ -349,6 +367,19 @@ MAX_ARCHIVE_SIZE = 5 * 1024 ** 3  # == math.pow(1024, 3) == 1 GB
 
 ARCHIVE_TIMEOUT_TIMEDELTA = timedelta(1)  # 24 hours
 
+# Limits for crawling addon file trees, per provider: concurrent WaterButler
+# metadata requests and requests per second
+ARCHIVER_CRAWL_LIMITS = {
+    'default': {'concurrency': 4, 'rate': 20},
+    'github': {'concurrency': 2, 'rate': 10},
+}
+# Registrations in a tree that are statted and copied at the same time
+ARCHIVER_MAX_CONCURRENT_NODES = 4
+# Retries of a failed folder listing (429, 5xx, connection errors)
+ARCHIVER_CRAWL_MAX_RETRIES = 3
+# Seconds before the first retry, doubled for each further retry
+ARCHIVER_CRAWL_BACKOFF = 1.0
+
 ENABLE_ARCHIVER = True
 
 JWT_SECRET = 'changeme'
@@ -446,6 +477,7 @@ class CeleryConfig:
 
     # Modules to import when celery launches
     imports = (
+        'framework.analytics.tasks',
         'framework.celery_tasks',
         'framework.email.tasks',
         'website.mailchimp_utils',
@@ -490,6 +522,14 @@ class CeleryConfig:
         #  Setting up a scheduler, essentially replaces an independent cron job
         # Note: these times must be in UTC
         beat_schedule = {
+            'flush_user_activity_counters': {
+                'task': 'framework.analytics.tasks.flush_user_activity_counters',
+                'schedule': crontab(minute='*'),  # Every minute
+            },
+            'rollup_page_views': {
+                'task': 'framework.analytics.tasks.rollup_page_views',
+                'schedule': crontab(minute='*'),  # Every minute
+            },
             '5-minute-emails': {
                 'task': 'website.notifications.tasks.send_users_email',
                 'schedule': crontab(minute='*/5'),